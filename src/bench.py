@@ -0,0 +1,340 @@
+"""Benchmarks of the hot paths and detection of performance regressions."""
+import logging
+log = logging.getLogger("stockbro")
+
+import json
+import os
+import pathlib
+import resource
+import sys
+import threading
+import time
+import typing
+
+DEFAULT_REPEAT = 20  # passes over the extraction corpus and the recorded feeds
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)  # numbers of items stored by the database benchmarks
+DEFAULT_THRESHOLD = 0.2  # relative deterioration of a metric considered a regression
+BASELINE_PATH = pathlib.Path("bench/baseline.json")
+CORPUS_PATH = pathlib.Path("test/extract-fulltext")  # '<name>.html' files whose first line is the URL
+FEEDS_PATH = pathlib.Path("test/parse-feed")  # recorded feeds '<name>.xml'
+FEEDS_SCHEMA = pathlib.Path("db/rss-feeds.schema")
+ITEMS_PER_FEED = 1000  # items of each synthetic feed served to the database benchmarks
+
+# Metrics compared against the baseline and whether higher values are better
+METRICS = {"throughput": True, "p50": False, "p99": False, "peak_rss": False}
+
+
+class Result(typing.NamedTuple):
+    """Outcome of a benchmark, see *run*."""
+
+    name: str  # e.g. 'extract_fulltext' or 'feeds_to_database[100000]'
+    unit: str  # what is counted, e.g. 'docs' or 'items'
+    count: int  # units processed in total
+    seconds: float  # total time spent processing
+    p50: float  # median seconds per operation (document, feed download, ...)
+    p99: float  # 99th percentile of seconds per operation
+    peak_rss: int  # peak resident set size of the benchmark's process in bytes
+
+    @property
+    def throughput(self) -> float:
+        """Units processed per second."""
+        return self.count / self.seconds if self.seconds > 0 else 0.0
+
+
+def run(names: list = None, repeat: int = DEFAULT_REPEAT, sizes: list = DEFAULT_SIZES) -> list:
+    """Run benchmarks, each one in a fresh process.
+
+    Every benchmark runs in its own spawned process, such that its peak
+    memory usage is not inflated by its predecessors and lazily imported
+    modules are loaded anew. Feeds are served by a local HTTP server running
+    in this process, such that download and parsing are measured without
+    network delays and without hitting any real host.
+
+    - *extract_fulltext* and *cleanup_by_tld*: the documents of
+      *CORPUS_PATH*, processed *repeat* times. Latency is per document.
+    - *feeds_to_dataframe*: all recorded feeds of *FEEDS_PATH*, downloaded
+      and parsed *repeat* times. Latency is per pass over all feeds.
+    - *feeds_to_database[N]*: N synthetic items stored into a new feeds
+      database, one feed of *ITEMS_PER_FEED* items per call, like repeated
+      fetches into a growing table. Latency is per call.
+    - *parse_dates[N]*: N synthetic publication dates parsed into UNIX
+      time, one feed of *ITEMS_PER_FEED* dates per call. Feeds use different
+      formats. Latency is per call.
+
+    Parameters
+    ----------
+    names: list of str (optional)
+        Prefixes of the benchmarks to run, e.g. ['extract', 'feeds_to_database'].
+        All benchmarks are run if None.
+
+    repeat: int (optional)
+        Passes over the corpus and the recorded feeds.
+
+    sizes: list of int (optional)
+        Numbers of items stored by the database benchmarks.
+
+    Returns
+    -------
+    list of Result
+        Results in the order the benchmarks were run.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    server = _serve_feeds()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    jobs = [("extract_fulltext", _bench_extract_fulltext, (repeat,)),
+            ("cleanup_by_tld", _bench_cleanup_by_tld, (repeat,)),
+            ("feeds_to_dataframe", _bench_feeds_to_dataframe, (base_url, repeat))]
+    jobs += [(f"feeds_to_database[{size}]", _bench_feeds_to_database, (base_url, size)) for size in sizes]
+    jobs += [(f"parse_dates[{size}]", _bench_parse_dates, (size,)) for size in sizes]
+    results = []
+    try:
+        for name, function, args in jobs:
+            if names and not any(name.startswith(prefix) for prefix in names):
+                continue
+            log.info(f"Running benchmark '{name}' ...")
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results.append(executor.submit(_measure, name, function, args).result())
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def compare(results: list, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """Return regressions of results compared to a baseline.
+
+    A metric regressed if it is more than *threshold* (relative) worse than
+    in the baseline, see *METRICS*. Benchmarks missing from the baseline are
+    not compared.
+
+    Parameters
+    ----------
+    results: list of Result
+        Results of the current run.
+
+    baseline: dict
+        Baseline as returned by *load_baseline*.
+
+    threshold: float (optional)
+        Tolerated relative deterioration, e.g. 0.2 for 20%.
+
+    Returns
+    -------
+    list of str
+        Description of each regressed metric, e.g. "extract_fulltext: p99
+        0.0061 -> 0.0094 (+54%)". Empty if nothing regressed.
+    """
+    regressions = []
+    for result in results:
+        reference = baseline.get(result.name)
+        if reference is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            before, after = reference[metric], getattr(result, metric)
+            if before <= 0:
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(f"{result.name}: {metric} {before:.4g} -> {after:.4g} ({change:+.0%})")
+    return regressions
+
+
+def load_baseline(path: pathlib.Path = BASELINE_PATH) -> dict:
+    """Return baseline saved by *save_baseline* as dict of benchmark name -> metrics, {} if there is none."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results: list, path: pathlib.Path = BASELINE_PATH):
+    """Store results as baseline. Benchmarks of an existing baseline which were not run are kept."""
+    baseline = load_baseline(path)
+    baseline.update({result.name: {**result._asdict(), "throughput": result.throughput} for result in results})
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def report(results: list, baseline: dict = None):
+    """Print results as table, including the change of throughput relative to the baseline."""
+    baseline = baseline or {}
+    print(f"{'benchmark':28s} {'count':>9s} {'throughput':>16s} {'p50 ms':>9s} {'p99 ms':>9s} "
+          f"{'peak RSS':>9s} {'vs. base':>8s}")
+    for result in results:
+        reference = baseline.get(result.name)
+        change = f"{result.throughput / reference['throughput'] - 1:+.0%}" if reference else ""
+        print(f"{result.name:28s} {result.count:9d} {result.throughput:10.0f} {result.unit + '/s':5s} "
+              f"{result.p50 * 1000:9.2f} {result.p99 * 1000:9.2f} {result.peak_rss / 2**20:6.0f} MiB "
+              f"{change:>8s}")
+
+
+def percentile(samples: list, q: float) -> float:
+    """Return the *q*-th percentile (0 <= q <= 100) of samples using the nearest-rank method."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * q // 100))  # ceiling without float rounding issues
+    return ordered[int(rank) - 1]
+
+
+def synthetic_feed(page: int, items: int = ITEMS_PER_FEED) -> bytes:
+    """Return an RSS feed of distinct items resembling those of finanznachrichten.de.
+
+    Items of different pages are distinct too, such that each page adds
+    *items* new rows to the database.
+    """
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0"><channel>'
+             f"<title>Benchmark {page}</title><link>https://example.org/</link>"
+             "<description>Synthetic feed</description>"]
+    from xml.sax.saxutils import escape
+    description = escape("Die Aktie ist zuletzt unter Druck geraten. <b>Worauf</b> Anleger jetzt achten "
+                         "müssen & was Analysten erwarten ...")
+    for ii in range(page * ITEMS_PER_FEED, page * ITEMS_PER_FEED + items):
+        parts.append(f"<item><title>Chart-Check Aktie {ii}: Diese Marke muss heute halten</title>"
+                     f"<link>https://example.org/nachrichten/{ii}-chart-check-diese-marke-muss-halten.htm</link>"
+                     f'<guid isPermaLink="false">{ii}</guid>'
+                     f"<pubDate>Fri, 05 Mar 2021 09:41:00 +0100</pubDate>"
+                     f"<description>{description}</description>"
+                     "</item>")
+    parts.append("</channel></rss>")
+    return "".join(parts).encode("utf-8")
+
+
+def _measure(name, function, args) -> Result:
+    """Run a benchmark function in a spawned worker and add its peak memory usage."""
+    unit, count, samples = function(*args)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss *= 1 if sys.platform == "darwin" else 1024  # bytes on macOS, KiB elsewhere
+    return Result(name, unit, count, sum(samples), percentile(samples, 50), percentile(samples, 99), peak_rss)
+
+
+def _corpus() -> list:
+    """Return (url, html) of each document of the extraction corpus."""
+    documents = []
+    for path in sorted(CORPUS_PATH.glob("*.html")):
+        url, html = path.read_text(encoding="utf-8").split("\n", 1)
+        documents.append((url, html))
+    return documents
+
+
+def _time_documents(function, documents, repeat) -> list:
+    """Return seconds spent by *function* on each document. A first untimed pass warms up caches and imports."""
+    samples = []
+    for timed in [False] + [True] * repeat:
+        for document in documents:
+            start = time.perf_counter()
+            try:
+                function(*document)
+            except NotImplementedError:
+                pass
+            if timed:
+                samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _bench_extract_fulltext(repeat):
+    from src import rss
+    documents = _corpus()
+    return "docs", len(documents) * repeat, _time_documents(rss.extract_fulltext, documents, repeat)
+
+
+def _bench_cleanup_by_tld(repeat):
+    from src import domains
+    from src import rss
+    documents = [(html, domains.registered_domain(url)) for url, html in _corpus()]
+    documents = [(html, tld) for html, tld in documents if getattr(rss.EXTRACTORS.get(tld), "cleanup", None)]
+    return "docs", len(documents) * repeat, _time_documents(rss.cleanup_by_tld, documents, repeat)
+
+
+def _bench_feeds_to_dataframe(base_url, repeat):
+    from src import rss
+    from src import throttle
+    throttle.configure(rate=1e9, burst=10**9)  # measure the code, not the politeness
+    urls = [f"{base_url}/recorded/{path.stem}" for path in sorted(FEEDS_PATH.glob("*.xml"))]
+    rss.feeds_to_dataframe(urls)  # warm up
+    count, samples = 0, []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count += len(rss.feeds_to_dataframe(urls))
+        samples.append(time.perf_counter() - start)
+    return "items", count, samples
+
+
+def _bench_feeds_to_database(base_url, size):
+    from src import pipeline
+    from src import rss
+    from src import throttle
+    from src import util
+    import tempfile
+    throttle.configure(rate=1e9, burst=10**9)  # measure the code, not the politeness
+    count, samples = 0, []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dbpath = pathlib.Path(tmpdir) / "rss-feeds.db"
+        util.connect_db(dbpath, FEEDS_SCHEMA)
+        for page in range(-(-size // ITEMS_PER_FEED)):
+            url = f"{base_url}/synthetic/{page}?items={min(ITEMS_PER_FEED, size - page * ITEMS_PER_FEED)}"
+            start = time.perf_counter()
+            count += rss.feeds_to_database([url], dbpath, "items", pipeline.ITEM_TAGS, pipeline.ITEM_KEYS)
+            samples.append(time.perf_counter() - start)
+        util.close_dbs()
+    return "items", count, samples
+
+
+def _bench_parse_dates(size):
+    from src import dates
+    formats = ("%a, %d %b %Y %H:%M:%S +0100", "%a, %d %b %Y %H:%M:%S GMT", "%Y-%m-%dT%H:%M:%SZ")
+    count, samples = 0, []
+    for page in range(-(-size // ITEMS_PER_FEED)):
+        items = min(ITEMS_PER_FEED, size - page * ITEMS_PER_FEED)
+        fmt = formats[page % len(formats)]
+        values = [time.strftime(fmt, time.gmtime(1614933660 + 60 * ii)) for ii in range(items)]
+        start = time.perf_counter()
+        count += sum(published is not None for published in dates.parse(values, f"feed{page % 10}"))
+        samples.append(time.perf_counter() - start)
+    return "dates", count, samples
+
+
+def _serve_feeds():
+    """Start a local HTTP server in a daemon thread and return it.
+
+    It serves '/recorded/<name>' from *FEEDS_PATH* and
+    '/synthetic/<page>?items=<n>', see *synthetic_feed*.
+    """
+    import http.server
+
+    class FeedHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep connections alive like real servers
+        disable_nagle_algorithm = True  # headers and body are written separately
+
+        def do_GET(self):
+            path, _, query = self.path.partition("?")
+            parts = path.strip("/").split("/")
+            body = None
+            if len(parts) == 2 and parts[0] == "recorded":
+                feed = FEEDS_PATH / f"{os.path.basename(parts[1])}.xml"
+                if feed.is_file():
+                    body = feed.read_bytes()
+            elif len(parts) == 2 and parts[0] == "synthetic" and parts[1].isdigit():
+                items = dict(pair.partition("=")[::2] for pair in query.split("&") if pair).get("items", "")
+                body = synthetic_feed(int(parts[1]), int(items) if items.isdigit() else ITEMS_PER_FEED)
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/rss+xml; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="bench-server", daemon=True).start()
+    return server
@@ -0,0 +1,150 @@
+"""Compressed, content-addressed storage of raw HTML."""
+import logging
+log = logging.getLogger("stockbro")
+
+import hashlib
+import sqlite3
+import zlib
+
+from src import util
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+CODECS = ("zlib", "zstd", "none")
+DEFAULT_CODEC = "zlib"
+DEFAULT_LEVEL = 6  # compression level; zlib: 0-9, zstd: 1-22
+
+CREATE_BLOBS_TABLE = """
+    CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT,  -- SHA-256 of the uncompressed content
+        codec TEXT, -- compression codec, see CODECS
+        data BLOB,  -- compressed content
+        PRIMARY KEY (hash)
+    )"""
+
+
+def compress(data: bytes, codec: str = DEFAULT_CODEC, level: int = DEFAULT_LEVEL) -> bytes:
+    """Compress bytes using the given codec."""
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    elif codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Codec 'zstd' requires the 'zstandard' package.")
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    elif codec == "none":
+        return data
+    raise ValueError(f"Unknown codec '{codec}'.")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    """Decompress bytes compressed by *compress*."""
+    if codec == "zlib":
+        return zlib.decompress(data)
+    elif codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Codec 'zstd' requires the 'zstandard' package.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "none":
+        return data
+    raise ValueError(f"Unknown codec '{codec}'.")
+
+
+def put(conn: sqlite3.Connection, text: str, codec: str = DEFAULT_CODEC, level: int = DEFAULT_LEVEL) -> str:
+    """Store text in the 'blobs' table and return its hash.
+
+    Text is keyed by the SHA-256 of its UTF-8 encoding. Identical texts are
+    stored only once; storing a known text costs a hash computation and a
+    primary key lookup. Concurrent writers may store the same text. The
+    caller is responsible for committing.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to a database containing the 'blobs' table.
+
+    text: str
+        Text to store, e.g. an article's raw HTML.
+
+    codec: str (optional)
+        Compression codec. One of "zlib", "zstd" (requires the 'zstandard'
+        package) or "none".
+
+    level: int (optional)
+        Compression level passed to the codec.
+
+    Returns
+    -------
+    str
+        Hash of the text, which is the key to retrieve it by.
+    """
+    data = text.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    if conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone() is None:
+        # Another writer may store the same text between the lookup and the insert.
+        conn.execute("INSERT OR IGNORE INTO blobs (hash, codec, data) VALUES (?, ?, ?)",
+                     (digest, codec, compress(data, codec, level)))
+    return digest
+
+
+def get(conn: sqlite3.Connection, digest: str) -> str:
+    """Return text stored by *put* or None if the hash is unknown."""
+    row = conn.execute("SELECT codec, data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+    if row is None:
+        return None
+    return decompress(row[1], row[0]).decode("utf-8")
+
+
+def migrate_html_table(conn: sqlite3.Connection, codec: str = DEFAULT_CODEC, level: int = DEFAULT_LEVEL) -> int:
+    """Move raw HTML of a legacy 'html' table into the 'blobs' table.
+
+    Databases created from earlier schemas store uncompressed HTML in the
+    'html' column of the 'html' table. This function stores each page via
+    *put* and rebuilds the 'html' table to reference pages by their hash in
+    the 'html_hash' column. The migration is a single transaction. Calling
+    this function on a migrated database only creates the 'blobs' table if
+    necessary. Run 'VACUUM' afterwards to reclaim the freed space.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the feeds database.
+
+    codec: str (optional)
+        Compression codec, see *put*.
+
+    level: int (optional)
+        Compression level, see *put*.
+
+    Returns
+    -------
+    int
+        Number of migrated rows.
+    """
+    conn.execute(CREATE_BLOBS_TABLE)
+    conn.commit()
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(html)")]
+    if "html" not in columns:
+        return 0
+
+    log.info("Migrating raw HTML to compressed blob storage ...")
+    count = 0
+    with util.transaction(conn):  # includes DDL statements
+        conn.execute("""
+            CREATE TABLE html_migrated (
+                rss_guid TEXT,
+                rss_link TEXT,
+                dest_url TEXT,
+                html_hash TEXT,
+                PRIMARY KEY (rss_guid, rss_link)
+            )""")
+        for rss_guid, rss_link, dest_url, html in conn.execute("SELECT rss_guid, rss_link, dest_url, html FROM html"):
+            digest = put(conn, html, codec, level) if html is not None else None
+            conn.execute("INSERT INTO html_migrated VALUES (?, ?, ?, ?)", (rss_guid, rss_link, dest_url, digest))
+            count += 1
+        conn.execute("DROP TABLE html")
+        conn.execute("ALTER TABLE html_migrated RENAME TO html")
+    log.info(f"Migrated {count} rows. Run 'VACUUM' on the database to reclaim space.")
+    return count
@@ -0,0 +1,331 @@
+"""Recording of HTTP responses and their replay by a local stand-in server."""
+import logging
+log = logging.getLogger("stockbro")
+
+import copy
+import functools
+import json
+import random
+import sqlite3
+import threading
+import time
+import typing
+import urllib.parse
+
+from src import blobs
+from src import util
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+CHUNK_SIZE = 16 * 1024  # bytes written at once when the stand-in server limits bandwidth
+ATOM_NAMESPACE = "http://www.w3.org/2005/Atom"
+
+# Headers describing the transfer rather than the content. Bodies are stored
+# decoded, so these are recomputed when replaying.
+HOP_HEADERS = {"connection", "content-encoding", "content-length", "keep-alive", "transfer-encoding"}
+
+CREATE_RESPONSES_TABLE = """
+    CREATE TABLE IF NOT EXISTS responses (
+        url TEXT,           -- requested URL without fragment
+        status INTEGER,     -- HTTP status code, e.g. 200 or 302
+        reason TEXT,        -- HTTP reason phrase, e.g. 'OK'
+        headers TEXT,       -- JSON object of response headers
+        codec TEXT,         -- compression codec of body, see blobs.CODECS
+        body BLOB,          -- compressed, decoded body
+        recorded_at INTEGER, -- UNIX time of recording; later recordings replace earlier ones
+        PRIMARY KEY (url)
+    )"""
+
+
+class Response(typing.NamedTuple):
+    """Recorded HTTP response, see *store* and *load*."""
+
+    url: str
+    status: int
+    reason: str
+    headers: dict
+    body: bytes
+
+
+def record(path):
+    """Store every response received via *util.http_session* in the cassette at *path*.
+
+    Requests are still sent to their real hosts. Bodies of streamed
+    responses are transferred in full, such that they can be replayed.
+    """
+    create_cassette(util.connect_db(path))
+    _configure("record", str(path))
+
+
+def replay(address: str):
+    """Send every request made via *util.http_session* to the stand-in server at *address*.
+
+    The stand-in server, see *serve*, answers with the recorded response of
+    the original URL. Responses carry their original URLs, and redirects are
+    followed by the session as usual, such that callers can't tell replayed
+    responses apart from real ones.
+
+    Parameters
+    ----------
+    address: str
+        Base URL of the stand-in server, e.g. 'http://127.0.0.1:8765'.
+    """
+    _configure("replay", address.rstrip("/"))
+
+
+def reset():
+    """Send requests to their real hosts again without recording them."""
+    _configure(None, None)
+
+
+def adapter(pool_size: int):
+    """Return a transport adapter for a new session of *util.http_session*.
+
+    Depending on the mode set by *record* or *replay*, the adapter records
+    responses or redirects requests to the stand-in server.
+    """
+    import requests
+    if _mode == "record":
+        return _adapter_classes()[0](_target, pool_connections=1, pool_maxsize=pool_size)
+    if _mode == "replay":
+        return _adapter_classes()[1](_target, pool_connections=1, pool_maxsize=pool_size)
+    return requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+
+
+def create_cassette(conn: sqlite3.Connection):
+    """Create the 'responses' table if it does not exist."""
+    with util.transaction(conn):
+        conn.execute(CREATE_RESPONSES_TABLE)
+
+
+def store(conn: sqlite3.Connection, response: Response, codec: str = blobs.DEFAULT_CODEC):
+    """Store a response in the cassette, replacing an earlier recording of its URL."""
+    headers = {name: value for name, value in response.headers.items() if name.lower() not in HOP_HEADERS}
+    with util.transaction(conn):
+        conn.execute("INSERT OR REPLACE INTO responses (url, status, reason, headers, codec, body, recorded_at) "
+                     "VALUES (?, ?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))",
+                     (_strip_fragment(response.url), response.status, response.reason, json.dumps(headers),
+                      codec, blobs.compress(response.body, codec)))
+
+
+def load(conn: sqlite3.Connection) -> dict:
+    """Return all responses of a cassette as dict of URL -> Response."""
+    return {url: Response(url, status, reason, json.loads(headers), blobs.decompress(body, codec))
+            for url, status, reason, headers, codec, body
+            in conn.execute("SELECT url, status, reason, headers, codec, body FROM responses")}
+
+
+def multiply_feed(body: bytes, copies: int, generation: int) -> bytes:
+    """Return an RSS or Atom feed whose items are each replaced by *copies* distinct copies.
+
+    The guid and link of each copy get the fragment '#<generation>-<copy>'
+    appended. Fragments are not sent in requests, so the copies' links still
+    resolve to the recorded articles, but they are stored as separate items.
+    Pass a new *generation* for every download of a feed to make all of its
+    items new. Bodies which aren't feeds are returned unchanged.
+    """
+    if b"<rss" not in body[:1024] and b"<feed" not in body[:1024]:
+        return body
+    from lxml import etree
+    try:
+        root = etree.fromstring(body, etree.XMLParser(recover=True, resolve_entities=False, no_network=True))
+    except etree.XMLSyntaxError:
+        return body
+    if root is None:
+        return body
+    items = list(root.iter("item", f"{{{ATOM_NAMESPACE}}}entry"))
+    if not items:
+        return body
+    for item in items:
+        parent = item.getparent()
+        index = parent.index(item)
+        for ii in range(copies):
+            item_copy = copy.deepcopy(item)
+            fragment = f"#{generation}-{ii}"
+            for tag in ("guid", "link", f"{{{ATOM_NAMESPACE}}}id"):
+                for element in item_copy.findall(tag):
+                    if element.text and element.text.strip():
+                        element.text = element.text.strip() + fragment
+            for element in item_copy.findall(f"{{{ATOM_NAMESPACE}}}link"):
+                if element.get("href"):
+                    element.set("href", element.get("href") + fragment)
+            parent.insert(index + 1 + ii, item_copy)
+        parent.remove(item)
+    return etree.tostring(root.getroottree(), xml_declaration=True, encoding="utf-8")
+
+
+def serve(path, stop: threading.Event, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, latency: float = 0.0,
+          error_rate: float = 0.0, bandwidth: float = None, copies: int = 1):
+    """Replay the responses of a cassette over HTTP until *stop* is set.
+
+    The server expects requests for '/<quoted original URL>', as sent by
+    sessions in *replay* mode. Unknown URLs are answered with 404. All
+    responses are read into memory on startup.
+
+    Parameters
+    ----------
+    path: pathlib.Path or str
+        Path of the cassette, see *record*.
+
+    stop: threading.Event
+        Event to shut down the server.
+
+    host, port: str, int (optional)
+        Address to listen on. Port 0 picks a free port.
+
+    latency: float (optional)
+        Mean seconds before a response is sent. Each response is delayed by
+        50% to 150% of it.
+
+    error_rate: float (optional)
+        Fraction of requests answered with 503 (Service Unavailable).
+
+    bandwidth: float (optional)
+        Bytes per second at which each body is sent. Unlimited if None.
+
+    copies: int (optional)
+        If greater than 1, every item of a feed is served as this many
+        items, which are new on every download of the feed, see
+        *multiply_feed*. Multiplied feeds are sent without validators, such
+        that they are never reported as unchanged.
+
+    Returns
+    -------
+    http.server.ThreadingHTTPServer
+        The server after it has been shut down; its 'server_address' holds
+        the actual port.
+    """
+    server = start_server(path, host, port, latency, error_rate, bandwidth, copies)
+    log.info(f"Replaying {len(server.responses)} responses at http://{server.server_address[0]}:"
+             f"{server.server_address[1]} ...")
+    try:
+        while not stop.wait(1):
+            pass
+    finally:
+        server.shutdown()
+        server.server_close()
+    return server
+
+
+def start_server(path, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, latency: float = 0.0,
+                 error_rate: float = 0.0, bandwidth: float = None, copies: int = 1):
+    """Start the stand-in server of *serve* in a daemon thread and return it. Call its 'shutdown' method to stop."""
+    import http.server
+
+    conn = util.connect_db(path)
+    create_cassette(conn)
+    responses = load(conn)
+    generations = {}  # url -> number of times a multiplied feed has been served
+    lock = threading.Lock()
+
+    class ReplayHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = _strip_fragment(urllib.parse.unquote(self.path[1:]))
+            if latency > 0:
+                time.sleep(latency * random.uniform(0.5, 1.5))
+            if random.random() < error_rate:
+                self._send(503, "Service Unavailable", {}, b"")
+                return
+            response = responses.get(url)
+            if response is None:
+                log.warning(f"No recorded response for '{url}'.")
+                self._send(404, "Not Found", {}, b"")
+                return
+            headers, body = dict(response.headers), response.body
+            if copies > 1 and response.status == 200:
+                with lock:
+                    generation = generations[url] = generations.get(url, 0) + 1
+                multiplied = multiply_feed(body, copies, generation)
+                if multiplied is not body:
+                    body = multiplied
+                    headers = {name: value for name, value in headers.items()
+                               if name.lower() not in ("etag", "last-modified")}
+            elif _not_modified(self.headers, headers):
+                self._send(304, "Not Modified", headers, b"")
+                return
+            self._send(response.status, response.reason, headers, body)
+
+        def _send(self, status, reason, headers, body):
+            self.send_response(status, reason)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if bandwidth is None:
+                self.wfile.write(body)
+                return
+            for offset in range(0, len(body), CHUNK_SIZE):
+                chunk = body[offset:offset + CHUNK_SIZE]
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / bandwidth)
+
+        def log_message(self, format, *args):
+            log.debug(f"Stand-in server: {format % args}")
+
+    server = http.server.ThreadingHTTPServer((host, port), ReplayHandler)
+    server.daemon_threads = True
+    server.responses = responses
+    threading.Thread(target=server.serve_forever, name="cassette-server", daemon=True).start()
+    return server
+
+
+def _configure(mode, target):
+    global _mode, _target
+    _mode, _target = mode, target
+    util.close_http_sessions()  # new sessions pick up the mode
+
+
+def _strip_fragment(url: str) -> str:
+    return urllib.parse.urldefrag(url)[0]
+
+
+def _not_modified(request_headers, headers: dict) -> bool:
+    """Return True if a conditional request's validators match the recorded headers."""
+    headers = {name.lower(): value for name, value in headers.items()}
+    etag = request_headers.get("If-None-Match")
+    if etag is not None:
+        return etag == headers.get("etag")
+    modified_since = request_headers.get("If-Modified-Since")
+    return modified_since is not None and modified_since == headers.get("last-modified")
+
+
+@functools.lru_cache(maxsize=None)
+def _adapter_classes():
+    """Return the recording and the replaying adapter classes. Defined lazily, as requests is slow to import."""
+    import requests
+
+    class RecordingAdapter(requests.adapters.HTTPAdapter):
+        def __init__(self, path, **kwargs):
+            super().__init__(**kwargs)
+            self.path = path
+
+        def send(self, request, **kwargs):
+            response = super().send(request, **kwargs)
+            if request.method == "GET":
+                store(util.connect_db(self.path), Response(request.url, response.status_code, response.reason or "",
+                                                           dict(response.headers), response.content))
+            return response
+
+    class ReplayAdapter(requests.adapters.HTTPAdapter):
+        def __init__(self, address, **kwargs):
+            super().__init__(**kwargs)
+            self.address = address
+
+        def send(self, request, **kwargs):
+            url = request.url
+            request.url = f"{self.address}/{urllib.parse.quote(_strip_fragment(url), safe='')}"
+            try:
+                response = super().send(request, **kwargs)
+            finally:
+                request.url = url
+            response.url = url
+            return response
+
+    return RecordingAdapter, ReplayAdapter
+
+
+_mode = None  # None, "record" or "replay", see _configure()
+_target = None  # cassette path when recording, address of the stand-in server when replaying
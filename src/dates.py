@@ -0,0 +1,252 @@
+"""Normalization of RSS publication dates to UTC."""
+import logging
+log = logging.getLogger("stockbro")
+
+import calendar
+import datetime
+import email.utils
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from src import util
+
+# Formats of publication dates in the wild, see *parse*. Dates are matched
+# as a whole, apart from surrounding whitespace.
+FORMATS = {
+    # RFC 822 as required for RSS, e.g. 'Fri, 05 Mar 2021 09:41:00 +0100'.
+    # Weekday and seconds are optional.
+    "rfc822": re.compile(r"\s*(?:[^\W\d]+,\s*)?(?P<day>\d{1,2})\s+(?P<month>[^\W\d]+)\.?\s+(?P<year>\d{2,4})"
+                         r"\s+(?P<hour>\d{1,2}):(?P<minute>\d\d)(?::(?P<second>\d\d))?"
+                         r"\s*(?P<zone>[+-]\d{4}|[A-Za-z]+)?\s*"),
+    # ISO 8601 as used by Atom, e.g. '2021-03-05T18:30:02+01:00'. Fractions of
+    # seconds are ignored.
+    "iso8601": re.compile(r"\s*(?P<year>\d{4})-(?P<month>\d\d)-(?P<day>\d\d)(?:[T ](?P<hour>\d\d):(?P<minute>\d\d)"
+                          r"(?::(?P<second>\d\d)(?:[.,]\d+)?)?)?\s*(?P<zone>Z|[+-]\d\d:?\d\d)?\s*"),
+}
+# Month names, including German abbreviations differing from English ones
+MONTHS = {name: ii + 1 for ii, name in enumerate(["jan", "feb", "mar", "apr", "may", "jun",
+                                                  "jul", "aug", "sep", "oct", "nov", "dec"])}
+MONTHS.update({"mär": 3, "mrz": 3, "mai": 5, "okt": 10, "dez": 12})
+# UTC offsets in minutes of zone names; dates with other names are left to email.utils
+ZONES = {"z": 0, "ut": 0, "utc": 0, "gmt": 0, "est": -300, "edt": -240, "cst": -360, "cdt": -300, "mst": -420,
+         "mdt": -360, "pst": -480, "pdt": -420, "cet": 60, "cest": 120, "mez": 60, "mesz": 120}
+ISO_FORMAT = "%Y-%m-%dT%H:%M:%SZ"  # format of normalized dates, which sort chronologically as strings
+
+# Publication dates as UNIX time, such that time ranges are selected by
+# index. Databases created before are migrated by *create_columns*.
+CREATE_ITEMS_INDEX = """
+    CREATE INDEX IF NOT EXISTS items_published ON items (rss_published)"""
+CREATE_TEXTS_INDEX = """
+    CREATE INDEX IF NOT EXISTS texts_published ON texts (published)"""
+
+
+def parse(values: list, feed: str = None) -> list:
+    """Parse publication dates in bulk and return them as UNIX time.
+
+    Each format of *FORMATS* is applied to all dates not parsed yet in turn.
+    The order in which formats matched is remembered per feed, such that
+    dates of a known feed are usually parsed by a single pass of its format.
+    Dates matching none of the formats are left to *email.utils*, which is
+    more lenient but slower. Dates without zone are taken as UTC.
+
+    Parameters
+    ----------
+    values: list of str
+        Publication dates, e.g. the 'pubDate' tags of a feed's items.
+
+    feed: str (optional)
+        Key under which the order of formats is remembered, e.g. the feed's
+        host, see *feed_of*. Dates of different feeds may be passed under the
+        same key, which costs a pass per format they use.
+
+    Returns
+    -------
+    list of int
+        Seconds since the epoch, None for missing or unparsable dates.
+    """
+    with _lock:
+        formats = _formats.get(feed, tuple(FORMATS))
+    epochs = [None] * len(values)
+    remaining = [ii for ii, value in enumerate(values) if value]
+    matches = {}
+    for name in formats:
+        if not remaining:
+            break
+        pattern, left = FORMATS[name], []
+        for ii in remaining:
+            epoch = _epoch(pattern.fullmatch(values[ii]))
+            if epoch is None:
+                left.append(ii)
+            else:
+                epochs[ii] = epoch
+        matches[name] = len(remaining) - len(left)
+        remaining = left
+    with _lock:
+        _formats[feed] = tuple(sorted(formats, key=lambda name: -matches.get(name, 0)))
+    for ii in remaining:
+        epochs[ii] = _parse_rfc822(values[ii])
+    return epochs
+
+
+def isoformat(epoch: int) -> str:
+    """Return UNIX time as ISO 8601 string in UTC, e.g. '2021-03-05T08:41:00Z'."""
+    return time.strftime(ISO_FORMAT, time.gmtime(epoch))
+
+
+def normalize(pubdate: str, published: int = None, feed: str = None) -> tuple:
+    """Return the date to store an item's text under and its UNIX time.
+
+    The date is the ISO 8601 string of *published*, which is parsed from
+    *pubdate* if None. Dates which can't be parsed are returned as is.
+    """
+    if published is None and pubdate is not None:
+        published = parse([pubdate], feed)[0]
+    return (isoformat(published) if published is not None else pubdate), published
+
+
+def feed_of(link: str) -> str:
+    """Return the key under which the date formats of an item are remembered: its link's host."""
+    return urllib.parse.urlsplit(link or "").hostname
+
+
+def create_columns(conn_feeds: sqlite3.Connection = None, conn_catalog: sqlite3.Connection = None) -> int:
+    """Add and index the UNIX time columns of the 'items' and 'texts' tables if they are missing.
+
+    Columns added to existing tables are filled from the stored dates: the
+    'rss_published' column of 'items' from 'rss_pubdate' and the 'published'
+    column of 'texts' from 'date'. Parsable 'date' keys of texts and of their
+    'analysis' and 'progress' rows are rewritten in ISO 8601, as new texts
+    are stored under, see *normalize*, in a single transaction. Texts whose
+    rewritten key is taken already keep their date along with their
+    'analysis' and 'progress' rows; they are counted in a warning.
+
+    Parameters
+    ----------
+    conn_feeds, conn_catalog: sqlite3.Connection (optional)
+        Connections to the feeds and the catalog database.
+
+    Returns
+    -------
+    int
+        Number of filled rows.
+    """
+    count = 0
+    if conn_feeds is not None and _add_column(conn_feeds, "items", "rss_published", CREATE_ITEMS_INDEX):
+        log.info("Normalizing publication dates of stored RSS items ...")
+        count += normalize_items(conn_feeds, queued=False)
+    if conn_catalog is not None and _add_column(conn_catalog, "texts", "published", CREATE_TEXTS_INDEX):
+        log.info("Normalizing publication dates of stored texts ...")
+        rows = conn_catalog.execute("SELECT rowid, url, date FROM texts WHERE date IS NOT NULL").fetchall()
+        keys = {rowid: (url, date) for rowid, url, date in rows}
+        tables = [row[0] for row in conn_catalog.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('analysis', 'progress')")]
+        conflicts = 0
+        with util.transaction(conn_catalog):
+            for rowid, published in _parse_rows(rows):
+                conn_catalog.execute("UPDATE texts SET published = ? WHERE rowid = ?", (published, rowid))
+                count += 1
+                # Rewrite the key, such that extracting or analyzing a text again does not store it twice
+                (url, date), iso = keys[rowid], isoformat(published)
+                if iso == date:
+                    continue
+                moved = conn_catalog.execute("UPDATE OR IGNORE texts SET date = ? WHERE rowid = ?", (iso, rowid))
+                if moved.rowcount == 0:
+                    conflicts += 1
+                    continue
+                for table in tables:
+                    conn_catalog.execute(f"UPDATE OR REPLACE {table} SET date = ? WHERE url = ? AND date = ?",
+                                         (iso, url, date))
+        if conflicts > 0:
+            log.warning(f"Kept the dates of {conflicts} texts, as they are stored under their ISO 8601 date too.")
+    return count
+
+
+def normalize_items(conn: sqlite3.Connection, queued: bool = True) -> int:
+    """Parse the 'rss_pubdate' of items into their 'rss_published' column.
+
+    Call this function after storing new items, see *rss.feeds_to_database*.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the feeds database, see *create_columns*.
+
+    queued: bool (optional)
+        Only normalize items still being processed, see *workqueue*, which
+        includes all new items. Otherwise, all items are normalized.
+
+    Returns
+    -------
+    int
+        Number of items with a parsable date.
+    """
+    join = "JOIN queue USING (rss_guid, rss_link)" if queued else ""
+    rows = conn.execute(f"""
+        SELECT items.rowid, items.rss_link, items.rss_pubdate FROM items {join}
+        WHERE items.rss_published IS NULL AND items.rss_pubdate IS NOT NULL""").fetchall()
+    return util.write_batches(conn, "UPDATE items SET rss_published = ? WHERE rowid = ?",
+                              ((published, rowid) for rowid, published in _parse_rows(rows)))
+
+
+def _parse_rows(rows: list):
+    """Parse (rowid, link, date) rows grouped by feed and yield (rowid, UNIX time) of parsable ones."""
+    feeds = {}
+    for rowid, link, date in rows:
+        feeds.setdefault(feed_of(link), []).append((rowid, date))
+    for feed, feed_rows in feeds.items():
+        for (rowid, _), published in zip(feed_rows, parse([date for _, date in feed_rows], feed)):
+            if published is not None:
+                yield rowid, published
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, create_index: str) -> bool:
+    """Add an INTEGER column and its index to a table. Return True if the column was missing."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    with util.transaction(conn):  # includes DDL statements
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER")
+        conn.execute(create_index)
+    return column not in columns
+
+
+def _epoch(match) -> int:
+    """Return the UNIX time of a date matched by a pattern of *FORMATS*, None if there is no valid match."""
+    if match is None:
+        return None
+    day, month, year, hour, minute, second, zone = match.group("day", "month", "year", "hour", "minute", "second",
+                                                               "zone")
+    month = int(month) if month.isdigit() else MONTHS.get(month[:3].casefold())
+    year = int(year)
+    if len(match.group("year")) == 2:
+        year += 2000 if year < 50 else 1900
+    hour, minute, second = int(hour or 0), int(minute or 0), int(second or 0)
+    if month is None or not (1 <= month <= 12 and hour < 24 and minute < 60 and second < 61):
+        return None
+    if not 1 <= int(day) <= calendar.monthrange(year, month)[1]:
+        return None
+    if zone is None:
+        offset = 0
+    elif zone[0] in "+-":
+        offset = (int(zone[1:3]) * 60 + int(zone[-2:])) * (-1 if zone[0] == "-" else 1)
+    else:
+        offset = ZONES.get(zone.casefold())
+        if offset is None:
+            return None
+    return calendar.timegm((year, month, int(day), hour, minute, second)) - offset * 60
+
+
+def _parse_rfc822(value: str) -> int:
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp())
+
+
+_formats = {}  # feed -> FORMATS ordered by their matches in the last call of parse()
+_lock = threading.Lock()
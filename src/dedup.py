@@ -0,0 +1,278 @@
+"""Detection of near-duplicate RSS items and articles, e.g. syndicated press releases."""
+import logging
+log = logging.getLogger("stockbro")
+
+import collections
+import hashlib
+import re
+import sqlite3
+
+from src import metrics
+from src import util
+from src import workqueue
+
+ITEM = "item"  # fingerprint of an item's title and description, taken at fetch time
+TEXT = "text"  # fingerprint of an article's fulltext, taken at extract time
+SHINGLES = {ITEM: 2, TEXT: 3}  # number of consecutive words forming a feature
+MIN_FEATURES = {ITEM: 8, TEXT: 16}  # shorter texts are too ambiguous to be fingerprinted
+MAX_DISTANCE = {ITEM: 0, TEXT: 3}  # differing bits of fingerprints of near-duplicates; at most BANDS - 1
+BANDS = 4  # the 64-bit fingerprints are indexed by 16-bit quarters
+STAGES = {ITEM: workqueue.DOWNLOAD, TEXT: workqueue.EXTRACT}  # stage at which duplicates leave the queue
+
+# Items are short, such that swapping a single word, e.g. the company in a
+# headline template, may change only one or two bits of their fingerprint.
+# Items are therefore only folded if their fingerprints are equal, i.e. if
+# they differ in case, punctuation or whitespace only; edited copies are left
+# to the fulltext.
+#
+# Fingerprints of canonical entries only. Two fingerprints differing in at
+# most BANDS - 1 bits agree in at least one band, so near-duplicates are
+# found by a few index lookups followed by comparing the candidates' bits.
+# Entries too short to be fingerprinted are stored with a NULL fingerprint,
+# such that they are not screened again.
+CREATE_FINGERPRINTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        rss_guid TEXT,
+        rss_link TEXT,
+        kind TEXT,        -- 'item' (title and description) or 'text' (fulltext)
+        simhash INTEGER,  -- 64-bit SimHash as signed integer
+        band0 INTEGER,    -- bits 0-15 of simhash
+        band1 INTEGER,    -- bits 16-31
+        band2 INTEGER,    -- bits 32-47
+        band3 INTEGER,    -- bits 48-63
+        PRIMARY KEY (rss_guid, rss_link, kind)
+    )"""
+
+CREATE_FINGERPRINTS_INDEXES = tuple(
+    f"CREATE INDEX IF NOT EXISTS fingerprints_band{ii} ON fingerprints (kind, band{ii})" for ii in range(BANDS))
+
+# Items which have not been processed further as they duplicate another item
+CREATE_DUPLICATES_TABLE = """
+    CREATE TABLE IF NOT EXISTS duplicates (
+        rss_guid TEXT,
+        rss_link TEXT,
+        kind TEXT,            -- fingerprint which matched: 'item' or 'text'
+        canonical_guid TEXT,  -- key of the first item seen with this content
+        canonical_link TEXT,
+        distance INTEGER,     -- number of differing bits of the fingerprints
+        PRIMARY KEY (rss_guid, rss_link)
+    )"""
+
+_WORDS = re.compile(r"\w+")
+
+
+def create_tables(conn: sqlite3.Connection):
+    """Create the 'fingerprints' and 'duplicates' tables and their indexes if they do not exist."""
+    with util.transaction(conn):
+        conn.execute(CREATE_FINGERPRINTS_TABLE)
+        for statement in CREATE_FINGERPRINTS_INDEXES:
+            conn.execute(statement)
+        conn.execute(CREATE_DUPLICATES_TABLE)
+
+
+def simhash(text: str, shingles: int = SHINGLES[TEXT], min_features: int = MIN_FEATURES[TEXT]) -> int:
+    """Return the 64-bit SimHash of a text or None if the text is too short.
+
+    Features are the text's case-folded runs of *shingles* consecutive words.
+    Each bit of the SimHash is the majority vote of the respective bit of
+    the features' hashes, so texts sharing most features have SimHashes
+    differing in few bits.
+    """
+    words = _WORDS.findall(text.casefold())
+    features = [" ".join(words[ii:ii + shingles]) for ii in range(max(1, len(words) - shingles + 1))]
+    if len(words) == 0 or len(features) < min_features:
+        return None
+    digests = [hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest() for feature in features]
+    # Count set bits per position byte by byte, which takes one pass over the
+    # digests per byte instead of one per bit.
+    counts = [0] * 64
+    for byte in range(8):
+        for value, count in collections.Counter(digest[byte] for digest in digests).items():
+            for bit in range(8):
+                if value >> bit & 1:
+                    counts[8 * byte + bit] += count
+    return sum(1 << ii for ii, count in enumerate(counts) if 2 * count > len(digests))
+
+
+def distance(a: int, b: int) -> int:
+    """Return the number of bits in which two SimHashes differ."""
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+def find(conn: sqlite3.Connection, kind: str, fingerprint: int, max_distance: int = None, exclude: tuple = None):
+    """Return the key and distance of the nearest canonical entry within *max_distance* bits or None.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the feeds database.
+
+    kind: str
+        Kind of fingerprint, *ITEM* or *TEXT*.
+
+    fingerprint: int
+        SimHash to look up, see *simhash*.
+
+    max_distance: int (optional)
+        Maximum number of differing bits. Defaults to *MAX_DISTANCE* of the
+        kind. Must be less than *BANDS*.
+
+    exclude: tuple (optional)
+        Key (rss_guid, rss_link) of the entry itself, which is not returned.
+
+    Returns
+    -------
+    tuple or None
+        ((rss_guid, rss_link), distance) of the nearest entry.
+    """
+    max_distance = MAX_DISTANCE[kind] if max_distance is None else max_distance
+    query = " UNION ".join(f"SELECT rss_guid, rss_link, simhash FROM fingerprints WHERE kind = ? AND band{ii} = ?"
+                           for ii in range(BANDS))
+    params = [value for band in _bands(fingerprint) for value in (kind, band)]
+    nearest = None
+    for guid, link, candidate in conn.execute(query, params):
+        if (guid, link) == exclude:
+            continue
+        bits = distance(fingerprint, candidate)
+        if bits <= max_distance and (nearest is None or bits < nearest[1]):
+            nearest = ((guid, link), bits)
+    return nearest
+
+
+def screen(conn: sqlite3.Connection, kind: str, entries, max_distance: int = None) -> dict:
+    """Fingerprint entries and link near-duplicates of known entries to them.
+
+    Each entry is compared to all canonical entries of the same kind,
+    including the entries passed before it. Entries without a near-duplicate
+    become canonical entries themselves; the others are recorded in the
+    'duplicates' table. Screening an entry again yields the same result. The
+    caller is responsible for committing, which should happen once the
+    canonical entries are stored. Call *release* for canonical entries
+    failing afterwards.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the feeds database.
+
+    kind: str
+        Kind of fingerprint, *ITEM* or *TEXT*.
+
+    entries: iterable of tuple
+        Tuples ((rss_guid, rss_link), text) of the entries to screen.
+
+    max_distance: int (optional)
+        Maximum number of differing bits of near-duplicates. Defaults to
+        *MAX_DISTANCE* of the kind.
+
+    Returns
+    -------
+    dict
+        Mapping of the keys of near-duplicate entries to the keys of their
+        canonical entries.
+    """
+    duplicates = {}
+    for key, text in entries:
+        fingerprint = simhash(text or "", SHINGLES[kind], MIN_FEATURES[kind])
+        nearest = find(conn, kind, fingerprint, max_distance, key) if fingerprint is not None else None
+        if nearest is None:
+            conn.execute("DELETE FROM duplicates WHERE rss_guid = ? AND rss_link = ?", key)
+            conn.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (*key, kind, _signed(fingerprint), *_bands(fingerprint)))
+            continue
+        canonical, bits = nearest
+        conn.execute("INSERT OR REPLACE INTO duplicates VALUES (?, ?, ?, ?, ?, ?)", (*key, kind, *canonical, bits))
+        duplicates[key] = canonical
+    if duplicates:
+        metrics.inc(metrics.DUPLICATES, len(duplicates), kind=kind)
+    return duplicates
+
+
+def screen_items(conn: sqlite3.Connection, max_distance: int = None) -> int:
+    """Screen items waiting for download by their title and description.
+
+    Items duplicating an already known item are removed from the queue and
+    thus never downloaded, extracted or analyzed. Call this function after
+    storing new items, see *rss.feeds_to_database*.
+
+    Returns
+    -------
+    int
+        Number of duplicates found.
+    """
+    rows = conn.execute(f"""
+        SELECT rss_guid, rss_link, rss_title, rss_description
+        FROM queue JOIN items USING (rss_guid, rss_link)
+        WHERE queue.stage = '{workqueue.DOWNLOAD}'
+          AND NOT EXISTS (SELECT 1 FROM fingerprints
+                          WHERE fingerprints.rss_guid = queue.rss_guid AND fingerprints.rss_link = queue.rss_link
+                            AND fingerprints.kind = '{ITEM}')
+          AND NOT EXISTS (SELECT 1 FROM duplicates
+                          WHERE duplicates.rss_guid = queue.rss_guid AND duplicates.rss_link = queue.rss_link)
+        ORDER BY queue.queued_at""").fetchall()
+    with util.transaction(conn):
+        duplicates = screen(conn, ITEM, [((guid, link), f"{title or ''} {description or ''}")
+                                         for guid, link, title, description in rows], max_distance)
+        workqueue.advance(conn, list(duplicates))
+    if duplicates:
+        log.info(f"Skipping {len(duplicates)}/{len(rows)} new RSS items duplicating known items.")
+    return len(duplicates)
+
+
+def release(conn: sqlite3.Connection, keys: list) -> int:
+    """Withdraw entries which failed to be processed from being canonical and requeue a duplicate instead.
+
+    The fingerprints of the failed entries are deleted. Per kind, the first
+    duplicate of a failed entry takes over its fingerprint and re-enters the
+    queue at the stage it was skipped at, see *STAGES*. Further duplicates
+    are linked to it. A failed item which is retried may thus turn out to
+    duplicate its successor. The caller is responsible for committing.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the feeds database.
+
+    keys: list of tuple
+        (rss_guid, rss_link) of the failed entries.
+
+    Returns
+    -------
+    int
+        Number of requeued duplicates.
+    """
+    successors = []
+    for key in keys:
+        firsts = {}
+        for guid, link, kind in conn.execute("SELECT rss_guid, rss_link, kind FROM duplicates "
+                                             "WHERE canonical_guid = ? AND canonical_link = ? ORDER BY rowid", key):
+            firsts.setdefault(kind, (guid, link))
+        for kind, successor in firsts.items():
+            conn.execute("UPDATE OR REPLACE fingerprints SET rss_guid = ?, rss_link = ? "
+                         "WHERE rss_guid = ? AND rss_link = ? AND kind = ?", (*successor, *key, kind))
+            conn.execute("DELETE FROM duplicates WHERE rss_guid = ? AND rss_link = ?", successor)
+            conn.execute("UPDATE duplicates SET canonical_guid = ?, canonical_link = ? "
+                         "WHERE canonical_guid = ? AND canonical_link = ? AND kind = ?", (*successor, *key, kind))
+            # Duplicates of texts have been marked as done
+            conn.execute("DELETE FROM progress WHERE rss_guid = ? AND rss_link = ?", successor)
+            workqueue.enqueue(conn, [successor], STAGES[kind])
+            successors.append(successor)
+        conn.execute("DELETE FROM fingerprints WHERE rss_guid = ? AND rss_link = ?", key)
+    if successors:
+        log.info(f"Requeued {len(successors)} duplicates of RSS items which failed to be processed.")
+    return len(successors)
+
+
+def _signed(fingerprint: int) -> int:
+    """Return a 64-bit fingerprint as signed integer as stored by SQLite, None stays None."""
+    if fingerprint is None:
+        return None
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def _bands(fingerprint: int) -> list:
+    """Split a fingerprint into *BANDS* integers, all None if the fingerprint is None."""
+    if fingerprint is None:
+        return [None] * BANDS
+    width = 64 // BANDS
+    return [(fingerprint >> (ii * width)) & ((1 << width) - 1) for ii in range(BANDS)]
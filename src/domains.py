@@ -0,0 +1,59 @@
+"""Offline resolution of URLs to registered domains."""
+import logging
+log = logging.getLogger("stockbro")
+
+import functools
+import typing
+import urllib.parse
+from pathlib import Path
+
+if typing.TYPE_CHECKING:
+    import tldextract
+
+# Snapshot of the public suffix list (https://publicsuffix.org/list/) shipped
+# with this project. Update by replacing the file.
+SUFFIX_LIST_PATH = Path(__file__).resolve().parent.parent / "assets" / "public_suffix_list.dat"
+CACHE_SIZE = 65536  # number of hostnames whose registered domain is memoized
+
+
+def registered_domain(url: str) -> str:
+    """Return the registered domain of a URL.
+
+    The registered domain is the domain name below the public suffix, e.g.
+    'finanznachrichten.de' for 'https://www.finanznachrichten.de/foo.htm' or
+    'fool.co.uk' for 'https://www.fool.co.uk/feed/'. Resolution never touches
+    the network: the public suffix list is read from the bundled snapshot at
+    *SUFFIX_LIST_PATH* upon first use. Results are memoized per hostname, such
+    that resolving a known host costs a dict lookup.
+
+    Parameters
+    ----------
+    url: str
+        URL or bare hostname. Case insensitive.
+
+    Returns
+    -------
+    str
+        Registered domain in the format '{domain}.{suffix}'.
+    """
+    if "//" not in url:
+        url = "//" + url  # bare hostname, e.g. 'www.fool.co.uk/feed/'
+    return _host_domain(urllib.parse.urlsplit(url).hostname or "")
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _host_domain(host: str) -> str:
+    extract = _extractor()(host)
+    return f"{extract.domain}.{extract.suffix}"
+
+
+@functools.lru_cache(maxsize=None)
+def _extractor() -> "tldextract.TLDExtract":
+    """Return suffix extractor reading the bundled snapshot. Never downloads the suffix list."""
+    import tldextract  # slow to import; only needed once a URL is resolved
+    if SUFFIX_LIST_PATH.is_file():
+        suffix_list_urls = (SUFFIX_LIST_PATH.as_uri(),)
+    else:
+        log.warning(f"Public suffix list '{SUFFIX_LIST_PATH}' missing. Using tldextract's snapshot.")
+        suffix_list_urls = ()
+    return tldextract.TLDExtract(cache_dir=None, suffix_list_urls=suffix_list_urls, fallback_to_snapshot=True)
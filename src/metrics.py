@@ -0,0 +1,301 @@
+"""Instrumentation of the RSS pipeline: stage timings, HTTP traffic and failures."""
+import logging
+log = logging.getLogger("stockbro")
+
+import bisect
+import contextlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import typing
+
+from src import util
+
+# Metric names, see KINDS for their types and descriptions
+STAGE_SECONDS = "stockbro_stage_seconds"
+ITEMS = "stockbro_items_total"
+FAILURES = "stockbro_failures_total"
+PARSE_SECONDS = "stockbro_parse_seconds"
+HTTP_SECONDS = "stockbro_http_request_seconds"
+HTTP_BYTES = "stockbro_http_response_bytes_total"
+HTTP_FAILURES = "stockbro_http_failures_total"
+DUPLICATES = "stockbro_duplicates_total"
+
+KINDS = {
+    STAGE_SECONDS: ("histogram", "Wall time of a unit of work of a stage: a fetch of all feeds, a trace, an "
+                                 "article's download or extraction."),
+    ITEMS: ("counter", "Items processed successfully by a stage."),
+    FAILURES: ("counter", "Failed units of work by stage and cause."),
+    PARSE_SECONDS: ("histogram", "Time spent parsing a feed or extracting an article's fulltext by domain."),
+    HTTP_SECONDS: ("histogram", "Latency of HTTP requests by host, including the transfer of the body."),
+    HTTP_BYTES: ("counter", "Bytes of HTTP response bodies received by host."),
+    HTTP_FAILURES: ("counter", "Failed HTTP requests by host and cause, including retried ones."),
+    DUPLICATES: ("counter", "Near-duplicate items skipped by kind of fingerprint, see src/dedup.py."),
+}
+
+# Upper bounds in seconds of the histograms' buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+DEFAULT_TEXTFILE = pathlib.Path("log/stockbro.prom")
+
+# Deltas of the metrics between two calls of *store*. Counters store their
+# increase in 'value'. Histograms store the sum of their observations in
+# 'value', the number of observations in 'count' and the number of
+# observations per bucket of *BUCKETS* as JSON list in 'buckets'.
+CREATE_METRICS_TABLE = """
+    CREATE TABLE IF NOT EXISTS metrics (
+        recorded_at INTEGER, -- UNIX time of storing
+        name TEXT,           -- metric name, see KINDS
+        labels TEXT,         -- JSON object of labels, e.g. {"stage": "download"}
+        value REAL,
+        count INTEGER,
+        buckets TEXT
+    )"""
+
+CREATE_METRICS_INDEX = """
+    CREATE INDEX IF NOT EXISTS metrics_name ON metrics (name, recorded_at)"""
+
+
+class Series(typing.NamedTuple):
+    """Aggregated metric as returned by *summary*."""
+
+    name: str
+    labels: dict
+    value: float  # total of a counter or sum of a histogram's observations
+    count: int  # number of observations of a histogram, None for counters
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Increase a counter, e.g. inc(FAILURES, stage="download", cause="Timeout")."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    """Add an observation to a histogram, e.g. observe(HTTP_SECONDS, 0.3, host="example.org")."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time the enclosed unit of work of a stage and count it as failure by cause if it raises.
+
+    Examples
+    --------
+        with metrics.stage("trace"):
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        inc(FAILURES, stage=name, cause=cause(e))
+        raise
+    finally:
+        observe(STAGE_SECONDS, time.perf_counter() - start, stage=name)
+
+
+def cause(error: BaseException) -> str:
+    """Return the label describing why something failed, e.g. 'http_404' or 'ConnectTimeout'."""
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "status_code", None) is not None:
+        return f"http_{response.status_code}"
+    return type(error).__name__
+
+
+def drain() -> dict:
+    """Return all metrics recorded in this process since the last call and reset them.
+
+    Used to hand metrics of worker processes back to the main process, which
+    adds them to its own via *merge*.
+    """
+    global _counters, _histograms
+    with _lock:
+        snapshot = {"counters": _counters, "histograms": _histograms}
+        _counters, _histograms = {}, {}
+    return snapshot
+
+
+def merge(snapshot: dict):
+    """Add metrics returned by *drain*, e.g. in a worker process, to the metrics of this process."""
+    with _lock:
+        for key, value in snapshot["counters"].items():
+            _counters[key] = _counters.get(key, 0) + value
+        for key, (buckets, total, count) in snapshot["histograms"].items():
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+            histogram[1] += total
+            histogram[2] += count
+
+
+def reset():
+    """Forget all metrics recorded so far, including what has been stored."""
+    global _counters, _histograms, _stored
+    with _lock:
+        _counters, _histograms = {}, {}
+        _stored = {"counters": {}, "histograms": {}}
+
+
+def textfile() -> str:
+    """Return all metrics recorded since the start of the process in the Prometheus text format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(buckets), total, count) for key, (buckets, total, count) in _histograms.items()}
+    lines = []
+    for name, (kind, description) in KINDS.items():
+        if kind == "counter":
+            series = sorted((labels, value) for (key, labels), value in counters.items() if key == name)
+        else:
+            series = sorted((labels, value) for (key, labels), value in histograms.items() if key == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in series:
+            if kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            buckets, total, count = value
+            cumulative = 0
+            for bound, observations in zip(BUCKETS, buckets):
+                cumulative += observations
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: pathlib.Path = DEFAULT_TEXTFILE):
+    """Write all metrics to a file in the Prometheus text format.
+
+    The file is replaced atomically, such that a collector, e.g. the textfile
+    collector of the Prometheus node exporter, never reads a partial file.
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmppath = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmppath.write_text(textfile(), encoding="utf-8")
+    os.replace(tmppath, path)
+
+
+def store(conn: sqlite3.Connection) -> int:
+    """Append the change of all metrics since the previous call to the 'metrics' table.
+
+    The table is created if it does not exist. Metrics are only marked as
+    stored once the transaction has been committed.
+
+    Returns
+    -------
+    int
+        Number of stored rows.
+    """
+    global _stored
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(buckets), total, count) for key, (buckets, total, count) in _histograms.items()}
+        stored = _stored
+    rows = []
+    for (name, labels), value in counters.items():
+        delta = value - stored["counters"].get((name, labels), 0)
+        if delta != 0:
+            rows.append((name, json.dumps(dict(labels)), delta, None, None))
+    for (name, labels), (buckets, total, count) in histograms.items():
+        previous = stored["histograms"].get((name, labels), ([0] * len(BUCKETS), 0.0, 0))
+        if count != previous[2]:
+            rows.append((name, json.dumps(dict(labels)), total - previous[1], count - previous[2],
+                         json.dumps([a - b for a, b in zip(buckets, previous[0])])))
+    with util.transaction(conn):
+        conn.execute(CREATE_METRICS_TABLE)
+        conn.execute(CREATE_METRICS_INDEX)
+        conn.executemany("INSERT INTO metrics (recorded_at, name, labels, value, count, buckets) "
+                         "VALUES (CAST(strftime('%s', 'now') AS INTEGER), ?, ?, ?, ?, ?)", rows)
+    with _lock:
+        _stored = {"counters": counters, "histograms": histograms}
+    return len(rows)
+
+
+def flush(conn: sqlite3.Connection, path: pathlib.Path = None):
+    """Store metrics to the 'metrics' table, see *store*, and write them to a textfile if *path* is given."""
+    store(conn)
+    if path is not None:
+        write_textfile(path)
+
+
+def summary(conn: sqlite3.Connection, since: float = None) -> list:
+    """Return the metrics stored in the 'metrics' table, aggregated per series.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the feeds database.
+
+    since: float (optional)
+        UNIX time; only metrics stored afterwards are aggregated. All metrics
+        are aggregated if None.
+
+    Returns
+    -------
+    list of Series
+        Series of all metrics, largest value first.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'metrics'").fetchone()
+    if not exists:
+        return []
+    rows = conn.execute("SELECT name, labels, SUM(value), SUM(count) FROM metrics WHERE recorded_at >= ? "
+                        "GROUP BY name, labels ORDER BY SUM(value) DESC", (since or 0,))
+    return [Series(name, json.loads(labels), value, count) for name, labels, value, count in rows]
+
+
+def report(conn: sqlite3.Connection, since: float = None, top: int = 10):
+    """Print where the time went according to the stored metrics: stages, domains, hosts and failures."""
+    series = summary(conn, since)
+
+    def table(title, name, label, histogram=True):
+        rows = [s for s in series if s.name == name][:top]
+        if not rows:
+            return
+        print(title)
+        for s in rows:
+            labels = " ".join(str(s.labels.get(key, "")) for key in label)
+            if histogram:
+                mean = s.value / s.count * 1000 if s.count else 0.0
+                print(f"  {s.value:10.3f} s  {s.count:8d} x  {mean:9.1f} ms  {labels}")
+            else:
+                print(f"  {s.value:12.0f}  {labels}")
+
+    table("Time per stage (total, count, mean):", STAGE_SECONDS, ["stage"])
+    table("Parse time per domain:", PARSE_SECONDS, ["kind", "domain"])
+    table("HTTP latency per host:", HTTP_SECONDS, ["host"])
+    table("HTTP bytes per host:", HTTP_BYTES, ["host"], histogram=False)
+    table("Failures per stage and cause:", FAILURES, ["stage", "cause"], histogram=False)
+    table("HTTP failures per host and cause:", HTTP_FAILURES, ["host", "cause"], histogram=False)
+    table("Duplicates skipped:", DUPLICATES, ["kind"], histogram=False)
+    if not series:
+        print("No metrics stored.")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [observations per bucket, sum, count]
+_stored = {"counters": {}, "histograms": {}}  # metrics as of the last store(), to compute deltas
+_lock = threading.Lock()
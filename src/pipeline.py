@@ -0,0 +1,370 @@
+"""Long-running pipeline passing RSS items from their feeds to the catalog."""
+import logging
+log = logging.getLogger("stockbro")
+
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src import blobs
+from src import dates
+from src import dedup
+from src import metrics
+from src import rss
+from src import search
+from src import symbols
+from src import util
+from src import workqueue
+
+# RSS tags stored in the 'items' table and the columns they are stored in
+ITEM_TAGS = {"guid": "rss_guid", "link": "rss_link", "pubDate": "rss_pubdate",
+             "title": "rss_title", "description": "rss_description"}
+ITEM_KEYS = ["rss_guid", "rss_link"]
+
+DEFAULT_FETCH_INTERVAL = 300  # seconds between two fetches of all feeds
+DEFAULT_QUEUE_SIZE = 256  # maximum number of items waiting between two stages
+DEFAULT_BATCHSIZE = 32  # maximum number of items a stage processes and commits at once
+LINGER = 0.5  # seconds a stage waits for more items to fill up a batch
+POLL_INTERVAL = 0.2  # seconds between checks for shutdown while waiting
+DEFAULT_METRICS_INTERVAL = 60  # seconds between two exports of the metrics
+
+
+def run(urls: list, feedsdb_path, feedsdb_schema, catalogdb_path, catalogdb_schema, automaton: symbols.Automaton,
+        stop: threading.Event, fetch_interval: float = DEFAULT_FETCH_INTERVAL, queue_size: int = DEFAULT_QUEUE_SIZE,
+        batchsize: int = DEFAULT_BATCHSIZE, max_per_host: int = rss.DEFAULT_FETCH_PER_HOST,
+        download_workers: int = rss.DEFAULT_DOWNLOAD_WORKERS, extract_workers: int = None,
+        metrics_textfile=None, metrics_interval: float = DEFAULT_METRICS_INTERVAL):
+    """Fetch, download, extract and analyze RSS items continuously until *stop* is set.
+
+    Each stage runs in its own thread. Stages pass items on via bounded
+    in-memory queues; a stage whose successor falls behind blocks once the
+    queue in between is full. Stages collect items into batches of up to
+    *batchsize* items, process them and store each batch's results in a
+    single transaction, which also advances the items in the database's
+    'queue' table (see *workqueue*). An item thus arrives in the catalog
+    within seconds after its feed has been fetched.
+
+    The database stays authoritative: items are handed to the next stage only
+    after their state has been committed. When *stop* is set, every stage
+    finishes and commits its current batch and exits. Items left in the
+    in-memory queues are still queued in the database and are picked up
+    again by the next run. Items waiting for extraction in the database,
+    e.g. downloaded by a previous run or requeued by *dedup.release*, are
+    polled for like items waiting for download.
+
+    Parameters
+    ----------
+    urls: list of str
+        URLs of the RSS feeds to fetch.
+
+    feedsdb_path, feedsdb_schema, catalogdb_path, catalogdb_schema: pathlib.Path or str
+        Paths of the feeds and catalog database and their schema files.
+
+    automaton: symbols.Automaton
+        Compiled symbols to detect in the extracted texts.
+
+    stop: threading.Event
+        Event to set to shut down the pipeline, e.g. from a signal handler.
+
+    fetch_interval: float (optional)
+        Seconds between two fetches of all feeds.
+
+    queue_size: int (optional)
+        Maximum number of items waiting between two stages.
+
+    batchsize: int (optional)
+        Maximum number of items processed and committed at once per stage.
+
+    max_per_host: int (optional)
+        Maximum number of concurrent feed downloads per host.
+
+    download_workers: int (optional)
+        Maximum number of concurrent article downloads.
+
+    extract_workers: int (optional)
+        Number of fulltext extraction processes. Defaults to the number of
+        CPUs.
+
+    metrics_textfile: pathlib.Path or str (optional)
+        Prometheus textfile to write the metrics to, see *metrics.flush*.
+        Metrics are stored to the feeds database's 'metrics' table in any case.
+
+    metrics_interval: float (optional)
+        Seconds between two exports of the metrics. They are exported once
+        more on shutdown.
+    """
+    conn_feeds = util.connect_db(feedsdb_path, feedsdb_schema)
+    blobs.migrate_html_table(conn_feeds)
+    conn_feeds.execute(rss.CREATE_TRACES_TABLE)
+    workqueue.create_queue(conn_feeds)
+    dedup.create_tables(conn_feeds)
+    conn_catalog = util.connect_db(catalogdb_path, catalogdb_schema)
+    dates.create_columns(conn_feeds, conn_catalog)
+    search.create_index(conn_catalog)
+
+    to_download = queue.Queue(queue_size)  # (rss_guid, rss_link)
+    to_extract = queue.Queue(queue_size)  # (rss_guid, rss_link, dest_url, html)
+    to_analyze = queue.Queue(queue_size)  # (url, date, title, description, fulltext)
+    scheduled = set()  # keys of items in download or extraction; not to be scheduled again
+    deferred = set()  # keys of items whose download or extraction failed since the last fetch
+    lock = threading.Lock()  # guards scheduled and deferred
+
+    def fetch():
+        """Fetch feeds periodically and schedule items waiting for download."""
+        conn = util.connect_db(feedsdb_path)
+        last_fetch = None
+        while not stop.is_set():
+            if last_fetch is None or time.monotonic() - last_fetch >= fetch_interval:
+                last_fetch = time.monotonic()
+                failed = {}
+                try:
+                    count = rss.feeds_to_database(urls, feedsdb_path, "items", ITEM_TAGS, ITEM_KEYS,
+                                                  max_per_host=max_per_host, failed=failed)
+                    log.info(f"Fetched {count} new items from {len(urls) - len(failed)}/{len(urls)} RSS feeds.")
+                    dates.normalize_items(conn)
+                    dedup.screen_items(conn)
+                except Exception as e:
+                    log.error(f"Failed to store RSS feeds: {e}")
+                with lock:
+                    deferred.clear()  # retry failed items once per fetch
+
+            # Top up the download queue without blocking, such that fetching
+            # keeps its pace while downloads fall behind.
+            with lock:
+                skip = scheduled | deferred
+            for key in workqueue.pending(conn, workqueue.DOWNLOAD, queue_size + len(skip)):
+                if key in skip:
+                    continue
+                try:
+                    to_download.put_nowait(key)
+                except queue.Full:
+                    break
+                with lock:
+                    scheduled.add(key)
+            stop.wait(1)
+
+    def download():
+        """Download the raw HTML of scheduled items and pass it on for extraction."""
+        import requests
+        conn = util.connect_db(feedsdb_path)
+        while True:
+            batch = _get_batch(to_download, batchsize, stop)
+            if len(batch) == 0:
+                break
+            pages, failed = [], []
+            try:
+                traces = rss.cached_traces(conn, [link for _, link in batch])
+                new_traces = {}
+                for guid, link, dest_url, html, error in rss.download_html(batch, download_workers, traces=traces):
+                    if link not in traces:
+                        if dest_url is not None:
+                            new_traces[link] = dest_url
+                        elif isinstance(error, NotImplementedError):
+                            new_traces[link] = error
+                    if isinstance(error, requests.exceptions.RequestException):
+                        log.error(f"Error for requests.get('{dest_url or link}'): {error}")
+                    elif error is not None:
+                        log.error(f"Miscellaneous error while trying to store '{dest_url or link}': {error}")
+                    if error is not None:
+                        failed.append((guid, link))
+                    else:
+                        pages.append((guid, link, dest_url, html))
+                with util.transaction(conn):
+                    rss.cache_traces(conn, new_traces)
+                    for guid, link, dest_url, html in pages:
+                        conn.execute("INSERT OR REPLACE INTO html (rss_guid, rss_link, dest_url, html_hash) "
+                                     "VALUES (?, ?, ?, ?)", (guid, link, dest_url, blobs.put(conn, html)))
+                    workqueue.advance(conn, [(guid, link) for guid, link, _, _ in pages], workqueue.EXTRACT)
+                    dedup.release(conn, failed)  # skipped duplicates are downloaded instead
+                    workqueue.requeue(conn, failed)
+                log.info(f"Downloaded the raw HTML of {len(pages)}/{len(batch)} RSS items.")
+            except Exception as e:
+                log.error(f"Failed to download {len(batch)} RSS items: {e}")
+                pages, failed = [], batch
+            finally:
+                with lock:
+                    # Downloaded items stay scheduled until they are extracted
+                    scheduled.difference_update(set(batch) - {(guid, link) for guid, link, _, _ in pages})
+                    deferred.update(failed)
+            for page in pages:
+                if not _put(to_extract, page, stop):
+                    break
+
+    def load_backlog():
+        """Pass items waiting for extraction in the database on for extraction.
+
+        These are items downloaded by a previous run and items requeued for
+        extraction since. Items downloaded by this run are passed on by
+        *download*.
+        """
+        conn = util.connect_db(feedsdb_path)
+        while not stop.is_set():
+            with lock:
+                skip = scheduled | deferred
+            keys = [key for key in workqueue.pending(conn, workqueue.EXTRACT, queue_size + len(skip))
+                    if key not in skip]
+            if len(keys) > 0:
+                log.info(f"Resuming extraction of {len(keys)} RSS items.")
+            for guid, link in keys:
+                row = conn.execute("SELECT dest_url, html_hash FROM html WHERE rss_guid = ? AND rss_link = ?",
+                                   (guid, link)).fetchone()
+                html = blobs.get(conn, row[1]) if row is not None and row[1] is not None else None
+                if html is None:
+                    # Raw HTML is gone; download it again.
+                    with util.transaction(conn):
+                        workqueue.advance(conn, [(guid, link)], workqueue.DOWNLOAD)
+                    continue
+                with lock:
+                    scheduled.add((guid, link))
+                if not _put(to_extract, (guid, link, row[0], html), stop):
+                    break
+            stop.wait(1)
+
+    def extract():
+        """Extract fulltexts of downloaded items, store them to the catalog and pass them on for analysis."""
+        conn_feeds = util.connect_db(feedsdb_path)
+        conn_catalog = util.connect_db(catalogdb_path)
+        max_workers = extract_workers or multiprocessing.cpu_count()
+        # Worker processes are spawned rather than forked, as forking a
+        # process running several threads may copy locks in a held state.
+        with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            while True:
+                batch = _get_batch(to_extract, batchsize, stop)
+                if len(batch) == 0:
+                    break
+                texts, failed = [], []
+                try:
+                    records, orphans = [], []
+                    for guid, link, dest_url, html in batch:
+                        row = conn_feeds.execute(
+                            "SELECT rss_pubdate, rss_published, rss_title, rss_description FROM items "
+                            "WHERE rss_guid = ? AND rss_link = ?", (guid, link)).fetchone()
+                        if row is None:
+                            # Nothing to store the fulltext with; drop the item from the queue.
+                            log.warning(f"Skipping queued RSS item without stored item: '{link}'.")
+                            orphans.append((guid, link))
+                            continue
+                        pubdate, published, title, description = row
+                        date, published = dates.normalize(pubdate, published, dates.feed_of(link))
+                        records.append(((guid, link, date, published, title, description, dest_url), dest_url, html))
+                    done, fulltexts = [], []
+                    for key, fulltext, error in rss.extract_fulltexts(records, max_workers,
+                                                                      max(1, len(records) // max_workers),
+                                                                      executor):
+                        guid, link, date, published, title, description, dest_url = key
+                        if error is not None:
+                            log.error(error)
+                            failed.append((guid, link))
+                            continue
+                        texts.append((dest_url, date, title, description, fulltext, published))
+                        done.append((guid, link))
+                        fulltexts.append(((guid, link), fulltext))
+                    # Duplicates of stored texts are marked as done without being stored again.
+                    # Fingerprints of new texts are committed once the texts are stored.
+                    with util.transaction(conn_feeds):
+                        duplicates = dedup.screen(conn_feeds, dedup.TEXT, fulltexts)
+                        texts = [text for text, key in zip(texts, done) if key not in duplicates]
+                        with util.transaction(conn_catalog):
+                            conn_catalog.executemany("INSERT OR IGNORE INTO texts (url, date, title, description, "
+                                                     "fulltext, published) VALUES (?, ?, ?, ?, ?, ?)", texts)
+                        conn_feeds.executemany("INSERT OR REPLACE INTO progress VALUES (?, ?, 1)", done)
+                        workqueue.advance(conn_feeds, done + orphans)
+                        dedup.release(conn_feeds, failed)  # skipped duplicates are extracted instead
+                        workqueue.requeue(conn_feeds, failed)
+                    log.info(f"Extracted the fulltext of {len(done)}/{len(batch)} RSS items, "
+                             f"{len(duplicates)} of which duplicate stored texts.")
+                except Exception as e:
+                    log.error(f"Failed to extract {len(batch)} RSS items: {e}")
+                    texts, failed = [], [(guid, link) for guid, link, _, _ in batch]
+                finally:
+                    with lock:
+                        scheduled.difference_update((guid, link) for guid, link, _, _ in batch)
+                        deferred.update(failed)
+                for text in texts:
+                    if not _put(to_analyze, text[:5], stop):
+                        break
+
+    def analyze():
+        """Detect symbols in extracted texts."""
+        conn = util.connect_db(catalogdb_path)
+        count = symbols.analyze_texts(conn, automaton)  # texts left over by a previous run
+        if count > 0:
+            log.info(f"Analyzed {count} texts left over by a previous run.")
+        while True:
+            batch = _get_batch(to_analyze, batchsize, stop)
+            if len(batch) == 0:
+                break
+            try:
+                symbols.store_analysis(conn, automaton, batch, batchsize)
+            except Exception as e:
+                log.error(f"Failed to analyze {len(batch)} texts: {e}")
+
+    def export():
+        """Export metrics periodically and after all other stages have finished."""
+        conn = util.connect_db(feedsdb_path)
+        while not stop.wait(metrics_interval):
+            metrics.flush(conn, metrics_textfile)
+        for thread in threads[:-1]:
+            thread.join()
+        metrics.flush(conn, metrics_textfile)
+
+    threads = [threading.Thread(target=_stage, args=(target, stop), name=target.__name__)
+               for target in (fetch, download, load_backlog, extract, analyze, export)]
+    for thread in threads:
+        thread.start()
+    log.info("Pipeline running.")
+    while not stop.wait(POLL_INTERVAL):  # wake up regularly such that signal handlers run
+        pass
+
+    log.info("Shutting down, finishing batches in progress ...")
+    for thread in threads:
+        thread.join()
+    waiting = to_download.qsize() + to_extract.qsize() + to_analyze.qsize()
+    log.info(f"Pipeline stopped. {waiting} items waiting in memory remain queued in the database.")
+    util.close_dbs()
+
+
+def _stage(target, stop: threading.Event):
+    """Run a stage's thread function. Shut down the pipeline if it fails."""
+    try:
+        target()
+    except Exception:
+        log.exception(f"Stage '{target.__name__}' failed.")
+        stop.set()
+    finally:
+        util.close_dbs()
+
+
+def _get_batch(q: queue.Queue, size: int, stop: threading.Event) -> list:
+    """Wait for an item, then collect up to *size* items arriving within *LINGER* seconds.
+
+    Returns an empty list if *stop* is set.
+    """
+    batch = []
+    while len(batch) == 0:
+        if stop.is_set():
+            return batch
+        try:
+            batch.append(q.get(timeout=POLL_INTERVAL))
+        except queue.Empty:
+            pass
+    deadline = time.monotonic() + LINGER
+    while len(batch) < size:
+        try:
+            batch.append(q.get(timeout=max(0, deadline - time.monotonic())))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put an item into a queue, waiting while it is full. Returns False if *stop* is set meanwhile."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
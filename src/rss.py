@@ -2,30 +2,404 @@
 import logging
 log = logging.getLogger("stockbro")
 
+import io
+import os
+import time
+import collections
 import sys
 import re
+import hashlib
+import itertools
 import sqlite3
-from pathlib import Path
+import threading
+import typing
+import urllib.parse
+import concurrent.futures
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from src import domains
+from src import metrics
+from src import throttle
+from src import util
 
-import bs4
+# bs4, lxml, pandas and requests take long to import. They are imported by the
+# functions using them such that commands not needing them start quickly.
+if typing.TYPE_CHECKING:
+    import pandas as pd
 
-import pandas as pd
+DEFAULT_RSS_FIELD_NAMES = {"link": "link", "guid": "guid", "pubDate": "pubDate",
+                           "title": "title", "description": "description"}
+DEFAULT_RSS_DBTABLE_KEYS = ["guid", "link"]
+DEFAULT_FETCH_WORKERS = 8  # maximum number of feeds downloaded concurrently
+DEFAULT_FETCH_PER_HOST = 2  # maximum number of concurrent downloads per host
+INSERT_BATCH_SIZE = 1000  # number of records passed to a single executemany()
+DEFAULT_FEED_PARSER = "lxml"  # see parse_feed()
+DEFAULT_DOWNLOAD_WORKERS = 8  # maximum number of articles downloaded concurrently
+TRACE_CACHE_TTL = 30 * 24 * 3600  # seconds a traced destination URL is cached
+TRACE_CACHE_NEGATIVE_TTL = 24 * 3600  # seconds a link without (complete) handler is cached
+TRACE_CACHE_SIZE = 4096  # number of traces cached in process memory
+
+CREATE_TRACES_TABLE = """
+    CREATE TABLE IF NOT EXISTS traces (
+        link TEXT,         -- RSS link
+        dest_url TEXT,     -- destination URL or NULL if tracing raised NotImplementedError
+        error TEXT,        -- error message if tracing raised NotImplementedError
+        traced_at INTEGER, -- UNIX time of tracing
+        PRIMARY KEY (link)
+    )"""
+
+ATOM_NAMESPACE = "http://www.w3.org/2005/Atom"
+# Atom elements used in place of RSS tags, in order of preference. Atom links
+# are taken from the 'href' attribute of the entry's alternate link.
+ATOM_FIELD_NAMES = {"guid": ("id",), "pubDate": ("published", "updated"), "description": ("summary", "content")}
+
+
+def fetch_feeds(urls: list, max_workers: int = DEFAULT_FETCH_WORKERS, max_per_host: int = DEFAULT_FETCH_PER_HOST,
+                timeout: float = 3, validators: dict = None):
+    """Download RSS feeds concurrently.
+
+    All feeds are downloaded by a pool of worker threads. The total number of
+    concurrent downloads is capped by *max_workers* and the number of
+    concurrent downloads from a single host is capped by *max_per_host*. Thus,
+    a fetch cycle takes roughly as long as the slowest feed instead of the sum
+    of all feeds' latencies.
 
-import requests
+    Parameters
+    ----------
+    urls: list of str
+        URL strings, e.g. https://news.co.uk/rss.xml
 
-import tldextract
+    max_workers: int (optional)
+        Maximum number of concurrent downloads.
 
-from src import util
+    max_per_host: int (optional)
+        Maximum number of concurrent downloads per host.
 
-DEFAULT_RSS_FIELD_NAMES = {"link": "link", "guid": "guid", "pubDate": "pubDate",
-                           "title": "title", "description": "description"}
-DEFAULT_RSS_DBTABLE_KEYS = ["guid", "link"]
+    timeout: float (optional)
+        Timeout in seconds of each request.
+
+    validators: dict (optional)
+        Mapping of URLs to tuples (etag, last_modified, content_hash) as
+        returned by a previous download, see *feed_validators*. If present for
+        a URL, the request is made conditional by sending the 'If-None-Match'
+        and 'If-Modified-Since' headers and the server may reply with status
+        304 (Not Modified) and an empty body.
+
+    Yields
+    ------
+    tuple
+        Tuple (url, response, error) for each URL in the order of *urls*.
+        Either *response* is the requests.Response object or *error* is the
+        exception raised while downloading the feed; the other one is None.
+    """
+    urls = list(urls)
+    if len(urls) == 0:
+        return
+
+    # One semaphore per host, created upfront so that workers don't race
+    semaphores = {urllib.parse.urlsplit(url).hostname: threading.BoundedSemaphore(max_per_host) for url in urls}
+
+    def fetch(url):
+        headers = {"User-Agent": util.USERAGENT}
+        etag, last_modified, _ = (validators or {}).get(url, (None, None, None))
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        with semaphores[urllib.parse.urlsplit(url).hostname]:
+            response = throttle.get(url, timeout=timeout, headers=headers)
+            response.raise_for_status()
+            return response
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+        futures = [(url, executor.submit(fetch, url)) for url in urls]
+        try:
+            for url, future in futures:
+                try:
+                    yield url, future.result(), None
+                except Exception as e:
+                    yield url, None, e
+        finally:
+            # Don't wait for pending downloads if the consumer stops early
+            for _, future in futures:
+                future.cancel()
+
+
+def feed_validators(response) -> tuple:
+    """Return tuple (etag, last_modified, content_hash) of a feed's response.
+
+    The 'ETag' and 'Last-Modified' headers are used to issue conditional
+    requests. The SHA-256 hash of the body is used to detect unchanged feeds
+    whose servers don't support conditional requests.
+    """
+    return (response.headers.get("ETag"), response.headers.get("Last-Modified"),
+            hashlib.sha256(response.content).hexdigest())
+
+
+def parse_feed(content, tags: dict = DEFAULT_RSS_FIELD_NAMES, known: set = None, keys: list = None,
+               parser: str = DEFAULT_FEED_PARSER):
+    """Parse a single RSS or Atom feed and yield its items one by one.
+
+    Parameters
+    ----------
+    content: str or bytes
+        The feed's raw XML. Pass bytes to let the parser pick up the encoding
+        declared by the feed.
+
+    tags: dict (optional)
+        Key-value pairs of RSS tags to extract from each item and their
+        corresponding column names. See *feeds_to_dataframe*. Atom entries'
+        tags are mapped to their RSS equivalents, see *ATOM_FIELD_NAMES*.
+
+    known: set (optional)
+        Keys of already known items. If provided, the *keys* tags of each item
+        are extracted first and the item is skipped if its key is contained in
+        *known*. Otherwise its key is added to *known* and its remaining tags
+        are extracted.
+
+    keys: list of str (optional)
+        Subset of column names in *tags*'s values which make up an item's key.
+        Must be provided together with *known*. Keys are tuples of the values
+        ordered as in *keys*.
+
+    parser: str (optional)
+        Parser backend. "lxml" parses the feed in a single streaming pass and
+        supports RSS and Atom feeds. "bs4" builds a BeautifulSoup tree of the
+        whole feed and only supports RSS 2.0 feeds. Both yield identical
+        records for RSS 2.0 feeds.
+
+    Yields
+    ------
+    tuple of str
+        One record per item holding the text of each tag in the order of
+        *tags*. Non-existing tags or tags without content yield "".
+    """
+    if parser == "lxml":
+        items = _lxml_feed_items(content, tags)
+    elif parser == "bs4":
+        items = _bs4_feed_items(content)
+    else:
+        raise ValueError(f"Unknown feed parser '{parser}'.")
+
+    columns = {field_name: rss_tag for rss_tag, field_name in tags.items()}
+    for text in items:
+        values = {}
+        if known is not None:
+            for field_name in keys:
+                values[field_name] = text(columns[field_name])
+            key = tuple(values[field_name] for field_name in keys)
+            if key in known:
+                continue
+            known.add(key)
+        yield tuple(values[field_name] if field_name in values else text(rss_tag)
+                    for rss_tag, field_name in tags.items())
+
+
+def _bs4_feed_items(content):
+    """Yield a function mapping RSS tags to their text for each item of a feed."""
+    import bs4
+    soup = bs4.BeautifulSoup(content, 'xml').find("rss")
+    if soup is None:
+        return
+
+    for item in soup.find_all("item"):
+        def text(rss_tag, item=item):
+            tag = item.find(rss_tag)
+            return tag.text if tag is not None else ""
+        yield text
+
+
+def _lxml_feed_items(content, tags):
+    """Yield a function mapping RSS tags to their text for each item of a feed.
+
+    The feed is parsed incrementally and each item is discarded as soon as it
+    has been processed. The tags of an item are looked up in a single pass
+    over its subtree. Like BeautifulSoup, a tag matches the first descendant
+    element of the same local name; prefixed tags such as 'dc:creator' must
+    match the prefix as well.
+    """
+    # local name -> list of (prefix or None, rss tag)
+    wanted = {}
+    for rss_tag in tags:
+        prefix, _, name = rss_tag.rpartition(":")
+        wanted.setdefault(name, []).append((prefix or None, rss_tag))
+
+    from lxml import etree
+    encoding = None
+    if isinstance(content, str):
+        content, encoding = content.encode("utf-8"), "utf-8"
+    context = etree.iterparse(io.BytesIO(content), events=("end",), tag=("{*}item", "{*}entry"), encoding=encoding,
+                              recover=True, resolve_entities=False, no_network=True, remove_comments=True,
+                              remove_pis=True)
+    for _, item in context:
+        namespace, _, name = item.tag.rpartition("}")
+        if name == "entry" and namespace.lstrip("{") != ATOM_NAMESPACE:
+            continue
+
+        if name == "item":
+            matches = {}  # rss tag -> first matching element
+            for element in item.iterdescendants():
+                candidates = wanted.get(element.tag.rpartition("}")[2], ())
+                for prefix, rss_tag in candidates:
+                    if rss_tag not in matches and (prefix is None or prefix == element.prefix):
+                        matches[rss_tag] = element
+            texts = {rss_tag: "".join(element.itertext()) for rss_tag, element in matches.items()}
+        else:
+            texts = _atom_entry_texts(item, tags)
+        yield lambda rss_tag, texts=texts: texts.get(rss_tag, "")
+
+        # Free processed items and their preceding siblings to keep memory bounded.
+        item.clear()
+        while item.getprevious() is not None:
+            del item.getparent()[0]
+
+
+def _atom_entry_texts(entry, tags):
+    """Return dict mapping RSS tags to the text of their Atom equivalents."""
+    children = {}  # local name -> first child element
+    links = []
+    for child in entry.iterchildren("{*}*"):
+        name = child.tag.rpartition("}")[2]
+        children.setdefault(name, child)
+        if name == "link" and child.get("rel", "alternate") == "alternate":
+            links.append(child.get("href", ""))
+
+    texts = {}
+    for rss_tag in tags:
+        name = rss_tag.rpartition(":")[2]
+        if name == "link":
+            texts[rss_tag] = links[0] if len(links) > 0 else ""
+            continue
+        for atom_name in ATOM_FIELD_NAMES.get(name, (name,)):
+            if atom_name in children:
+                texts[rss_tag] = "".join(children[atom_name].itertext())
+                break
+    return texts
+
+
+def known_items(conn: sqlite3.Connection, tablename: str, keys: list) -> set:
+    """Return the set of keys of all items stored in a database table.
+
+    The set is loaded from the database once and cached for the lifetime of
+    the process, such that subsequent calls cost a dict lookup. Callers are
+    expected to keep the set up to date, e.g. via *parse_feed*. Use
+    *forget_known_items* to drop a cached set.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the database containing the table.
 
+    tablename: str
+        Name of the database table storing the items.
 
-def feeds_to_dataframe(urls: list, tags: dict = DEFAULT_RSS_FIELD_NAMES) -> pd.DataFrame:
+    keys: list of str
+        Column names constituting an item's key.
+
+    Returns
+    -------
+    set of tuple
+        Keys of all stored items. Keys are tuples of the *keys* columns.
+    """
+    cachekey = _known_items_cachekey(conn, tablename, keys)
+    if cachekey not in _known_items:
+        _known_items[cachekey] = set(conn.execute(f"SELECT {', '.join(keys)} FROM {tablename}"))
+        log.debug(f"Loaded {len(_known_items[cachekey])} known keys from table '{tablename}'.")
+    return _known_items[cachekey]
+
+
+def forget_known_items(conn: sqlite3.Connection, tablename: str, keys: list) -> None:
+    """Drop the set of known items cached by *known_items*."""
+    _known_items.pop(_known_items_cachekey(conn, tablename, keys), None)
+
+
+def _known_items_cachekey(conn, tablename, keys):
+    dbpath = conn.execute("PRAGMA database_list").fetchone()[2]  # absolute path of 'main' database
+    return (dbpath, tablename, tuple(keys))
+
+
+_known_items = {}  # cache of known_items()
+
+
+def feed_records(urls: list, tags: dict = DEFAULT_RSS_FIELD_NAMES, max_workers: int = DEFAULT_FETCH_WORKERS,
+                 max_per_host: int = DEFAULT_FETCH_PER_HOST, failed: dict = None, validators: dict = None,
+                 known: set = None, keys: list = None, parser: str = DEFAULT_FEED_PARSER):
+    """Download RSS feeds and yield their items as records.
+
+    This is the streaming counterpart of *feeds_to_dataframe*: records are
+    produced one by one as the feeds are parsed and are never accumulated.
+    See *feeds_to_dataframe* for a description of the parameters.
+
+    If *validators* is a dict, feeds are requested conditionally (see
+    *fetch_feeds*). Feeds whose server replies with 304 (Not Modified) or
+    whose body is identical to the previous download are skipped without
+    being parsed. The dict is updated in place with the validators of every
+    successfully downloaded feed.
+
+    If *known* and *keys* are given, already known items are skipped, see
+    *parse_feed*. *parser* selects the feed parser backend, see *parse_feed*.
+
+    Feeds which fail to download or to parse, e.g. as their body is empty,
+    are entered into *failed* and skipped. Records of a feed failing halfway
+    which were yielded before are kept. If *failed* is None, errors are
+    raised instead.
+
+    Yields
+    ------
+    tuple of str
+        One record per item. Values are ordered as the values of *tags*.
+    """
+    from lxml import etree
+    for url, response, error in fetch_feeds(urls, max_workers, max_per_host, validators=validators):
+        if error is not None:
+            if failed is None:
+                raise error
+            log.error(f"Failed to download RSS feed '{url}': {error}")
+            metrics.inc(metrics.FAILURES, stage="fetch", cause=metrics.cause(error))
+            failed[url] = error
+            continue
+        if validators is not None:
+            if response.status_code == 304:
+                log.debug(f"RSS feed '{url}' not modified.")
+                continue
+            previous_hash = validators.get(url, (None, None, None))[2]
+            validators[url] = feed_validators(response)
+            if validators[url][2] == previous_hash:
+                log.debug(f"RSS feed '{url}' unchanged.")
+                continue
+        # The BeautifulSoup backend historically parses the decoded text.
+        content = response.text if parser == "bs4" else response.content
+        # Time spent by the consumer between two records doesn't count.
+        seconds, start = 0.0, time.perf_counter()
+        records = parse_feed(content, tags, known, keys, parser)
+        while True:
+            try:
+                record = next(records)
+            except StopIteration:
+                break
+            except (etree.XMLSyntaxError, ValueError) as e:
+                if failed is None:
+                    raise
+                log.error(f"Failed to parse RSS feed '{url}': {e}")
+                metrics.inc(metrics.FAILURES, stage="fetch", cause=metrics.cause(e))
+                failed[url] = e
+                break
+            seconds += time.perf_counter() - start
+            yield record
+            start = time.perf_counter()
+        seconds += time.perf_counter() - start
+        metrics.observe(metrics.PARSE_SECONDS, seconds, kind="feed",
+                        domain=domains.registered_domain(url) or urllib.parse.urlsplit(url).hostname)
+
+
+def feeds_to_dataframe(urls: list, tags: dict = DEFAULT_RSS_FIELD_NAMES, max_workers: int = DEFAULT_FETCH_WORKERS,
+                       max_per_host: int = DEFAULT_FETCH_PER_HOST, failed: dict = None,
+                       parser: str = DEFAULT_FEED_PARSER) -> "pd.DataFrame":
     """Download RSS feeds and return as dataframe.
 
     Non-existing tags or tags without content are stored as empty strings "".
+    Feeds are downloaded concurrently, see *fetch_feeds*.
 
     Parameters
     ----------
@@ -39,6 +413,20 @@ def feeds_to_dataframe(urls: list, tags: dict = DEFAULT_RSS_FIELD_NAMES) -> pd.D
         information stored in eponymous columns. Keys and values must be
         unique.
 
+    max_workers: int (optional)
+        Maximum number of concurrent downloads.
+
+    max_per_host: int (optional)
+        Maximum number of concurrent downloads per host.
+
+    failed: dict (optional)
+        If provided, feeds which could not be downloaded are stored as
+        url-exception pairs in this dict and the remaining feeds are processed
+        regardless. Otherwise, the first error is raised.
+
+    parser: str (optional)
+        Feed parser backend, "lxml" or "bs4". See *parse_feed*.
+
     Returns
     -------
     pandas.DataFrame
@@ -54,24 +442,16 @@ def feeds_to_dataframe(urls: list, tags: dict = DEFAULT_RSS_FIELD_NAMES) -> pd.D
                 "https://www.finanznachrichten.de/rss-marktberichte"]
         feeds_to_dataframe(urls, tags={"link": "rss_link", "pubDate": "rss_pubdate"})
     """
-    df = pd.DataFrame(columns=[val for val in tags.values()], dtype="string")
-    for url in urls:
-        response = requests.get(url, timeout=3, headers={"User-Agent": util.USERAGENT})
-        response.raise_for_status()
-
-        soup = bs4.BeautifulSoup(response.text, 'xml').find("rss")
-        if soup is not None:
-            for item in soup.find_all("item"):
-                record = {}
-                for rss_tag, field_name in tags.items():
-                    tag = item.find(rss_tag)
-                    record[field_name] = tag.text if tag is not None else ""
-                df = df.append(record, ignore_index=True)
-    return df
+    import pandas as pd
+    columns = list(tags.values())
+    records = list(feed_records(urls, tags, max_workers, max_per_host, failed, parser=parser))
+    return pd.DataFrame.from_records(records, columns=columns).astype("string")
 
 
 def feeds_to_database(urls: list, dbpath: str, tablename: str = "items", tags: dict = DEFAULT_RSS_FIELD_NAMES,
-                      keys: list = DEFAULT_RSS_DBTABLE_KEYS) -> None:
+                      keys: list = DEFAULT_RSS_DBTABLE_KEYS, max_workers: int = DEFAULT_FETCH_WORKERS,
+                      max_per_host: int = DEFAULT_FETCH_PER_HOST, failed: dict = None,
+                      cachetable: str = "feeds", prefilter: bool = True, parser: str = DEFAULT_FEED_PARSER) -> int:
     """Download RSS feeds and store to sqlite database.
 
     Parameters
@@ -98,17 +478,42 @@ def feeds_to_database(urls: list, dbpath: str, tablename: str = "items", tags: d
         compound primary key. Must be specified if non-default *tags* are used.
         By default, the *link* and *guid* column are used as primary key.
 
+    max_workers: int (optional)
+        Maximum number of concurrent downloads.
+
+    max_per_host: int (optional)
+        Maximum number of concurrent downloads per host.
+
+    failed: dict (optional)
+        If provided, feeds which could not be downloaded are stored as
+        url-exception pairs in this dict. See *feeds_to_dataframe*.
+
+    cachetable: str or None (optional)
+        Name of database table storing each feed's ETag, Last-Modified header
+        and content hash. Feeds are requested conditionally and unchanged
+        feeds are skipped entirely, see *feed_records*. The table is created
+        if it does not exist. Pass None to always download and parse all
+        feeds. Default: "feeds".
+
+    prefilter: bool (optional)
+        Skip items whose key is already stored in the table before extracting
+        their remaining tags and before sending them to the database. The
+        stored keys are cached in memory, see *known_items*. Default: True.
+
+    parser: str (optional)
+        Feed parser backend, "lxml" or "bs4". See *parse_feed*.
+
     Returns
     -------
     int
-        Total number of fetched items across all URLs.
+        Number of new items passed to the database across all URLs.
 
     Examples
     -----------
     The following call will fetch the RSS tags *link*, *pubDate* and *title*,
     name the corresponding columns *rss_link*, *rss_pubdate* and *rss_title* in
     a database table *items*, which will use the columns *rss_link* and
-    *rss_title* as compound primary key (unless the database already exists).
+    *rss_title* as compound primary key (unless the table already exists).
 
         urls = ["https://www.finanznachrichten.de/rss-nachrichten-meistgelesen",
                 "https://www.finanznachrichten.de/rss-marktberichte"]
@@ -116,109 +521,369 @@ def feeds_to_database(urls: list, dbpath: str, tablename: str = "items", tags: d
                           tags={"link": "rss_link", "pubDate": "rss_pubdate", "title": "rss_title"},
                           keys=["rss_link", "rss_title"])
     """
-    df = feeds_to_dataframe(urls, tags)
-    columns = list(df)  # retrieve column names
-    # create path to db
-    path = Path(dbpath)
-    if not path.is_file():
-        path.parent.mkdir(parents=True, exist_ok=True)
-        # construct instruction to create table based on given column names. E.g.
-        # CREATE TABLE items (guid TEXT, link TEXT, ..., PRIMARY KEY (guid, link))
-        create_table_instruction = f"CREATE TABLE {tablename} (" \
-            + " TEXT, ".join(columns + [""]) \
-            + " PRIMARY KEY (" \
-            + ", ".join(keys) \
-            + "))"
-        conn = sqlite3.connect(str(path))
-        conn.execute(create_table_instruction)
-    else:
-        conn = sqlite3.connect(str(path))
+    columns = list(tags.values())
+    conn = util.connect_db(dbpath)
+    # construct instruction to create table based on given column names. E.g.
+    # CREATE TABLE IF NOT EXISTS items (guid TEXT, link TEXT, ..., PRIMARY KEY (guid, link))
+    create_table_instruction = f"CREATE TABLE IF NOT EXISTS {tablename} (" \
+        + " TEXT, ".join(columns + [""]) \
+        + " PRIMARY KEY (" \
+        + ", ".join(keys) \
+        + "))"
+    conn.execute(create_table_instruction)
     # construct instruction to insert records into table. E.g
     # INSERT OR IGNORE INTO items (guid, link) VALUES (?, ?)
     insert_instruction = f"INSERT OR IGNORE INTO {tablename} (" + ", ".join(columns) + ") VALUES (" \
         + ("?, " * len(columns)).rstrip(", ") + ")"
-    conn.executemany(insert_instruction, list(df.itertuples(index=False, name=None)))
+    # Load validators of previous downloads to request feeds conditionally.
+    validators = None
+    if cachetable is not None:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {cachetable} (url TEXT, etag TEXT, last_modified TEXT, "
+                     "content_hash TEXT, PRIMARY KEY (url))")
+        validators = {url: (etag, last_modified, content_hash) for url, etag, last_modified, content_hash
+                      in conn.execute(f"SELECT url, etag, last_modified, content_hash FROM {cachetable}")}
+
     conn.commit()
-    conn.close()
-    return len(df)
+
+    # Stream records into the database in chunks to keep memory bounded. Each
+    # chunk is committed on its own such that the write lock is not held
+    # while waiting for downloads, which would block concurrent stages.
+    with metrics.stage("fetch"):
+        known = known_items(conn, tablename, keys) if prefilter else None
+        records = feed_records(urls, tags, max_workers, max_per_host, failed, validators, known, keys, parser)
+        try:
+            count = util.write_batches(conn, insert_instruction, records, INSERT_BATCH_SIZE)
+        except Exception:
+            # The cached keys may now include items which never made it into the
+            # database. Reload them from the database next time.
+            if prefilter:
+                forget_known_items(conn, tablename, keys)
+            raise
+
+        # Store validators after all records so that a feed is never marked
+        # unchanged without its items having been stored.
+        if validators is not None:
+            with util.transaction(conn):
+                conn.executemany(f"INSERT OR REPLACE INTO {cachetable} (url, etag, last_modified, content_hash) "
+                                 "VALUES (?, ?, ?, ?)",
+                                 [(url, *validators[url]) for url in urls if url in validators])
+    metrics.inc(metrics.ITEMS, count, stage="fetch")
+    return count
+
+
+class TraceResult(typing.NamedTuple):
+    """Result of tracing an RSS feed's link to its destination, see *trace_link*."""
+
+    url: str  # destination URL of the targeted resource
+    html: str  # raw HTML of the destination if downloaded while tracing, None otherwise
+    redirects: list  # URLs which redirected while tracing, in order
 
 
 def rss_trace_link(link: str) -> str:
     """Return destination URL of a resource pointed by an RSS feed's link.
 
+    This is a shorthand for *trace_link(link).url*.
+
+    Parameters
+    ----------
+    link: str
+        The RSS feed's link tag's text.
+
+    Returns
+    -------
+    str
+        Destination URL of the targeted resource.
+    """
+    return trace_link(link).url
+
+
+def trace_link(link: str, fetch_destination: bool = False, fast: bool = True) -> TraceResult:
+    """Trace an RSS feed's link to the resource it points to.
+
     Some RSS feeds return links pointing not the actual article, but rather an
     intermediate "appetizer" page which only links the page or article in
     question. This is often the case when the target content is provided
     outside the RSS feed's own domain and refers to an external site or portal.
 
-    This function returns the final URL of the content the RSS feed links to
-    indirectly. Depending on the input URL, the correct (handcrafted)
-    extraction scheme is chosen to retrieve the destination URL.
+    This function determines the final URL of the content the RSS feed links
+    to indirectly. Depending on the input URL, the correct (handcrafted)
+    extraction scheme is chosen to retrieve the destination URL. Pages
+    downloaded along the way are handed back, such that the destination need
+    not be downloaded again.
 
     Parameters
     ----------
     link: str
         The RSS feed's link tag's text.
 
+    fetch_destination: bool (optional)
+        Whether to download the destination's body if the link redirects to
+        another page. Otherwise only the redirect target is resolved and the
+        destination's body is not transferred.
+
+    fast: bool (optional)
+        Parse only the relevant part of intermediate pages. The whole page is
+        parsed as a fallback if the relevant part can't be found.
+
     Returns
     -------
-    str
-        Destination URL of the targeted resource.
+    TraceResult
+        Destination URL of the targeted resource, its raw HTML if it has been
+        downloaded successfully while tracing and the redirect chain.
     """
-    extr = tldextract.extract(link)
-    domain, suffix = extr.domain, extr.suffix
-    tld = f"{domain}.{suffix}"
-    response = requests.get(link, timeout=3)
-    soup = bs4.BeautifulSoup(response.text, "html.parser")
+    with metrics.stage("trace"):
+        result = _trace_link(link, fetch_destination, fast)
+    metrics.inc(metrics.ITEMS, stage="trace")
+    return result
 
-    if tld == "finanznachrichten.de":
+
+def _trace_link(link, fetch_destination, fast):
+    """Trace a link, see *trace_link*."""
+    tld = domains.registered_domain(link)
+    if tld != "finanznachrichten.de":
+        errmsg = f"Missing handler for tld '{tld}' (link: {link})."
+        log.error(errmsg)
+        raise NotImplementedError(errmsg)
+
+    import bs4
+    response = throttle.get(link, timeout=3)
+    response.raise_for_status()  # don't mistake error pages for incomplete handlers
+    text = response.text  # decoded once, as requests detects the charset on every access
+    content = None
+    if fast:
+        soup = bs4.BeautifulSoup(text, "html.parser", parse_only=_artikel_text_puffer())
+        content = soup.find("div", {"id": "artikelTextPuffer"})
+    if content is None and "artikelTextPuffer" in text:
+        soup = bs4.BeautifulSoup(text, "html.parser")
         content = soup.find("div", {"id": "artikelTextPuffer"})
-        if content is None:
+        if content is not None and fast:
+            log.warning(f"Fast path failed to locate content of '{link}'.")
+    if content is None:
+        errmsg = f"Incomplete handler for tld '{tld}' (link: {link})."
+        log.error(errmsg)
+        raise NotImplementedError(errmsg)
+
+    onclick_span = content.find("span", {"onclick": True})
+    if onclick_span is None:
+        # Page shows full content. Nothing to do.
+        return TraceResult(link, text if response.ok else None, [r.url for r in response.history])
+    else:
+        # Page shows only embedded article preview. Track down external news id, an 8 digit number hidden inside
+        # the value of the 'onclick' property of a 'span' tag. The ID is then used to retrieve the redirection target.
+        # Example: '<span onclick="FN.artikelKomplettID('0', 52172551) ...'"
+        onclick = onclick_span["onclick"]
+        matches = _NEWS_ID.findall(onclick)
+        if len(matches) == 0:
             errmsg = f"Incomplete handler for tld '{tld}' (link: {link})."
             log.error(errmsg)
             raise NotImplementedError(errmsg)
+        news_id = matches[0]
+        redirect_url = f"https://www.finanznachrichten.de/ext/nachricht-komplett-{news_id}-0.htm"
+        # Redirects are followed in any case. The destination's body is only
+        # transferred if it is requested; closing a streamed response discards it.
+        redirect = throttle.get(redirect_url, timeout=3, stream=not fetch_destination)
+        html = redirect.text if fetch_destination and redirect.ok else None
+        redirect.close()
+        return TraceResult(redirect.url, html, [r.url for r in response.history + redirect.history])
 
-        onclick_span = content.find("span", {"onclick": True})
-        if onclick_span is None:
-            # Page shows full content. Nothing to do.
-            return link
+
+@functools.lru_cache(maxsize=None)
+def _artikel_text_puffer():
+    """Return SoupStrainer restricting parsing to the content of finanznachrichten.de pages."""
+    import bs4
+    return bs4.SoupStrainer("div", {"id": "artikelTextPuffer"})
+
+
+# Precompiled matcher of finanznachrichten.de pages used by trace_link()
+_NEWS_ID = re.compile(r"\d{8}")
+
+
+def cached_traces(conn: sqlite3.Connection, links: list, ttl: int = TRACE_CACHE_TTL,
+                  negative_ttl: int = TRACE_CACHE_NEGATIVE_TTL) -> dict:
+    """Look up cached outcomes of *trace_link*.
+
+    Links are looked up in a process-local LRU cache first and in the
+    database's 'traces' table second. Entries older than their time-to-live
+    are ignored. Store outcomes via *cache_traces*.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to a database containing the 'traces' table, see
+        *CREATE_TRACES_TABLE*.
+
+    links: list of str
+        RSS links to look up.
+
+    ttl: int (optional)
+        Time-to-live in seconds of destination URLs.
+
+    negative_ttl: int (optional)
+        Time-to-live in seconds of links which could not be traced due to a
+        missing or incomplete handler.
+
+    Returns
+    -------
+    dict
+        Mapping of each link found in the cache to its destination URL or to
+        the NotImplementedError raised while tracing it.
+    """
+    now = int(time.time())
+
+    def valid(outcome, traced_at):
+        return traced_at >= now - (negative_ttl if isinstance(outcome, NotImplementedError) else ttl)
+
+    traces, missing = {}, []
+    with _trace_lru_lock:
+        for link in links:
+            entry = _trace_lru.get(link)
+            if entry is not None and valid(*entry):
+                _trace_lru.move_to_end(link)
+                traces[link] = entry[0]
+            else:
+                missing.append(link)
+
+    for link in missing:
+        row = conn.execute("SELECT dest_url, error, traced_at FROM traces WHERE link = ?", (link,)).fetchone()
+        if row is None:
+            continue
+        dest_url, error, traced_at = row
+        outcome = NotImplementedError(error) if dest_url is None else dest_url
+        if valid(outcome, traced_at):
+            traces[link] = outcome
+            _trace_lru_put(link, outcome, traced_at)
+    return traces
+
+
+def cache_traces(conn: sqlite3.Connection, traces: dict) -> None:
+    """Store outcomes of *trace_link* in the process-local and the database cache.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to a database containing the 'traces' table. The caller is
+        responsible for committing.
+
+    traces: dict
+        Mapping of links to their destination URL or to the
+        NotImplementedError raised while tracing them.
+    """
+    now = int(time.time())
+    rows = []
+    for link, outcome in traces.items():
+        _trace_lru_put(link, outcome, now)
+        if isinstance(outcome, NotImplementedError):
+            rows.append((link, None, str(outcome), now))
         else:
-            # Page shows only embedded article preview. Track down external news id, an 8 digit number hidden inside
-            # the value of the 'onclick' property of a 'span' tag. The ID is then used to retrieve the redirection target.
-            # Example: '<span onclick="FN.artikelKomplettID('0', 52172551) ...'"
-            onclick = onclick_span["onclick"]
-            matches = re.findall(r"\d{8}", onclick)
-            if len(matches) == 0:
-                errmsg = f"Incomplete handler for tld '{tld}' (link: {link})."
-                log.error(errmsg)
-                raise NotImplementedError(errmsg)
-            news_id = matches[0]
-            redirect = requests.get(f"https://www.finanznachrichten.de/ext/nachricht-komplett-{news_id}-0.htm")
-            destination = redirect.url
-            return destination
-    else:
-        errmsg = f"Missing handler for tld '{tld}' (link: {link})."
-        log.error(errmsg)
-        raise NotImplementedError(errmsg)
+            rows.append((link, outcome, None, now))
+    conn.executemany("INSERT OR REPLACE INTO traces (link, dest_url, error, traced_at) VALUES (?, ?, ?, ?)", rows)
+
+
+def _trace_lru_put(link, outcome, traced_at):
+    with _trace_lru_lock:
+        _trace_lru[link] = (outcome, traced_at)
+        _trace_lru.move_to_end(link)
+        while len(_trace_lru) > TRACE_CACHE_SIZE:
+            _trace_lru.popitem(last=False)
+
+
+_trace_lru = collections.OrderedDict()  # link -> (outcome, traced_at), see cached_traces()
+_trace_lru_lock = threading.Lock()
+
+
+def download_html(items, max_workers: int = DEFAULT_DOWNLOAD_WORKERS, timeout: float = 3, traces: dict = None):
+    """Download the raw HTML of the articles RSS items link to.
+
+    Each item's link is traced to its destination (see *trace_link*) and the
+    destination's raw HTML is downloaded, unless it has already been
+    downloaded while tracing. Items are processed by a bounded pool of worker
+    threads. Requests are rate-limited and retried per host by
+    *throttle.get* and use the per-host keep-alive sessions of
+    *util.http_session*. At most twice as many items as there are workers are in flight at any time,
+    such that arbitrarily long iterables of items may be passed.
+
+    Parameters
+    ----------
+    items: iterable of tuple
+        Tuples (rss_guid, rss_link) of the items to download.
+
+    max_workers: int (optional)
+        Maximum number of concurrent downloads.
+
+    timeout: float (optional)
+        Timeout in seconds of the article request.
+
+    traces: dict (optional)
+        Known outcomes of *trace_link* as returned by *cached_traces*. Links
+        contained are not traced again.
+
+    Yields
+    ------
+    tuple
+        Tuple (rss_guid, rss_link, dest_url, html, error) for each item in
+        order of completion. Either *html* is the article's raw HTML or *error*
+        is the exception raised while tracing or downloading it; the other one
+        is None. *dest_url* is None if the link could not be traced.
+    """
+    def download(guid, link):
+        dest_url = None
+        start = time.perf_counter()
+        try:
+            cached = (traces or {}).get(link)
+            if isinstance(cached, NotImplementedError):
+                raise cached
+            elif cached is not None:
+                dest_url = cached
+            else:
+                trace = trace_link(link, fetch_destination=True)  # track down destination url, not the appetizer
+                dest_url = trace.url
+                if trace.html is not None:
+                    metrics.inc(metrics.ITEMS, stage="download")
+                    return guid, link, dest_url, trace.html, None  # downloaded while tracing
+
+            reply = throttle.get(dest_url, timeout=timeout)
+            reply.raise_for_status()  # throw if 400 ≤ ret_code ≤ 600
+            metrics.inc(metrics.ITEMS, stage="download")
+            return guid, link, dest_url, reply.text, None
+        except Exception as e:
+            metrics.inc(metrics.FAILURES, stage="download", cause=metrics.cause(e))
+            return guid, link, dest_url, None, e
+        finally:
+            metrics.observe(metrics.STAGE_SECONDS, time.perf_counter() - start, stage="download")
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        try:
+            while True:
+                # Top up the window of in-flight items
+                for guid, link in itertools.islice(items, 2 * max_workers - len(pending)):
+                    pending.add(executor.submit(download, guid, link))
+                if len(pending) == 0:
+                    break
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
 
 
 def extract_single_tag(html, tag, attribute, value):
     return html.find(tag, {attribute: value}).text.replace("\r", "")
 
 
-def extract_multi_tag(html, tag, attribute, value, cut=0):
+def extract_multi_tag(html, tag, attribute, value, cut=0, stop=()):
     text = ''
     try:
         texts = html.find(tag, {attribute: value}).find_all("p")
-        text = ''
-        if cut == 0:
-            for paragraph in texts:
-                if paragraph.attrs == {}:
-                    text = text + paragraph.text + ' '
-        else:
-            for paragraph in texts[:cut]:
-                if paragraph.attrs == {}:
-                    text = text + paragraph.text + ' '
+        if cut != 0:
+            texts = texts[:cut]
+        for paragraph in texts:
+            if stop and paragraph.text.startswith(stop):
+                break
+            if paragraph.attrs == {}:
+                text = text + paragraph.text + ' '
     except:
         pass
     return text
@@ -227,7 +892,10 @@ def extract_multi_tag(html, tag, attribute, value, cut=0):
 def extract_fulltext(url, html=None):
     """Pull out content fulltext according the URL's hardcoded extraction scheme.
 
-    Raw HTML will be downloaded from the URL if *html* is None.
+    Raw HTML will be downloaded from the URL if *html* is None. The extraction
+    scheme is looked up in *EXTRACTORS* by the URL's registered domain. URLs
+    of sites without a fulltext extraction scheme raise NotImplementedError
+    before any HTML is downloaded or parsed.
 
     Parameters
     ----------
@@ -239,480 +907,452 @@ def extract_fulltext(url, html=None):
     html: str (optional)
         Raw HTML from which to extract the content fulltext.
     """
+    tld = domains.registered_domain(url)
+    errmsg = f"Incomplete handler for tld '{tld}' (url: {url})."
+    extractor = EXTRACTORS.get(tld)
+    if extractor is None or extractor.fulltext is None:
+        raise NotImplementedError(errmsg)
+
     if html is None:
-        response = requests.get(url)
+        response = throttle.get(url)
         response.raise_for_status()
         html = response.text
-    soup = bs4.BeautifulSoup(html, "html.parser")
-    extract = tldextract.extract(url.lower())
-    tld = f"{extract.domain}.{extract.suffix}"
-    result = ""
-
-    ## Dispatch to corresponding extraction scheme.
-    #
-    #  We wrap the logic into a try/except block
-    # to avoid code repetition. All missing or faulty implementation raises an exception, which
-    # is then caught to generate an error log and reraised.
 
+    # All missing or faulty implementation raises a NotImplementedError, which
+    # is reraised with the offending URL.
+    start = time.perf_counter()
     try:
-        if tld == "deraktionaer.de":
-            # Expect exactly one <div id="article-body"> ... </div>
-            divs = soup.find_all("div", {"id": "article-body"})
-            if divs is None or len(divs) != 1: raise NotImplementedError()
-
-            # Expect at least one paragraph
-            paragraphs = divs[0].find_all("p")
-            if paragraphs is None or len(paragraphs) == 0: raise NotImplementedError()
-
-            for p in paragraphs:
-                # Stop parsing at conflicts of interest
-                if p.text.startswith("Hinweis auf mögliche Interessenskonflikte"):
-                    break
-                result += f"{p.text}\n\n"
-            result = result.rstrip("\n")
-
-        elif tld == "stock-world.de":
-            # Expect exactly one <div class="w100 ibox_rss"> ... </div>
-            divs = soup.find_all("div", {"class": "w100 ibox_rss"})
-            if divs is None or len(divs) != 1: raise NotImplementedError()
-
-            # Nested inside a <p> are the content paragraphs
-            paragraph = divs[0].find("p")
-            for tag in [t for t in paragraph.children if t.name is not None]:  #FIXME: Why are there here tags without name?
-                # skip empty paragraphs, separator lines and short paragraphs
-                text = tag.text.rstrip()
-                if len(text) == 0 or text.startswith("___") or len(text.split(" ")) < 10:
-                    continue
-
-                # abort when banner or conflict of interests is reached
-                banner = tag.find("div", {"class": "banner_content"})
-                if banner is not None or text.startswith("Hinweis auf bestehende Interessen"):
-                    break
-
-                if tag.name == "p":
-                    # Remove newlines and tabs. Treat as proper paragraph.
-                    text = " ".join(text.split())
-                    result += f"{text}\n\n"
-            result = result.rstrip("\n")
-
-        elif tld == "4investors.de":
-            # Content stored in <article> tag
-            article = soup.find_all("article")
-            if len(article) != 1: raise NotImplementedError()
-
-            for tag in [t for t in article[0].children if t.name == "p"]:
-                # Skip date and author
-                if tag.text.find("- Autor:") != -1:
-                    continue
-
-                # End of article is always characterized by summary or stock data
-                end = tag.text.find("Wichtige charttechnische Daten")
-                if end == -1: raise NotImplementedError()
-                result += tag.text[:end]
-
-            # Remove ads
-            result = result.replace("Extrem günstig Aktien traden - Aktien-Sparpläne - die Top Depot-Anbieter", "")
-            result = result.rstrip("\n")
-
-        else:
-            raise NotImplementedError()
-
-    except NotImplementedError as e:
-        errmsg = f"Incomplete handler for tld '{tld}' (url: {url})."
+        scheme = extractor.fulltext
+        if isinstance(scheme, Rule):
+            return _rule_fulltext(scheme, _parse_html(html, scheme))
+        return scheme(_parse_html(html))
+    except NotImplementedError:
         raise NotImplementedError(errmsg)
-    except Exception as e:
-        raise
-
-    return result
-
-
-def cleanup_by_tld(html, tld) -> str:
-    html = bs4.BeautifulSoup(html, 'html.parser')
-    text = ""
-    if tld == 'finanznachrichten.de':
-        tag = html.find("div", {"id": "artikelTextPuffer"})
-        if tag is not None:
-            text = tag.text
-        try:
-            text = extract_single_tag(
-                html, "div", "id", "artikelTextPuffer")
-        except:
-            try:
-                text = extract_multi_tag(
-                    html, "div", "id", "artikelTextPuffer")
-            except:
-                pass
-
-    elif tld == 'ariva.de':
-        text = extract_multi_tag(
-            html, "div", "id", "pageSingleNews", -3)
-
-    elif tld == 'finanzen.at':
-        text = extract_single_tag(
-            html, "div", "class", "news-content")
+    finally:
+        metrics.observe(metrics.PARSE_SECONDS, time.perf_counter() - start, kind="article", domain=tld)
 
-    elif tld == 'deraktionaer.de':
-        text = extract_multi_tag(
-            html, "div", "id", "article-body", -1)
 
-    elif tld == 'fool.de':
-        text = extract_multi_tag(
-            html, "section", "id", "full_content", -1)
+def extract_fulltexts(records, max_workers: int = None, chunksize: int = 16, executor: ProcessPoolExecutor = None):
+    """Extract the fulltexts of many articles using multiple processes.
 
-    elif tld == 'timschaefermedia.com' or tld == 'feingold-research.com':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content")
+    Extraction is CPU-bound. Records are sent in chunks to a pool of worker
+    processes which run *extract_fulltext* on each of them. At most two
+    chunks per worker are in flight at any time, such that arbitrarily long
+    iterables, e.g. database cursors, may be passed.
 
-    elif tld == '4investors.de':
-        texts = html.find("article").find_all("p")[1].contents[:-9]
-        for paragraph in texts:
-            try:
-                text = text + paragraph + ' '
-            except:
-                pass
-
-    elif tld == 'markteinblicke.de':
-        text = extract_multi_tag(
-            html, "div", "class", "td-post-content", -2)
-
-    elif tld == 'moneycab.com':
-        text = extract_multi_tag(
-            html, "div", "class", "entry__post-content", -1)
-
-    elif tld == 't3n.de':
-        text = extract_multi_tag(
-            html, "div", "id", "main-content", -2)
-
-    elif tld == 'it-times.de':
-        text = extract_multi_tag(
-            html, "div", "class", "media-body")
+    Parameters
+    ----------
+    records: iterable of tuple
+        Tuples (key, url, html). *url* and *html* are passed to
+        *extract_fulltext*. *key* is an arbitrary identifier which is not sent
+        to the workers but handed back together with the result.
+
+    max_workers: int (optional)
+        Number of worker processes. Defaults to the number of CPUs. If 1, the
+        fulltexts are extracted in the calling process.
+
+    chunksize: int (optional)
+        Number of records sent to a worker at once.
+
+    executor: ProcessPoolExecutor (optional)
+        Pool of worker processes to use instead of starting a new one, e.g.
+        to avoid the startup cost when called repeatedly. The pool is not
+        shut down. *max_workers* should match the pool's size.
+
+    Yields
+    ------
+    tuple
+        Tuple (key, fulltext, error) for each record in order of completion.
+        Either *fulltext* is the extracted fulltext or *error* is the
+        exception raised by *extract_fulltext*; the other one is None.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    records = iter(records)
+    if executor is not None:
+        yield from _extract_fulltexts(executor, records, max_workers, chunksize)
+    elif max_workers == 1:
+        for key, url, html in records:
+            (fulltext, error), = _extract_fulltext_chunk([(url, html)])
+            yield key, fulltext, error
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            yield from _extract_fulltexts(executor, records, max_workers, chunksize)
 
-    elif tld == 'finanzen.net':
-        texts = html.find(
-            "div", {"id": "news-container"}).find_all("p", {"class": "TEXT"})
-        text = ''
-        for paragraph in texts:
-            text = text + paragraph.text + ' '
 
-    elif tld == 'nebenwerte-magazin.com':
+def _extract_fulltexts(executor, records, max_workers, chunksize):
+    pending = {}  # future -> keys of the chunk's records
+    try:
+        while True:
+            # Top up the window of in-flight chunks
+            while len(pending) < 2 * max_workers:
+                chunk = list(itertools.islice(records, chunksize))
+                if len(chunk) == 0:
+                    break
+                future = executor.submit(_extract_fulltext_worker, [(url, html) for _, url, html in chunk])
+                pending[future] = [key for key, _, _ in chunk]
+            if len(pending) == 0:
+                break
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                keys = pending.pop(future)
+                results, worker_metrics = future.result()
+                metrics.merge(worker_metrics)
+                for key, (fulltext, error) in zip(keys, results):
+                    yield key, fulltext, error
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _extract_fulltext_chunk(chunk):
+    """Run *extract_fulltext* on a list of (url, html) tuples."""
+    results = []
+    for url, html in chunk:
         try:
-            text = extract_multi_tag(
-                html, "div", "class", "article-description")
-        except:
-            text = extract_multi_tag(
-                html, "div", "class", "post_content", -6)
-
-    elif tld == 'goldinvest.de':
-        text = extract_multi_tag(
-            html, "div", "itemprop", "articleBody", -6)
-
-    elif tld == 'resource-capital.ch':
-        text = extract_multi_tag(
-            html, "div", "class", "entry__article", -3)
-
-    elif tld == 'rumas.de':
-        text = extract_multi_tag(
-            html, "div", "itemprop", "articleBody", -2)
-
-    elif tld == 'electrive.net':
-        text = extract_multi_tag(
-            html, "section", "class", "content")
-
-    elif tld == 'boerse-online.de':
-        text = extract_multi_tag(
-            html, "div", "class", "content news_detail", -4)
-
-    elif tld == 'bullvestorbb.com':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content", -13)
-
-    elif tld == 'boerse-daily.de':
-        text = extract_multi_tag(
-            html, "div", "class", "ce_text")
-
-    elif tld == 'finanzen.ch':
-        text = extract_multi_tag(
-            html, "div", "class", "instrument-description", -2)
+            with metrics.stage("extract"):
+                results.append((extract_fulltext(url, html), None))
+            metrics.inc(metrics.ITEMS, stage="extract")
+        except Exception as e:
+            results.append((None, e))
+    return results
 
-    elif tld == 'finanztreff.de':
-        text = extract_multi_tag(
-            html, "div", "class", "article")
 
-    elif tld == 'trading-treff.de':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content", -5)
+def _extract_fulltext_worker(chunk):
+    """Run *_extract_fulltext_chunk* in a worker process and hand back the worker's metrics."""
+    return _extract_fulltext_chunk(chunk), metrics.drain()
 
-    elif tld == 'start-trading.de':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content", -7)
 
-    elif tld == 'fuchsbriefe.de':
-        text = extract_multi_tag(
-            html, "div", "itemprop", "articlebody")
-
-    elif tld == 'ratgebergeld.at':
-        text = extract_multi_tag(
-            html, "div", "class", "wpb_text_column wpb_content_element", -6)
+def cleanup_by_tld(html, tld) -> str:
+    """Pull out content text according to the domain's legacy cleanup scheme.
 
-    elif tld == 'anlegerverlag.de':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content")
+    The scheme is looked up in *EXTRACTORS*. Domains without a cleanup scheme
+    are rejected before the HTML is parsed.
 
-    elif tld == 'investinghaven.com':
-        text = extract_multi_tag(
-            html, "div", "class", "content-inner", -1)
+    Parameters
+    ----------
+    html: str
+        Raw HTML from which to extract the content text.
 
-    elif tld == 'kapitalerhoehungen.de':
-        texts = html.find("article").find_all("p")
-        for paragraph in texts[:-4]:
-            if paragraph.attrs == {}:
-                text = text + paragraph.text + ' '
+    tld: str
+        Registered domain of the HTML's URL, e.g. 'finanzen.net'.
 
-    elif tld == 'mydividends.de':
-        text = extract_multi_tag(
-            html, "div", "itemprop", "articleBody", -1)
+    Returns
+    -------
+    str or None
+        Extracted text or None, if nothing could be extracted.
+    """
+    extractor = EXTRACTORS.get(tld)
+    if extractor is None:
+        log.debug(f"Missing handler for tld '{tld}'.")
+        return None
+    scheme = extractor.cleanup
+    if scheme is None:
+        return None
+
+    if isinstance(scheme, Rule):
+        soup = _parse_html(html, scheme)
+        if scheme.single:
+            text = extract_single_tag(soup, scheme.tag, scheme.attribute, scheme.value)
+        else:
+            text = extract_multi_tag(soup, scheme.tag, scheme.attribute, scheme.value, scheme.cut, scheme.stop)
+    else:
+        text = scheme(_parse_html(html))
+    return text if text else None
 
-    elif tld == 'esg-aktien.de':
-        text = extract_multi_tag(
-            html, "div", "id", "mainContent")
 
-    elif tld == 'ki-portal.de':
-        text = extract_multi_tag(
-            html, "div", "class", "content clearfix")
+## Extraction schemes.
+#
+# Each supported site is described by an entry in the registry *EXTRACTORS*,
+# which maps registered domains to their schemes. Most sites are covered by a
+# declarative *Rule*; irregular sites use a function which receives the parsed
+# HTML and returns the text.
 
-    elif tld == 'plastverarbeiter.de':
-        text = extract_multi_tag(
-            html, "section", "class", "post-content", -3)
+class Rule(typing.NamedTuple):
+    """Declarative extraction scheme locating content within <tag attribute="value">."""
 
-    elif tld == 'chemietechnik.de':
-        text = extract_multi_tag(
-            html, "article", "itemprop", "articleBody", -2)
+    tag: str
+    attribute: str
+    value: str
+    cut: int = 0  # keep paragraphs up to this (negative) index; 0 keeps all
+    stop: tuple = ()  # stop at the first paragraph starting with one of these markers
+    single: bool = False  # take the element's whole text instead of its paragraphs
 
-    elif tld == 'de.com':  # Subdomain prüfen
-        text = extract_multi_tag(
-            html, "div", "id", "fxs_article_body", -1)
 
-    elif tld == 'bondguide.de':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content", -1)
+class Extractor(typing.NamedTuple):
+    """Extraction schemes of a domain. Either may be a Rule, a function or None if unsupported."""
 
-    elif tld == 'inv3st.de':
-        texts = html.find("article").find_all("p")
-        for paragraph in texts[:-6]:
-            if paragraph.attrs == {}:
-                text = text + paragraph.text + ' '
+    fulltext: object = None  # used by extract_fulltext()
+    cleanup: object = None  # used by cleanup_by_tld()
 
-    elif tld == 'mein-geld-medien.de':
-        text = extract_multi_tag(
-            html, "div", "itemprop", "articleBody", -1)
 
-    elif tld == 'boersengefluester.de':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content", -1)
+def _parse_html(html, rule=None):
+    """Parse HTML. If a rule is given only the elements it refers to are parsed."""
+    import bs4
+    return bs4.BeautifulSoup(html, "html.parser", parse_only=_strainer(rule) if rule is not None else None)
 
-    elif tld == 'stock-world.de':  # recheck
-        pass
 
-    elif tld == 'kgk-rubberpoint.de':
-        text = extract_multi_tag(
-            html, "section", "class", "post-content")
+def _rule_fulltext(rule, soup):
+    # Expect exactly one container with at least one paragraph
+    containers = soup.find_all(rule.tag, {rule.attribute: rule.value})
+    if len(containers) != 1: raise NotImplementedError()
+    if rule.single:
+        return containers[0].text
+    paragraphs = containers[0].find_all("p")
+    if rule.cut != 0:
+        paragraphs = paragraphs[:rule.cut]
+    if len(paragraphs) == 0: raise NotImplementedError()
 
-    elif tld == 'boersennews.de':
-        text = extract_multi_tag(
-            html, "div", "itemprop", "articleBody", -8)
+    result = ""
+    for p in paragraphs:
+        if rule.stop and p.text.startswith(rule.stop):
+            break
+        result += f"{p.text}\n\n"
+    return result.rstrip("\n")
 
-    elif tld == 'boerse-global.de':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content clearfix", -2)
 
-    elif tld == 'lynxbroker.de':
-        text = extract_multi_tag(
-            html, "div", "class", "article__content", -2)
+def _fulltext_stock_world(soup):
+    # Expect exactly one <div class="w100 ibox_rss"> ... </div>
+    divs = soup.find_all("div", {"class": "w100 ibox_rss"})
+    if divs is None or len(divs) != 1: raise NotImplementedError()
 
-    elif tld == 'anleihen-finder.de':
-        text = extract_multi_tag(
-            html, "div", "class", "news", -20)
+    # Nested inside a <p> are the content paragraphs
+    result = ""
+    paragraph = divs[0].find("p")
+    for tag in [t for t in paragraph.children if t.name is not None]:  #FIXME: Why are there here tags without name?
+        # skip empty paragraphs, separator lines and short paragraphs
+        text = tag.text.rstrip()
+        if len(text) == 0 or text.startswith("___") or len(text.split(" ")) < 10:
+            continue
+
+        # abort when banner or conflict of interests is reached
+        banner = tag.find("div", {"class": "banner_content"})
+        if banner is not None or text.startswith("Hinweis auf bestehende Interessen"):
+            break
+
+        if tag.name == "p":
+            # Remove newlines and tabs. Treat as proper paragraph.
+            text = " ".join(text.split())
+            result += f"{text}\n\n"
+    return result.rstrip("\n")
+
+
+def _fulltext_4investors(soup):
+    # Content stored in <article> tag
+    article = soup.find_all("article")
+    if len(article) != 1: raise NotImplementedError()
 
-    elif tld == 'onvista.de':
-        # text = extract_multi_tag(
-        #     html, "div", "id", "newsContentContainer", -2)
-        try:
-            texts = html.find(
-                "div", {"id": 'newsContentContainer'}).find_all("font")
-            for paragraph in texts[:-5]:
-                text = text + paragraph.text + ' '
-            if text == '':
-                text = extract_multi_tag(
-                    html, "div", "id", "newsContentContainer")
-        except:
-            pass
+    result = ""
+    for tag in [t for t in article[0].children if t.name == "p"]:
+        # Skip date and author
+        if tag.text.find("- Autor:") != -1:
+            continue
 
-    elif tld == 'xtb.com':
-        text = extract_multi_tag(
-            html, "div", "class", "market-news-single-content", -1)
+        # End of article is always characterized by summary or stock data
+        end = tag.text.find("Wichtige charttechnische Daten")
+        if end == -1: raise NotImplementedError()
+        result += tag.text[:end]
 
-    elif tld == 'anleihencheck.de':
-        text = html.find("span", {"class": "analysen_content"}).text
+    # Remove ads
+    result = result.replace("Extrem günstig Aktien traden - Aktien-Sparpläne - die Top Depot-Anbieter", "")
+    return result.rstrip("\n")
 
-    elif tld == 'asscompact.de':
-        text = extract_multi_tag(
-            html, "div", "class", "story-body", -1)
 
-    elif tld == 'boerse.de':
-        text = extract_multi_tag(
-            html, "div", "class", "newsBox readMe", -1)
+def _cleanup_finanznachrichten(html):
+    tag = html.find("div", {"id": "artikelTextPuffer"})
+    return tag.text.replace("\r", "") if tag is not None else ""
 
-    elif tld == 'abam-gmbh.com':
-        texts = html.find("div", {
-                          "class": "fusion-column-wrapper fusion-flex-column-wrapper-legacy"}).find_all("p")
-        for paragraph in texts:
-            if paragraph.attrs == {}:
-                text = text + paragraph.text + ' '
 
-    elif tld == 'solarserver.de':
+def _cleanup_4investors(html):
+    text = ""
+    texts = html.find("article").find_all("p")[1].contents[:-9]
+    for paragraph in texts:
         try:
-            text = extract_multi_tag(
-                html, "div", "class", "postContent bodyCopy entry-content clearfix", -1)
+            text = text + paragraph + ' '
         except:
             pass
+    return text
 
-    elif tld == 'platow.de':
-        text = extract_multi_tag(
-            html, "div", "class", "article-description")
-
-    elif tld == 'index-radar.de':
-        text = extract_multi_tag(
-            html, "div", "class", "post-content", -7)
-
-    elif tld == 'finance-magazin.de':
-        text = extract_multi_tag(
-            html, "section", "id", "content", -1)
-
-    elif tld == 'pv-magazine.de':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content", -1)
-
-    elif tld == 'neue-verpackung.de':
-        text = extract_multi_tag(
-            html, "article", "class", "article")
-
-    elif tld == 'peh.de':
-        text = extract_multi_tag(
-            html, "div", "class", "financity-single-article-content", -1)
-
-    elif tld == 'euwid-recycling.de':
-        text = extract_multi_tag(
-            html, "div", "class", "news-single-item", -3)
-
-    elif tld == 'aktien-global.de':
-        text = extract_multi_tag(
-            html, "div", "itemprop", "articleBody", -1)
 
-    elif tld == 'automobil-produktion.de':
-        text = extract_multi_tag(
-            html, "article", "itemprop", "articleBody", -2)
+def _cleanup_finanzen_net(html):
+    texts = html.find(
+        "div", {"id": "news-container"}).find_all("p", {"class": "TEXT"})
+    text = ''
+    for paragraph in texts:
+        text = text + paragraph.text + ' '
+    return text
 
-    elif tld == 'derboersianer.com':
-        text = extract_multi_tag(
-            html, "div", "class", "entry post-entry")
 
-    elif tld == 'finanzjournalisten.de':
-        texts = html.find_all("div", {
-            "class": "et_pb_text_inner"})[1].find_all("p")
-        for paragraph in texts:
+def _cleanup_article_paragraphs(cut):
+    """Return cleanup scheme joining the plain paragraphs of <article> up to index *cut*."""
+    def cleanup(html):
+        text = ""
+        texts = html.find("article").find_all("p")
+        for paragraph in texts[:cut]:
             if paragraph.attrs == {}:
                 text = text + paragraph.text + ' '
+        return text
+    return cleanup
 
-    elif tld == 'shareribs.com':
-        text = extract_single_tag(
-            html, "div", "class", "newsbody")
-
-    elif tld == 'fondscheck.de':
-        text = extract_single_tag(
-            html, "span", "class", "analysen_content")
 
-    elif tld == 'plusvisionen.de':
-        text = extract_multi_tag(
-            html, "div", "class", "entry")
-
-    elif tld == 'fondsdiscount.de':
-        text = extract_multi_tag(
-            html, "div", "class", "article-body", -2)
-
-    elif tld == 'investresearch.net':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content")
-
-    elif tld == 'rohstoffbrief.com':
-        text = extract_multi_tag(
-            html, "div", "class", "post-content", -7)
-
-    elif tld == 'heizoel24.de':
-        text = extract_multi_tag(
-            html, "span", "itemprop", "articleBody")
-
-    elif tld == 'ideas-daily.de':
-        text = extract_multi_tag(
-            html, "section", "id", "main-content-section")
-
-    elif tld == 'aktien.guide':
-        text = extract_multi_tag(
-            html, "div", "class", "news-content", -2)
-
-    elif tld == 'ntg24.de':
-        text = extract_multi_tag(
-            html, "div", "class", "articleContent", -1)
-
-    elif tld == 'kapitalmarkt.blog':
-        text = extract_multi_tag(
-            html, "div", "class", "post-entry", -3)
+def _cleanup_onvista(html):
+    text = ""
+    try:
+        texts = html.find(
+            "div", {"id": 'newsContentContainer'}).find_all("font")
+        for paragraph in texts[:-5]:
+            text = text + paragraph.text + ' '
+        if text == '':
+            text = extract_multi_tag(
+                html, "div", "id", "newsContentContainer")
+    except:
+        pass
+    return text
 
-    elif tld == 'world-news-monitor.de':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content")
 
-    elif tld == 'miningscout.de':
-        text = extract_multi_tag(
-            html, "div", "class", "post-content", -1)
+def _cleanup_anleihencheck(html):
+    return html.find("span", {"class": "analysen_content"}).text
 
-    elif tld == 'nebenwerte-online.de':
-        text = extract_multi_tag(
-            html, "div", "class", "entry-content", -1)
 
-    elif tld == 'ideas-magazin.de':
-        text = extract_multi_tag(
-            html, "div", "class", "ce-bodytext")
+def _cleanup_abam(html):
+    text = ""
+    texts = html.find("div", {
+                      "class": "fusion-column-wrapper fusion-flex-column-wrapper-legacy"}).find_all("p")
+    for paragraph in texts:
+        if paragraph.attrs == {}:
+            text = text + paragraph.text + ' '
+    return text
 
-    elif tld == 'vontobel.com':
-        text = extract_multi_tag(
-            html, "span", "class", "column three details", -1)
 
-    elif tld == 'aktienfinder.net':
-        text = extract_multi_tag(
-            html, "div", "class", "the_content_wrapper", -1)
-    elif tld == 'smartinvestor.de':
-        text = extract_multi_tag(
-            html, "div", "id", "content", -15)
+def _cleanup_finanzjournalisten(html):
+    text = ""
+    texts = html.find_all("div", {
+        "class": "et_pb_text_inner"})[1].find_all("p")
+    for paragraph in texts:
+        if paragraph.attrs == {}:
+            text = text + paragraph.text + ' '
+    return text
 
-    elif tld == 'intelligent-investieren.net' or tld == 'scenarieconomici.it' or tld == 'tichyseinblick.de' or tld == 'tmx.com':
-        pass
-    elif tld == 'sg-zertifikate.de' or tld == 'boerse-social.com' or tld == 'clausvogt.com' or tld == 'hsbc-zertifikate.de':
-        pass
-    elif tld == 'formationstrader.de' or tld == 'mailchi.mp' or tld == 'fruchtportal.de' or tld == 'derfinanzinvestor.de':
-        pass
-    elif tld == 'youtube.com' or tld == 'ethische-rendite.de' or tld == 'deutsche-wirtschafts-nachrichten.de':
-        pass
-    elif tld == 'pharma-food.de' or tld == 'onemarkets.de' or tld == 'was-audio.de' or tld == 'oddo-bhf.com':
-        pass
-    elif tld == 'assetstandard.com' or tld == 'tradingeconomics.com' or tld == 'barchart.com' or tld == 'bnpparibas.com':
-        pass
-    elif tld == 'finanzen100.de' or tld == 'wallstreet-online.de':
-        pass
-    else:
-        print(tld)
-        pass
 
-    return text if text else None
+EXTRACTORS = {
+    "finanznachrichten.de": Extractor(cleanup=_cleanup_finanznachrichten),
+    "deraktionaer.de": Extractor(
+        fulltext=Rule("div", "id", "article-body", stop=("Hinweis auf mögliche Interessenskonflikte",)),
+        cleanup=Rule("div", "id", "article-body", -1)),
+    "stock-world.de": Extractor(fulltext=_fulltext_stock_world),  # cleanup: recheck
+    "4investors.de": Extractor(fulltext=_fulltext_4investors, cleanup=_cleanup_4investors),
+    "ariva.de": Extractor(cleanup=Rule("div", "id", "pageSingleNews", -3)),
+    "finanzen.at": Extractor(cleanup=Rule("div", "class", "news-content", single=True)),
+    "fool.de": Extractor(cleanup=Rule("section", "id", "full_content", -1)),
+    "timschaefermedia.com": Extractor(cleanup=Rule("div", "class", "entry-content")),
+    "feingold-research.com": Extractor(cleanup=Rule("div", "class", "entry-content")),
+    "markteinblicke.de": Extractor(cleanup=Rule("div", "class", "td-post-content", -2)),
+    "moneycab.com": Extractor(cleanup=Rule("div", "class", "entry__post-content", -1)),
+    "t3n.de": Extractor(cleanup=Rule("div", "id", "main-content", -2)),
+    "it-times.de": Extractor(cleanup=Rule("div", "class", "media-body")),
+    "finanzen.net": Extractor(cleanup=_cleanup_finanzen_net),
+    "nebenwerte-magazin.com": Extractor(cleanup=Rule("div", "class", "article-description")),
+    "goldinvest.de": Extractor(cleanup=Rule("div", "itemprop", "articleBody", -6)),
+    "resource-capital.ch": Extractor(cleanup=Rule("div", "class", "entry__article", -3)),
+    "rumas.de": Extractor(cleanup=Rule("div", "itemprop", "articleBody", -2)),
+    "electrive.net": Extractor(cleanup=Rule("section", "class", "content")),
+    "boerse-online.de": Extractor(cleanup=Rule("div", "class", "content news_detail", -4)),
+    "bullvestorbb.com": Extractor(cleanup=Rule("div", "class", "entry-content", -13)),
+    "boerse-daily.de": Extractor(cleanup=Rule("div", "class", "ce_text")),
+    "finanzen.ch": Extractor(cleanup=Rule("div", "class", "instrument-description", -2)),
+    "finanztreff.de": Extractor(cleanup=Rule("div", "class", "article")),
+    "trading-treff.de": Extractor(cleanup=Rule("div", "class", "entry-content", -5)),
+    "start-trading.de": Extractor(cleanup=Rule("div", "class", "entry-content", -7)),
+    "fuchsbriefe.de": Extractor(cleanup=Rule("div", "itemprop", "articlebody")),
+    "ratgebergeld.at": Extractor(cleanup=Rule("div", "class", "wpb_text_column wpb_content_element", -6)),
+    "anlegerverlag.de": Extractor(cleanup=Rule("div", "class", "entry-content")),
+    "investinghaven.com": Extractor(cleanup=Rule("div", "class", "content-inner", -1)),
+    "kapitalerhoehungen.de": Extractor(cleanup=_cleanup_article_paragraphs(-4)),
+    "mydividends.de": Extractor(cleanup=Rule("div", "itemprop", "articleBody", -1)),
+    "esg-aktien.de": Extractor(cleanup=Rule("div", "id", "mainContent")),
+    "ki-portal.de": Extractor(cleanup=Rule("div", "class", "content clearfix")),
+    "plastverarbeiter.de": Extractor(cleanup=Rule("section", "class", "post-content", -3)),
+    "chemietechnik.de": Extractor(cleanup=Rule("article", "itemprop", "articleBody", -2)),
+    "de.com": Extractor(cleanup=Rule("div", "id", "fxs_article_body", -1)),  # Subdomain prüfen
+    "bondguide.de": Extractor(cleanup=Rule("div", "class", "entry-content", -1)),
+    "inv3st.de": Extractor(cleanup=_cleanup_article_paragraphs(-6)),
+    "mein-geld-medien.de": Extractor(cleanup=Rule("div", "itemprop", "articleBody", -1)),
+    "boersengefluester.de": Extractor(cleanup=Rule("div", "class", "entry-content", -1)),
+    "kgk-rubberpoint.de": Extractor(cleanup=Rule("section", "class", "post-content")),
+    "boersennews.de": Extractor(cleanup=Rule("div", "itemprop", "articleBody", -8)),
+    "boerse-global.de": Extractor(cleanup=Rule("div", "class", "entry-content clearfix", -2)),
+    "lynxbroker.de": Extractor(cleanup=Rule("div", "class", "article__content", -2)),
+    "anleihen-finder.de": Extractor(cleanup=Rule("div", "class", "news", -20)),
+    "onvista.de": Extractor(cleanup=_cleanup_onvista),
+    "xtb.com": Extractor(cleanup=Rule("div", "class", "market-news-single-content", -1)),
+    "anleihencheck.de": Extractor(cleanup=_cleanup_anleihencheck),
+    "asscompact.de": Extractor(cleanup=Rule("div", "class", "story-body", -1)),
+    "boerse.de": Extractor(cleanup=Rule("div", "class", "newsBox readMe", -1)),
+    "abam-gmbh.com": Extractor(cleanup=_cleanup_abam),
+    "solarserver.de": Extractor(cleanup=Rule("div", "class", "postContent bodyCopy entry-content clearfix", -1)),
+    "platow.de": Extractor(cleanup=Rule("div", "class", "article-description")),
+    "index-radar.de": Extractor(cleanup=Rule("div", "class", "post-content", -7)),
+    "finance-magazin.de": Extractor(cleanup=Rule("section", "id", "content", -1)),
+    "pv-magazine.de": Extractor(cleanup=Rule("div", "class", "entry-content", -1)),
+    "neue-verpackung.de": Extractor(cleanup=Rule("article", "class", "article")),
+    "peh.de": Extractor(cleanup=Rule("div", "class", "financity-single-article-content", -1)),
+    "euwid-recycling.de": Extractor(cleanup=Rule("div", "class", "news-single-item", -3)),
+    "aktien-global.de": Extractor(cleanup=Rule("div", "itemprop", "articleBody", -1)),
+    "automobil-produktion.de": Extractor(cleanup=Rule("article", "itemprop", "articleBody", -2)),
+    "derboersianer.com": Extractor(cleanup=Rule("div", "class", "entry post-entry")),
+    "finanzjournalisten.de": Extractor(cleanup=_cleanup_finanzjournalisten),
+    "shareribs.com": Extractor(cleanup=Rule("div", "class", "newsbody", single=True)),
+    "fondscheck.de": Extractor(cleanup=Rule("span", "class", "analysen_content", single=True)),
+    "plusvisionen.de": Extractor(cleanup=Rule("div", "class", "entry")),
+    "fondsdiscount.de": Extractor(cleanup=Rule("div", "class", "article-body", -2)),
+    "investresearch.net": Extractor(cleanup=Rule("div", "class", "entry-content")),
+    "rohstoffbrief.com": Extractor(cleanup=Rule("div", "class", "post-content", -7)),
+    "heizoel24.de": Extractor(cleanup=Rule("span", "itemprop", "articleBody")),
+    "ideas-daily.de": Extractor(cleanup=Rule("section", "id", "main-content-section")),
+    "aktien.guide": Extractor(cleanup=Rule("div", "class", "news-content", -2)),
+    "ntg24.de": Extractor(cleanup=Rule("div", "class", "articleContent", -1)),
+    "kapitalmarkt.blog": Extractor(cleanup=Rule("div", "class", "post-entry", -3)),
+    "world-news-monitor.de": Extractor(cleanup=Rule("div", "class", "entry-content")),
+    "miningscout.de": Extractor(cleanup=Rule("div", "class", "post-content", -1)),
+    "nebenwerte-online.de": Extractor(cleanup=Rule("div", "class", "entry-content", -1)),
+    "ideas-magazin.de": Extractor(cleanup=Rule("div", "class", "ce-bodytext")),
+    "vontobel.com": Extractor(cleanup=Rule("span", "class", "column three details", -1)),
+    "aktienfinder.net": Extractor(cleanup=Rule("div", "class", "the_content_wrapper", -1)),
+    "smartinvestor.de": Extractor(cleanup=Rule("div", "id", "content", -15)),
+}
+
+# Known sites which are not supported (yet).
+EXTRACTORS.update((tld, Extractor()) for tld in [
+    "intelligent-investieren.net", "scenarieconomici.it", "tichyseinblick.de", "tmx.com", "sg-zertifikate.de",
+    "boerse-social.com", "clausvogt.com", "hsbc-zertifikate.de", "formationstrader.de", "mailchi.mp",
+    "fruchtportal.de", "derfinanzinvestor.de", "youtube.com", "ethische-rendite.de",
+    "deutsche-wirtschafts-nachrichten.de", "pharma-food.de", "onemarkets.de", "was-audio.de", "oddo-bhf.com",
+    "assetstandard.com", "tradingeconomics.com", "barchart.com", "bnpparibas.com", "finanzen100.de",
+    "wallstreet-online.de"])
+
+
+@functools.lru_cache(maxsize=None)
+def _strainer(rule):
+    """Return SoupStrainer restricting parsing to the elements a rule refers to.
+
+    Rules only ever need the element they refer to. Strainers are built once
+    per rule.
+
+    'class' is a multi-valued attribute which find() matches by individual
+    classes, whereas strainers see the raw attribute value. Hence, class rules
+    accept any element carrying all of the rule's classes and leave the exact
+    match to find().
+    """
+    import bs4
+    if rule.attribute != "class":
+        return bs4.SoupStrainer(rule.tag, {rule.attribute: rule.value})
+    classes = rule.value.split()
+
+    def match(value):
+        if value is None:
+            return False
+        value = value.split() if isinstance(value, str) else value
+        return all(c in value for c in classes)
+    return bs4.SoupStrainer(rule.tag, {"class": match})
 
 
 if __name__ == "__main__":
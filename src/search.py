@@ -0,0 +1,157 @@
+"""Full-text search over the catalog's texts."""
+import logging
+log = logging.getLogger("stockbro")
+
+import sqlite3
+import typing
+
+from src import util
+
+# The index is an external content table: it stores only the inverted index
+# and reads title, description and fulltext from 'texts' by rowid. Tokens are
+# split at any non-alphanumeric character such that parts of hyphenated
+# German compounds ('Tesla-Aktie') are found individually. Umlauts and other
+# diacritics are folded ('Börse' matches 'Borse') and the prefix indexes
+# speed up prefix queries ('Aktie*') which stand in for stemming, as the
+# stock stemmer of FTS5 is English-only.
+CREATE_INDEX = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS texts_fts USING fts5 (
+        title,
+        description,
+        fulltext,
+        content='texts',
+        content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='3 4'
+    )"""
+
+# Keep the index in sync with 'texts'
+CREATE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS texts_fts_insert AFTER INSERT ON texts BEGIN
+        INSERT INTO texts_fts (rowid, title, description, fulltext)
+        VALUES (new.rowid, new.title, new.description, new.fulltext);
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS texts_fts_delete AFTER DELETE ON texts BEGIN
+        INSERT INTO texts_fts (texts_fts, rowid, title, description, fulltext)
+        VALUES ('delete', old.rowid, old.title, old.description, old.fulltext);
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS texts_fts_update AFTER UPDATE ON texts BEGIN
+        INSERT INTO texts_fts (texts_fts, rowid, title, description, fulltext)
+        VALUES ('delete', old.rowid, old.title, old.description, old.fulltext);
+        INSERT INTO texts_fts (rowid, title, description, fulltext)
+        VALUES (new.rowid, new.title, new.description, new.fulltext);
+    END""",
+)
+
+# Weights of title, description and fulltext when ranking hits via BM25
+RANK = "bm25(10.0, 5.0, 1.0)"
+
+
+class Hit(typing.NamedTuple):
+    """Search result, see *search*."""
+
+    url: str
+    date: str
+    title: str
+    snippet: str  # excerpt of the best-matching column with matches highlighted
+    score: float  # BM25 score, lower is better
+
+
+def create_index(conn: sqlite3.Connection) -> bool:
+    """Create the full-text index of the 'texts' table if it does not exist.
+
+    New indexes are populated from existing texts. Afterwards, triggers keep
+    the index up to date with inserts, updates and deletes on 'texts'.
+
+    The index refers to texts by rowid. As 'VACUUM' may renumber rowids of
+    the 'texts' table, call *rebuild_index* after vacuuming the database.
+
+    Returns
+    -------
+    bool
+        True if the index was created, False if it already existed.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'texts_fts'").fetchone()
+    with util.transaction(conn):  # includes DDL statements
+        conn.execute(CREATE_INDEX)
+        for statement in CREATE_TRIGGERS:
+            conn.execute(statement)
+        if not exists:
+            conn.execute(f"INSERT INTO texts_fts (texts_fts, rank) VALUES ('rank', '{RANK}')")
+            conn.execute("INSERT INTO texts_fts (texts_fts) VALUES ('rebuild')")
+    if not exists:
+        log.info("Created full-text index of texts.")
+    return not exists
+
+
+def rebuild_index(conn: sqlite3.Connection):
+    """Rebuild the full-text index from the 'texts' table and optimize it."""
+    conn.execute("INSERT INTO texts_fts (texts_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO texts_fts (texts_fts) VALUES ('optimize')")
+    conn.commit()
+
+
+def search(conn: sqlite3.Connection, query: str, limit: int = 10, raw: bool = False, since: int = None) -> list:
+    """Search texts and return hits ranked by relevance.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the catalog database, see *create_index*.
+
+    query: str
+        Search terms. All terms must occur in a text for it to match. A term
+        ending in '*' matches any word starting with it, e.g. 'Dividend*'.
+
+    limit: int (optional)
+        Maximum number of hits.
+
+    raw: bool (optional)
+        Pass query to SQLite as is, which allows the full FTS5 query syntax,
+        e.g. 'title:Tesla AND (Aktie OR Anleihe)'.
+
+    since: int (optional)
+        UNIX time; only texts published afterwards match, see *dates*. With
+        an empty query, the texts published since are returned newest first,
+        with their description as snippet and a score of 0.
+
+    Returns
+    -------
+    list of Hit
+        Hits, most relevant first.
+    """
+    if not raw:
+        query = quote(query)
+    if not query and since is not None:
+        rows = conn.execute("""
+            SELECT url, date, title, COALESCE(description, ''), 0.0 FROM texts
+            WHERE published >= ?
+            ORDER BY published DESC
+            LIMIT ?""", (since, limit))
+        return [Hit(*row) for row in rows]
+    if not query:
+        return []
+    rows = conn.execute("""
+        SELECT texts.url, texts.date, texts.title, snippet(texts_fts, -1, '[', ']', '...', 16), texts_fts.rank
+        FROM texts_fts JOIN texts ON texts.rowid = texts_fts.rowid
+        WHERE texts_fts MATCH ? AND (? IS NULL OR texts.published >= ?)
+        ORDER BY texts_fts.rank
+        LIMIT ?""", (query, since, since, limit))
+    return [Hit(*row) for row in rows]
+
+
+def quote(query: str) -> str:
+    """Turn whitespace-separated terms into an FTS5 query matching all of them literally.
+
+    E.g. 'Tesla-Aktie Dividend*' becomes '"Tesla-Aktie" "Dividend"*'.
+    """
+    terms = []
+    for term in query.split():
+        prefix = term.endswith("*")
+        term = term.rstrip("*")
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
@@ -0,0 +1,99 @@
+"""Measurement of the startup time of command-line interfaces."""
+import logging
+log = logging.getLogger("stockbro")
+
+import argparse
+import subprocess
+import sys
+import time
+import typing
+
+DEFAULT_BUDGET = 0.2  # seconds a command may take to start, including the interpreter's startup
+DEFAULT_REPEAT = 5  # number of runs per command; the fastest one counts
+
+
+class Startup(typing.NamedTuple):
+    """Startup time of a command, see *measure*."""
+
+    command: list  # subcommands, e.g. ["rss", "fetch"]
+    seconds: float  # wall-clock time until the command's arguments have been parsed
+    imports: list  # (module, seconds) of the modules imported at top level, slowest first
+
+
+def commands(parser: argparse.ArgumentParser, prefix: list = None) -> list:
+    """Return all subcommands of an argument parser, e.g. [[], ["rss"], ["rss", "fetch"], ...]."""
+    prefix = prefix or []
+    result = [prefix]
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            for name, subparser in action.choices.items():
+                result += commands(subparser, prefix + [name])
+    return result
+
+
+def measure(script: str, command: list, repeat: int = DEFAULT_REPEAT) -> Startup:
+    """Measure the time a command takes to start.
+
+    The command is run with '--help' in a fresh interpreter, such that it
+    exits right after its module-level imports and argument parsing. That is
+    the cost paid by every invocation before any work is done. The imports
+    are timed by an extra run with Python's '-X importtime' option.
+
+    Parameters
+    ----------
+    script: str
+        Path of the script, e.g. 'stockbro2.py'.
+
+    command: list of str
+        Subcommands to pass to the script.
+
+    repeat: int (optional)
+        Number of timed runs. The fastest one counts.
+
+    Returns
+    -------
+    Startup
+        Startup time and imports of the command.
+    """
+    argv = [script, *command, "--help"]
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *argv], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    # Lines read 'import time: <self us> | <cumulative us> | <module>', where
+    # the module name is indented by its depth in the import tree.
+    stderr = subprocess.run([sys.executable, "-X", "importtime", *argv], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True, check=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, module = line.split("|")
+        if cumulative.strip().isdigit() and not module.startswith("  "):
+            imports.append((module.strip(), int(cumulative) / 1e6))
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return Startup(command, seconds, imports)
+
+
+def report(script: str, parser: argparse.ArgumentParser, budget: float = DEFAULT_BUDGET,
+           repeat: int = DEFAULT_REPEAT, top: int = 5) -> bool:
+    """Print the startup time and slowest imports of every subcommand of a script.
+
+    Returns
+    -------
+    bool
+        True if all commands start within the budget.
+    """
+    within_budget = True
+    for command in commands(parser):
+        startup = measure(script, command, repeat)
+        over = startup.seconds > budget
+        within_budget = within_budget and not over
+        print(f"{startup.seconds * 1000:7.1f} ms  {'OVER BUDGET' if over else 'ok':11s}  "
+              f"{' '.join([script] + command)}")
+        for module, seconds in startup.imports[:top]:
+            print(f"{'':22s}{seconds * 1000:7.1f} ms  import {module}")
+    print(f"Budget: {budget * 1000:.0f} ms per command.")
+    return within_budget
@@ -0,0 +1,184 @@
+"""Detection of ticker symbols mentioned in texts."""
+import logging
+log = logging.getLogger("stockbro")
+
+import collections
+import sqlite3
+import typing
+from pathlib import Path
+
+from src import util
+
+SYMBOLS_PATH = Path(__file__).resolve().parent.parent / "assets" / "symbols.nsv"
+
+
+class Automaton(typing.NamedTuple):
+    """Aho-Corasick automaton matching many symbols in a single pass, see *compile_symbols*."""
+
+    goto: list  # state -> dict mapping characters to successor states
+    fail: list  # state -> state of the longest proper suffix which is a prefix of some symbol
+    output: list  # state -> tuple of symbols ending in this state
+
+
+def load_symbols(path=SYMBOLS_PATH) -> list:
+    """Read symbols from a file of newline-separated values. Blank lines are ignored."""
+    with open(str(path), encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def compile_symbols(symbols: list) -> Automaton:
+    """Compile symbols into an Aho-Corasick automaton.
+
+    Compilation is linear in the total length of all symbols and needs to be
+    done once. Afterwards, texts are scanned in time linear in their length
+    and the number of matches, regardless of the number of symbols.
+
+    Parameters
+    ----------
+    symbols: list of str
+        Symbols to match, e.g. ["AAPL", "TSLA"]. Matching is case-sensitive.
+
+    Returns
+    -------
+    Automaton
+        Automaton to pass to *find_symbols*.
+    """
+    goto, fail, output = [{}], [0], [()]
+
+    # Build trie
+    for symbol in symbols:
+        state = 0
+        for char in symbol:
+            if char not in goto[state]:
+                goto.append({})
+                fail.append(0)
+                output.append(())
+                goto[state][char] = len(goto) - 1
+            state = goto[state][char]
+        if symbol not in output[state]:
+            output[state] += (symbol,)
+
+    # Compute failure links breadth-first. The outputs of a state's failure
+    # link are merged into its own outputs such that no links need to be
+    # followed to report matches while scanning.
+    queue = collections.deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, successor in goto[state].items():
+            queue.append(successor)
+            fallback = fail[state]
+            while fallback != 0 and char not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[successor] = goto[fallback].get(char, 0)
+            output[successor] += output[fail[successor]]
+    return Automaton(goto, fail, output)
+
+
+def find_symbols(automaton: Automaton, text: str) -> list:
+    """Return symbols mentioned verbatim in a text.
+
+    A symbol is only matched as a whole word, i.e. if it is neither preceded
+    nor followed by a letter, digit or underscore. E.g. 'AMD' matches in
+    'AMD-Aktie' and '$AMD', but not in 'AMDOCS'.
+
+    Parameters
+    ----------
+    automaton: Automaton
+        Compiled symbols, see *compile_symbols*.
+
+    text: str
+        Text to scan.
+
+    Returns
+    -------
+    list of str
+        Distinct matched symbols in order of their first occurrence.
+    """
+    goto, fail, output = automaton
+    found = {}  # dict preserves insertion order
+    state = 0
+    for ii, char in enumerate(text):
+        while state != 0 and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        for symbol in output[state]:
+            start, end = ii - len(symbol) + 1, ii + 1
+            if (start == 0 or not _is_word_char(text[start - 1])) \
+                    and (end == len(text) or not _is_word_char(text[end])):
+                found[symbol] = None
+    return list(found)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def analyze_texts(conn: sqlite3.Connection, automaton: Automaton, maxitems: int = None,
+                  batchsize: int = 256) -> int:
+    """Scan catalog texts for symbols and store the results to the 'analysis' table.
+
+    Texts without an entry in the 'analysis' table are scanned. Title,
+    description and fulltext of a text are scanned in a single pass. Matched
+    symbols are stored comma-separated in the 'symbols_verbatim' column;
+    texts without matches are stored with an empty string such that they are
+    not scanned again. Results are inserted and committed in batches, see
+    *store_analysis*.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the catalog database.
+
+    automaton: Automaton
+        Compiled symbols, see *compile_symbols*.
+
+    maxitems: int (optional)
+        Maximum number of texts to scan. All pending texts are scanned if
+        None.
+
+    batchsize: int (optional)
+        Number of results inserted per transaction.
+
+    Returns
+    -------
+    int
+        Number of scanned texts.
+    """
+    query = "SELECT texts.url, texts.date, texts.title, texts.description, texts.fulltext " \
+        "FROM texts LEFT JOIN analysis USING (url, date) WHERE analysis.url IS NULL"
+    if maxitems is not None:
+        query += f" LIMIT {int(maxitems)}"
+    # Read all pending texts first; the table is written to while scanning.
+    return store_analysis(conn, automaton, conn.execute(query).fetchall(), batchsize)
+
+
+def store_analysis(conn: sqlite3.Connection, automaton: Automaton, records, batchsize: int = 256) -> int:
+    """Scan texts for symbols and store the results to the 'analysis' table.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the catalog database.
+
+    automaton: Automaton
+        Compiled symbols, see *compile_symbols*.
+
+    records: iterable of tuple
+        Tuples (url, date, title, description, fulltext) as stored in the
+        'texts' table.
+
+    batchsize: int (optional)
+        Number of results inserted per transaction.
+
+    Returns
+    -------
+    int
+        Number of scanned texts.
+    """
+    def results():
+        for url, date, title, description, fulltext in records:
+            document = "\n".join(text for text in (title, description, fulltext) if text)
+            yield url, date, ",".join(find_symbols(automaton, document)), None
+
+    return util.write_batches(conn, "INSERT OR REPLACE INTO analysis (url, date, symbols_verbatim, symbols_deduced) "
+                              "VALUES (?, ?, ?, ?)", results(), batchsize)
@@ -0,0 +1,227 @@
+"""Polite scheduling of outbound HTTP requests."""
+import logging
+log = logging.getLogger("stockbro")
+
+import email.utils
+import random
+import threading
+import time
+import urllib.parse
+
+from src import metrics
+from src import util
+
+DEFAULT_RATE = 4.0  # requests per second per host
+DEFAULT_BURST = 8  # requests a host may receive at once after being idle
+MAX_RETRIES = 3  # retries of a request failing transiently
+BACKOFF_BASE = 1.0  # seconds waited before the first retry; doubles with each retry
+BACKOFF_MAX = 60.0  # seconds waited at most before a retry
+MAX_WAIT = 120.0  # seconds a request may wait for its host, otherwise HostBlocked is raised
+MIN_SPEED = 1 / 16  # lowest fraction of its rate a host is slowed down to
+SPEED_RECOVERY = 0.05  # fraction of its rate a host regains per successful request
+RETRY_STATUS = {429, 500, 502, 503, 504}  # status codes signaling an overloaded or throttling server
+
+
+class HostBlocked(OSError):
+    """Raised if a host asked to wait longer than *MAX_WAIT* before the next request."""
+
+
+class _Host:
+    """Token bucket and health of a single host. Guarded by its lock."""
+
+    def __init__(self, rate: float, burst: int):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.speed = 1.0  # fraction of rate currently granted, lowered on errors
+        self.blocked_until = 0.0  # monotonic time before which no request may be sent
+
+
+def configure(rate: float = None, burst: int = None, hosts: dict = None):
+    """Set request limits.
+
+    Parameters
+    ----------
+    rate: float (optional)
+        Requests per second granted to hosts without a specific limit.
+
+    burst: int (optional)
+        Requests a host without a specific limit may receive at once.
+
+    hosts: dict (optional)
+        Limits of specific hosts, e.g. {"finanznachrichten.de": {"rate": 1,
+        "burst": 2}}. A limit applies to the host and its subdomains. Omitted
+        values fall back to the defaults.
+    """
+    global _default_rate, _default_burst
+    with _hosts_lock:
+        _default_rate = rate if rate is not None else DEFAULT_RATE
+        _default_burst = burst if burst is not None else DEFAULT_BURST
+        _limits.clear()
+        _limits.update(hosts or {})
+        _hosts.clear()
+
+
+def get(url: str, **kwargs):
+    """Send a GET request within the limits of the URL's host.
+
+    The request waits for a token of its host's token bucket, which refills
+    at the host's rate. Requests failing transiently, i.e. with a status in
+    *RETRY_STATUS*, a timeout or a connection error, are retried up to
+    *MAX_RETRIES* times after a jittered exponential backoff or the delay
+    requested by the server's 'Retry-After' header. While backing off, the
+    whole host is paused. Each failure halves the host's rate (down to
+    *MIN_SPEED*), each success restores a bit of it, such that hosts
+    answering with errors are slowed down until they recover.
+
+    Parameters
+    ----------
+    url: str
+        URL to request via the host's shared session, see *util.http_session*.
+
+    **kwargs
+        Passed to requests.Session.get(), e.g. timeout or headers.
+
+    Returns
+    -------
+    requests.Response
+        Response of the last attempt. Like requests.get(), error statuses
+        are not raised.
+
+    Raises
+    ------
+    requests.exceptions.RequestException
+        If the last attempt raised.
+
+    HostBlocked
+        If the host asked to pause longer than *MAX_WAIT*.
+    """
+    import requests
+    hostname = urllib.parse.urlsplit(url).hostname or ""
+    host = _host(hostname)
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            _acquire(host, url)
+        except HostBlocked as e:
+            metrics.inc(metrics.HTTP_FAILURES, host=hostname, cause=metrics.cause(e))
+            raise
+        start = time.perf_counter()
+        try:
+            response = util.http_session(url).get(url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            metrics.inc(metrics.HTTP_FAILURES, host=hostname, cause=metrics.cause(e))
+            if not isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                raise
+            if attempt == MAX_RETRIES or not _is_transient(e):
+                _slow_down(host, None)
+                raise
+            delay = _slow_down(host, _backoff(attempt))
+            log.debug(f"Retrying '{url}' in {delay:.1f}s after error: {e}")
+            continue
+        _record(hostname, response, time.perf_counter() - start, kwargs.get("stream", False))
+        if response.status_code not in RETRY_STATUS:
+            _speed_up(host)
+            return response
+        retry_after = _retry_after(response)
+        delay = _slow_down(host, retry_after if retry_after is not None else _backoff(attempt))
+        if attempt == MAX_RETRIES or delay > MAX_WAIT:
+            return response
+        log.debug(f"Retrying '{url}' in {delay:.1f}s after status {response.status_code}.")
+        response.close()
+    return response
+
+
+def _record(hostname: str, response, seconds: float, stream: bool):
+    """Record latency, size and failure of a response. Bodies of streamed responses are counted if announced."""
+    metrics.observe(metrics.HTTP_SECONDS, seconds, host=hostname)
+    length = response.headers.get("Content-Length", "")
+    size = len(response.content) if not stream else int(length) if length.isdigit() else 0
+    metrics.inc(metrics.HTTP_BYTES, size, host=hostname)
+    if response.status_code >= 400:
+        metrics.inc(metrics.HTTP_FAILURES, host=hostname, cause=f"http_{response.status_code}")
+
+
+def _host(hostname: str) -> _Host:
+    """Return state of a host. Limits of parent domains apply to subdomains."""
+    host = _hosts.get(hostname)
+    if host is None:
+        with _hosts_lock:
+            host = _hosts.get(hostname)
+            if host is None:
+                limits = {}
+                labels = hostname.split(".")
+                for ii in range(len(labels)):
+                    if ".".join(labels[ii:]) in _limits:
+                        limits = _limits[".".join(labels[ii:])]
+                        break
+                host = _Host(limits.get("rate", _default_rate), limits.get("burst", _default_burst))
+                _hosts[hostname] = host
+    return host
+
+
+def _acquire(host: _Host, url: str):
+    """Wait until the host may receive another request and take a token."""
+    while True:
+        with host.lock:
+            now = time.monotonic()
+            rate = host.rate * host.speed
+            host.tokens = min(host.burst, host.tokens + (now - host.updated) * rate)
+            host.updated = now
+            wait = host.blocked_until - now
+            if wait <= 0:
+                if host.tokens >= 1:
+                    host.tokens -= 1
+                    return
+                wait = (1 - host.tokens) / rate
+        if wait > MAX_WAIT:
+            raise HostBlocked(f"Host of '{url}' is paused for another {wait:.0f}s.")
+        time.sleep(wait)
+
+
+def _slow_down(host: _Host, delay: float = None) -> float:
+    """Halve the host's speed and pause it for *delay* seconds. Returns the host's remaining pause."""
+    with host.lock:
+        host.speed = max(MIN_SPEED, host.speed / 2)
+        now = time.monotonic()
+        if delay is not None:
+            host.blocked_until = max(host.blocked_until, now + delay)
+        return max(0.0, host.blocked_until - now)
+
+
+def _speed_up(host: _Host):
+    with host.lock:
+        host.speed = min(1.0, host.speed + SPEED_RECOVERY)
+
+
+def _backoff(attempt: int) -> float:
+    """Return jittered delay before retry number *attempt* + 1."""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def _retry_after(response) -> float:
+    """Return delay in seconds requested by a 'Retry-After' header or None."""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_transient(error) -> bool:
+    """Return False for connection errors which a retry won't fix, such as unresolvable hostnames."""
+    return "NameResolutionError" not in repr(error) and "Name or service not known" not in str(error)
+
+
+_default_rate = DEFAULT_RATE
+_default_burst = DEFAULT_BURST
+_limits = {}  # domain -> dict of 'rate' and 'burst', see configure()
+_hosts = {}  # hostname -> _Host
+_hosts_lock = threading.Lock()
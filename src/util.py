@@ -4,14 +4,70 @@ import argparse
 import logging
 log = logging.getLogger("stockbro")
 
+import contextlib
+import itertools
 import sqlite3
 import pathlib
+import threading
+import typing
+import urllib.parse
 from pathlib import Path
 
+if typing.TYPE_CHECKING:
+    import requests
+
 
 # Realistic user agent to use for requests
 USERAGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4340.112 Safari/537.36"
 
+def http_session(url: str) -> "requests.Session":
+    """Return the shared HTTP session of the URL's host.
+
+    Sessions keep connections to their host alive and pool them, such that
+    consecutive requests to the same host skip the TCP and TLS handshakes.
+    One session is created per host and shared among threads; each session's
+    connection pool holds up to *HTTP_POOL_SIZE* connections.
+
+    Parameters
+    ----------
+    url: str
+        URL to be requested via the session.
+
+    Returns
+    -------
+    requests.Session
+        Session to use for requests to the URL's host.
+    """
+    host = urllib.parse.urlsplit(url).hostname
+    session = _http_sessions.get(host)
+    if session is None:
+        import requests  # slow to import; only needed by commands downloading anything
+        from src import cassette
+        with _http_sessions_lock:
+            session = _http_sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers["User-Agent"] = USERAGENT
+                adapter = cassette.adapter(HTTP_POOL_SIZE)  # records or replays responses if enabled
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _http_sessions[host] = session
+    return session
+
+
+def close_http_sessions():
+    """Close all sessions returned by *http_session*. Later calls of *http_session* create new ones."""
+    with _http_sessions_lock:
+        for session in _http_sessions.values():
+            session.close()
+        _http_sessions.clear()
+
+
+HTTP_POOL_SIZE = 16  # maximum number of kept-alive connections per host
+_http_sessions = {}  # host -> requests.Session, see http_session()
+_http_sessions_lock = threading.Lock()
+
+
 def create_db(dbpath: pathlib.Path, schemapath=None):
     """Create database and execute SQL instructions from file.
 
@@ -22,15 +78,16 @@ def create_db(dbpath: pathlib.Path, schemapath=None):
 
     Parameters
     ----------
-    dbpath: pathlib.Path
+    dbpath: pathlib.Path or str
         Path to sqlite3 database. All subdirectories and the database will be
         created.
 
-    schemapath: pathlib.Path or None
+    schemapath: pathlib.Path or str or None
         Path to file containing SQL instructions or 'None', if no instructions
         are to be executed. No SQL instructions will be executed it database
         already exists.
     """
+    dbpath = Path(dbpath)
     if dbpath.is_file():
         log.debug(f"Database '{dbpath}' already exists. Nothing to do.")
         return
@@ -50,5 +107,140 @@ def create_db(dbpath: pathlib.Path, schemapath=None):
     conn.close()
 
 
+# Pragmas applied to every connection opened by connect_db(). In WAL mode
+# readers do not block writers and vice versa, such that stages may read and
+# write a database concurrently. With synchronous=NORMAL a WAL database stays
+# consistent on power loss but may lose the most recent commits.
+DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # page cache of 64 MB, negative values are KiB
+    "mmap_size": 256 * 1024 ** 2,  # bytes of the database file memory-mapped for reading
+    "temp_store": "MEMORY",
+}
+DB_TIMEOUT = 30  # seconds to wait for a lock held by a concurrent writer
+DB_CACHED_STATEMENTS = 256  # number of prepared statements kept per connection
+DB_BATCH_SIZE = 1000  # default number of rows written per transaction
+_db_connections = threading.local()  # per-thread dict of path -> sqlite3.Connection, see connect_db()
+
+
+def connect_db(dbpath, schemapath=None) -> sqlite3.Connection:
+    """Return the shared connection of this thread to a database.
+
+    Connections are opened once per thread and database and reused by later
+    calls, which keeps their page caches and prepared statements warm. New
+    connections are configured with *DB_PRAGMAS* and wait up to *DB_TIMEOUT*
+    seconds for locks held by other processes. Do not close the returned
+    connection; use *close_dbs* instead.
+
+    Parameters
+    ----------
+    dbpath: pathlib.Path or str
+        Path to sqlite3 database.
+
+    schemapath: pathlib.Path or str or None
+        Path to a file of SQL instructions, which are executed if the
+        database does not exist yet, see *create_db*.
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection usable from the calling thread only.
+    """
+    key = str(Path(dbpath).resolve())
+    connections = getattr(_db_connections, "connections", None)
+    if connections is None:
+        connections = _db_connections.connections = {}
+    conn = connections.get(key)
+    if conn is not None:
+        try:
+            conn.total_changes  # raises if the connection has been closed
+            return conn
+        except sqlite3.ProgrammingError:
+            pass
+
+    create_db(dbpath, schemapath)
+    conn = sqlite3.connect(key, timeout=DB_TIMEOUT, cached_statements=DB_CACHED_STATEMENTS)
+    for pragma, value in DB_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    connections[key] = conn
+    log.debug(f"Connected to database '{dbpath}'.")
+    return conn
+
+
+def close_dbs():
+    """Commit and close all connections of this thread opened by *connect_db*."""
+    connections = getattr(_db_connections, "connections", {})
+    for conn in connections.values():
+        try:
+            conn.commit()
+            conn.close()
+        except sqlite3.ProgrammingError:  # already closed
+            pass
+    connections.clear()
+
+
+@contextlib.contextmanager
+def transaction(conn: sqlite3.Connection):
+    """Run the enclosed statements in a single write transaction.
+
+    The transaction acquires the database's write lock up front, such that
+    it waits for concurrent writers instead of failing with 'database is
+    locked' halfway. It is committed on success and rolled back on any
+    exception. Nested uses join the enclosing transaction.
+
+    Examples
+    --------
+        with transaction(conn):
+            conn.execute("INSERT INTO ...")
+            conn.execute("UPDATE ...")
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def write_batches(conn: sqlite3.Connection, statement: str, rows, batchsize: int = DB_BATCH_SIZE) -> int:
+    """Execute a statement for all rows, committing once per batch of rows.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to write to.
+
+    statement: str
+        SQL statement with placeholders, e.g. 'INSERT INTO t VALUES (?, ?)'.
+
+    rows: iterable of tuple
+        Parameters of the statement. Consumed lazily, so a generator keeps
+        only one batch in memory.
+
+    batchsize: int (optional)
+        Number of rows written per transaction.
+
+    Returns
+    -------
+    int
+        Number of rows passed to the statement.
+    """
+    rows = iter(rows)
+    count = 0
+    while True:
+        batch = list(itertools.islice(rows, batchsize))
+        if len(batch) == 0:
+            break
+        with transaction(conn):
+            conn.executemany(statement, batch)
+        count += len(batch)
+    return count
+
+
 if __name__ == "__main__":
     create_db("/tmp/bingo.db", "./db/rss-feeds.schema")
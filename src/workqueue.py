@@ -0,0 +1,125 @@
+"""Processing state of RSS items in the feeds database."""
+import logging
+log = logging.getLogger("stockbro")
+
+import sqlite3
+
+from src import util
+
+DOWNLOAD = "download"  # raw HTML of the item's link is to be downloaded
+EXTRACT = "extract"  # fulltext is to be extracted from the raw HTML
+
+# Items are queued until they have passed all stages. Rows of finished items
+# are deleted, such that the table and its index only grow with the backlog
+# and not with the history of items.
+CREATE_QUEUE_TABLE = """
+    CREATE TABLE IF NOT EXISTS queue (
+        rss_guid TEXT,
+        rss_link TEXT,
+        stage TEXT,         -- next processing stage, see DOWNLOAD and EXTRACT
+        queued_at INTEGER,  -- UNIX time of entering the stage; items are processed oldest first
+        PRIMARY KEY (rss_guid, rss_link)
+    )"""
+
+# Covers *pending*: selecting N items of a stage reads N index entries only.
+CREATE_QUEUE_INDEX = """
+    CREATE INDEX IF NOT EXISTS queue_stage ON queue (stage, queued_at, rss_guid, rss_link)"""
+
+# Newly stored items enter the first stage
+CREATE_QUEUE_TRIGGER = f"""
+    CREATE TRIGGER IF NOT EXISTS items_enqueue AFTER INSERT ON items BEGIN
+        INSERT OR IGNORE INTO queue (rss_guid, rss_link, stage, queued_at)
+        VALUES (new.rss_guid, new.rss_link, '{DOWNLOAD}', CAST(strftime('%s', 'now') AS INTEGER));
+    END"""
+
+
+def create_queue(conn: sqlite3.Connection) -> int:
+    """Create the 'queue' table if it does not exist.
+
+    A new queue is filled from the state of existing items once: items
+    without raw HTML are queued for download, items with raw HTML but without
+    progress are queued for extraction. Afterwards, a trigger queues items
+    inserted into the 'items' table for download. Migrate a legacy 'html'
+    table first, see *blobs.migrate_html_table*.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the feeds database.
+
+    Returns
+    -------
+    int
+        Number of queued existing items, 0 if the queue already existed.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'queue'").fetchone()
+    count = 0
+    with util.transaction(conn):  # includes DDL statements
+        conn.execute(CREATE_QUEUE_TABLE)
+        conn.execute(CREATE_QUEUE_INDEX)
+        conn.execute(CREATE_QUEUE_TRIGGER)
+        if not exists:
+            count = conn.execute(f"""
+                INSERT INTO queue (rss_guid, rss_link, stage, queued_at)
+                SELECT items.rss_guid, items.rss_link,
+                       CASE WHEN html.html_hash IS NULL THEN '{DOWNLOAD}' ELSE '{EXTRACT}' END,
+                       CAST(strftime('%s', 'now') AS INTEGER)
+                FROM items
+                LEFT JOIN html USING (rss_guid, rss_link)
+                LEFT JOIN progress USING (rss_guid, rss_link)
+                WHERE progress.can_delete IS NULL""").rowcount
+    if count > 0:
+        log.info(f"Queued {count} unprocessed items.")
+    return count
+
+
+def pending(conn: sqlite3.Connection, stage: str, limit: int = None) -> list:
+    """Return keys of items waiting for a stage, oldest first.
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        Connection to the feeds database.
+
+    stage: str
+        Stage to select items of, see *DOWNLOAD* and *EXTRACT*.
+
+    limit: int (optional)
+        Maximum number of items. All waiting items are returned if None.
+
+    Returns
+    -------
+    list of tuple
+        (rss_guid, rss_link) of each item.
+    """
+    return conn.execute("SELECT rss_guid, rss_link FROM queue WHERE stage = ? ORDER BY queued_at LIMIT ?",
+                        (stage, -1 if limit is None else limit)).fetchall()
+
+
+def advance(conn: sqlite3.Connection, keys: list, stage: str = None):
+    """Move items to another stage or remove them from the queue if *stage* is None.
+
+    The caller is responsible for committing, such that the state change can
+    be part of the transaction storing the stage's results.
+    """
+    if stage is None:
+        conn.executemany("DELETE FROM queue WHERE rss_guid = ? AND rss_link = ?", keys)
+    else:
+        conn.executemany("UPDATE queue SET stage = ?, queued_at = CAST(strftime('%s', 'now') AS INTEGER) "
+                         "WHERE rss_guid = ? AND rss_link = ?", [(stage, *key) for key in keys])
+
+
+def enqueue(conn: sqlite3.Connection, keys: list, stage: str):
+    """Queue items for a stage, including items which have left the queue before.
+
+    The caller is responsible for committing, see *advance*.
+    """
+    conn.executemany("INSERT OR REPLACE INTO queue (rss_guid, rss_link, stage, queued_at) "
+                     "VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))", [(*key, stage) for key in keys])
+
+
+def requeue(conn: sqlite3.Connection, keys: list):
+    """Move items to the end of their stage's queue, e.g. after failing to process them."""
+    with util.transaction(conn):
+        conn.executemany("UPDATE queue SET queued_at = CAST(strftime('%s', 'now') AS INTEGER) "
+                         "WHERE rss_guid = ? AND rss_link = ?", keys)
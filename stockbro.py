@@ -3,16 +3,26 @@
 
 """Main modules."""
 import argparse
+import atexit
 import configparser
 import logging
+import os
 import sqlite3
 from datetime import datetime
 from pathlib import Path
 
 import requests
 
+from src import blobs
+from src import cassette
+from src import dates
+from src import dedup
+from src import metrics
 from src import rss
+from src import search
+from src import throttle
 from src import util
+from src import workqueue
 
 
 def rss_fetch() -> int:
@@ -31,27 +41,29 @@ def rss_fetch() -> int:
     feedsdb_schema = cfg["project"]["rss-feedsdb-schema"]
 
     # Count rows in database table before insertion
-    util.create_db(feedsdb_path, feedsdb_schema)
-    conn = sqlite3.connect(feedsdb_path)
+    conn = util.connect_db(feedsdb_path, feedsdb_schema)
+    blobs.migrate_html_table(conn)  # the queue is filled from the migrated 'html' table
+    workqueue.create_queue(conn)
+    dedup.create_tables(conn)
+    dates.create_columns(conn)
     rows_before = int(conn.execute("SELECT COUNT(*) FROM items").fetchone()[0])
-    conn.close()
 
-    # Store feeds to database
-    for ii, url in enumerate(urls, 1):
-        log.info(f"Fetching items from RSS feed {ii}/{len(urls)}: {url}")
-        try:
-            rss.feeds_to_database([url], feedsdb_path, tablename="items",
-                                  tags={"guid": "rss_guid", "link": "rss_link", "pubDate": "rss_pubdate",
-                                        "title": "rss_title", "description": "rss_description"},
-                                  keys=["rss_guid", "rss_link"])
-        except Exception as e:
-            log.error(e)
-        ii += 1
-
-    # Count rows in database table after insertion
-    conn = sqlite3.connect(feedsdb_path)
+    # Store feeds to database. Feeds are downloaded concurrently.
+    log.info(f"Fetching items from {len(urls)} RSS feeds.")
+    try:
+        # Feeds which fail are logged and skipped by rss.feed_records().
+        rss.feeds_to_database(urls, feedsdb_path, tablename="items",
+                              tags={"guid": "rss_guid", "link": "rss_link", "pubDate": "rss_pubdate",
+                                    "title": "rss_title", "description": "rss_description"},
+                              keys=["rss_guid", "rss_link"], failed={})
+    except Exception as e:
+        log.error(e)
+    dates.normalize_items(conn)
+    dedup.screen_items(conn)  # duplicates of known items won't be downloaded
+
+    # Count rows in database table after insertion. The connection is shared
+    # with feeds_to_database().
     rows_after = int(conn.execute("SELECT COUNT(*) FROM items").fetchone()[0])
-    conn.close()
 
     return rows_after - rows_before
 
@@ -66,6 +78,12 @@ parser_verbosity_meg.add_argument("-v", "--verbose", action="store_true", defaul
                                   help="Increase logging verbosity. Lowers debug level from INFO to DEBUG.")
 parser_verbosity_meg.add_argument("-q", "--quiet", action="store_true", default=False,
                                   help="Decreases logging verbosity. Increases debug level from INFO to WARNING.")
+parser.add_argument("--record", type=Path, default=None, metavar="CASSETTE",
+                    help="Store all HTTP responses in the given cassette, see 'stockbro2.py replay'.")
+parser.add_argument("--replay", default=None, metavar="ADDRESS",
+                    help="Send all HTTP requests to the stand-in server at the given address, e.g. "
+                         f"http://{cassette.DEFAULT_HOST}:{cassette.DEFAULT_PORT}, instead of the real hosts. "
+                         "Lifts the per-host request limits.")
 subparsers = parser.add_subparsers(help="command help", dest="command")
 
 # configure subcommand
@@ -75,11 +93,25 @@ parser_download_html = subparsers.add_parser("rss-download-html", formatter_clas
 parser_download_html.add_argument("-m", "--maxitems", type=int, default=32,  # FIXME: enforce nonneg integers
                                   help="Stop after given number of items have been processed. Used to chunk up "
                                        "workload into batches of predictable duration.")
+parser_download_html.add_argument("-w", "--workers", type=int, default=rss.DEFAULT_DOWNLOAD_WORKERS,
+                                  help="Maximum number of articles downloaded concurrently.")
+parser_download_html.add_argument("-b", "--batchsize", type=int, default=64,
+                                  help="Number of downloaded articles written to the database per transaction.")
+parser_download_html.add_argument("--compression", default=blobs.DEFAULT_CODEC, choices=blobs.CODECS,
+                                  help="Compression codec of stored raw HTML.")
+parser_download_html.add_argument("--level", type=int, default=blobs.DEFAULT_LEVEL,
+                                  help="Compression level of stored raw HTML.")
 
 parser_extract_fulltext = subparsers.add_parser("rss-extract-fulltext", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser_extract_fulltext.add_argument("-m", "--maxitems", type=int, default=32,  # FIXME: enforce nonneg integers
                                      help="Stop after given number of items have been processed. Used to chunk up "
                                           "workload into batches of predictable duration.")
+parser_extract_fulltext.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                                     help="Number of worker processes extracting fulltexts.")
+parser_extract_fulltext.add_argument("-c", "--chunksize", type=int, default=16,
+                                     help="Number of articles sent to a worker process at once.")
+parser_extract_fulltext.add_argument("-b", "--batchsize", type=int, default=64,
+                                     help="Number of extracted fulltexts written to the database per transaction.")
 
 args = parser.parse_args()
 cfg = configparser.ConfigParser(inline_comment_prefixes=";")
@@ -123,6 +155,28 @@ else:
 ch.setFormatter(logging.Formatter('[%(levelname)s] %(funcName)s: %(message)s'))
 log.addHandler(ch)
 
+# Record or replay the HTTP traffic of feeds, traces and article downloads.
+if args.record is not None:
+    cassette.record(args.record)
+if args.replay is not None:
+    cassette.replay(args.replay)
+    throttle.configure(rate=1e9, burst=10**9)  # no real host is contacted
+
+
+## Metrics export.
+#
+# Metrics recorded by a command are stored to the feeds database's 'metrics'
+# table when the process exits, including after the command failed. See
+# 'stockbro2.py rss metrics'.
+
+def flush_metrics():
+    metrics.flush(util.connect_db(cfg["project"]["rss-feedsdb-path"]))
+    util.close_dbs()
+
+
+if args.command is not None:
+    atexit.register(flush_metrics)
+
 
 ## Command dispatch.
 
@@ -132,80 +186,149 @@ if args.command == "rss-fetch":
 
 elif args.command == "rss-extract-fulltext":
     # Create accessed databases if necessary
-    util.create_db(cfg["project"]["rss-feedsdb-path"], cfg["project"]["rss-feedsdb-schema"])
-    util.create_db(cfg["project"]["rss-catalogdb-path"], cfg["project"]["rss-catalogdb-schema"])
-
-    conn_feeds = sqlite3.connect(cfg["project"]["rss-feedsdb-path"])
-    conn_catalog = sqlite3.connect(cfg["project"]["rss-catalogdb-path"])
+    conn_feeds = util.connect_db(cfg["project"]["rss-feedsdb-path"], cfg["project"]["rss-feedsdb-schema"])
+    conn_catalog = util.connect_db(cfg["project"]["rss-catalogdb-path"], cfg["project"]["rss-catalogdb-schema"])
+    blobs.migrate_html_table(conn_feeds)
+    workqueue.create_queue(conn_feeds)
+    dedup.create_tables(conn_feeds)
+    dates.create_columns(conn_feeds, conn_catalog)
+    search.create_index(conn_catalog)  # stored texts are indexed by triggers
+    # Select items queued for extraction. Their raw html is looked up lazily
+    # when an item is handed to the extraction workers such that only a few
+    # pages are held in memory at any time.
     query_join = """
-        SELECT rss_guid, rss_link, rss_pubdate, rss_title, rss_description, dest_url, html FROM
-            (
-                SELECT rss_guid, rss_link, rss_pubdate, rss_title, rss_description FROM items LEFT JOIN progress
-                    USING(rss_guid, rss_link) WHERE progress.can_delete IS NULL
-            ) LEFT JOIN html USING(rss_guid, rss_link) WHERE html IS NOT NULL
+        SELECT rss_guid, rss_link, rss_pubdate, rss_published, rss_title, rss_description, dest_url, html_hash
+        FROM (SELECT rss_guid, rss_link, queued_at FROM queue WHERE stage = ? ORDER BY queued_at LIMIT ?)
+        JOIN items USING (rss_guid, rss_link) LEFT JOIN html USING (rss_guid, rss_link)
+        ORDER BY queued_at
         """
-    records = conn_feeds.execute(query_join).fetchmany(args.maxitems)
-    successful = 0  # number of successful downloads
-    for ii, record in enumerate(records, 1):
-        rss_guid, rss_link, pubdate = record[0], record[1], record[2]
-        title, description = record[3], record[4]
-        dest_url, html = record[5], record[6]
-
-        try:
-            # Extract fulltext, convert date to standard format and store to 'rss-catalog.db'
-            # TODO: Date conversion is missing
-            fulltext = rss.extract_fulltext(dest_url, html)
-            date = pubdate
-            conn_catalog.execute("INSERT INTO texts VALUES (?, ?, ?, ?, ?)",
-                                 (dest_url, date, title, description, fulltext))
-
-            # Mark as done in 'rss-feeds.db'. Note that the 'progress' table is
-            # empty by default so that we may simple insert values instead of
-            # updating them.
-            conn_feeds.execute("INSERT INTO progress VALUES (?, ?, ?)",
-                               (rss_guid, rss_link, 1))
-
-            successful += 1
-        except Exception as e:
+    records = conn_feeds.execute(query_join, (workqueue.EXTRACT, args.maxitems)).fetchall()
+    missing = []  # keys of items whose raw html is gone
+
+    def pending_pages():
+        for record in records:
+            html = blobs.get(conn_feeds, record[7]) if record[7] is not None else None
+            if html is None:
+                # Don't let the extraction workers download it, see rss.extract_fulltext().
+                log.warning(f"Raw HTML of RSS item '{record[1]}' is missing; it will be downloaded again.")
+                missing.append(record[:2])
+                continue
+            yield record[:7], record[6], html
+
+    # Texts stored before under the same URL and date are kept, like 'stockbro2.py rss run' does.
+    INSERT_TEXT = ("INSERT OR IGNORE INTO texts (url, date, title, description, fulltext, published) "
+                   "VALUES (?, ?, ?, ?, ?, ?)")
+
+    def store_batch(texts: list, progress: list) -> int:
+        """Store extracted fulltexts to 'rss-catalog.db' and mark items as done in 'rss-feeds.db'.
+
+        Texts duplicating stored texts are marked as done without being stored.
+        Fingerprints of new texts are committed along with the progress, i.e.
+        once the texts are stored.
+        """
+        with util.transaction(conn_feeds):
+            duplicates = dedup.screen(conn_feeds, dedup.TEXT,
+                                      [(done[:2], text[4]) for text, done in zip(texts, progress)])
+            skipped = [done for done in progress if done[:2] in duplicates]
+            texts = [text for text, done in zip(texts, progress) if done[:2] not in duplicates]
+            progress = [done for done in progress if done[:2] not in duplicates]
+            conn_catalog.executemany(INSERT_TEXT, texts)
+            conn_catalog.commit()
+
+            # Mark as done in 'rss-feeds.db'. Items extracted again, e.g. after
+            # being requeued by dedup.release(), replace their progress.
+            conn_feeds.executemany("INSERT OR REPLACE INTO progress VALUES (?, ?, ?)", progress + skipped)
+            workqueue.advance(conn_feeds, [(rss_guid, rss_link) for rss_guid, rss_link, _ in progress + skipped])
+        return len(texts) + len(skipped)
+
+    # Extract fulltexts on all cores. Results are written in batches by this
+    # process.
+    successful = 0  # number of successful extractions
+    texts, progress, failed = [], [], []
+    for record, fulltext, error in rss.extract_fulltexts(pending_pages(), args.workers, args.chunksize):
+        if error is not None:
             # Exceptions are raised for urls whose extraction scheme is missing or incomplete
-            log.error(e)
-
-    conn_feeds.commit()
-    conn_feeds.close()
-    conn_catalog.commit()
-    conn_catalog.close()
-    log.info(f"Successfully downloaded the raw html of {successful}/{len(records)} RSS items.")
+            log.error(error)
+            failed.append(record[:2])
+            continue
+
+        rss_guid, rss_link, pubdate, published, title, description, dest_url = record
+        date, published = dates.normalize(pubdate, published, dates.feed_of(rss_link))
+        texts.append((dest_url, date, title, description, fulltext, published))
+        progress.append((rss_guid, rss_link, 1))
+        if len(texts) >= args.batchsize:
+            successful += store_batch(texts, progress)
+            texts, progress = [], []
+    if len(texts) > 0:
+        successful += store_batch(texts, progress)
+    with util.transaction(conn_feeds):
+        dedup.release(conn_feeds, failed)  # skipped duplicates are extracted instead
+        workqueue.requeue(conn_feeds, failed)  # retry after all other queued items
+        workqueue.advance(conn_feeds, missing, workqueue.DOWNLOAD)
+
+    util.close_dbs()
+    log.info(f"Successfully extracted the fulltext of {successful}/{len(records)} RSS items.")
 
 elif args.command == "rss-download-html":
     # Set up database and connection
-    util.create_db(cfg["project"]["rss-feedsdb-path"], cfg["project"]["rss-feedsdb-schema"])
-    conn = sqlite3.connect(cfg["project"]["rss-feedsdb-path"])
-
-    # Retrieve all records whose raw html is missing
-    query_join = "SELECT items.rss_guid, items.rss_link FROM " \
-        "items LEFT JOIN html USING (rss_guid, rss_link) " \
-        "WHERE (html.html IS NULL)"
-    records = conn.execute(query_join).fetchmany(args.maxitems)
-
-    # For each record attempt to download the raw html and write it to the database
-    successful = 0  # number of successful downloads
-    for ii, record in enumerate(records, 1):
-        log.info(f"Downloading raw HTML of RSS item {ii}/{len(records)}.")
-        guid, dest_url = record[0], record[1]
+    conn = util.connect_db(cfg["project"]["rss-feedsdb-path"], cfg["project"]["rss-feedsdb-schema"])
+    blobs.migrate_html_table(conn, args.compression, args.level)
+    conn.execute(rss.CREATE_TRACES_TABLE)
+    workqueue.create_queue(conn)
+    dedup.create_tables(conn)
+
+    # Retrieve items queued for download
+    records = workqueue.pending(conn, workqueue.DOWNLOAD, args.maxitems)
+
+    # Links traced before need not be traced again
+    traces = rss.cached_traces(conn, [link for _, link in records])
+    new_traces = {}
+
+    # Download the raw html concurrently and write it to the database in
+    # batches. Each batch is committed in a single transaction. Pages are
+    # stored compressed and only once per distinct content.
+    def store_batch(batch: list) -> int:
         try:
-            dest_url = rss.rss_trace_link(dest_url)  # track down destination url, not the appetizer
-            reply = requests.get(dest_url, headers={'User-Agent': util.USERAGENT}, timeout=3)
-            reply.raise_for_status()  # throw if 400 ≤ ret_code ≤ 600
-            html = reply.text
-            conn.execute("INSERT INTO html (rss_guid, rss_link, dest_url, html) VALUES (?, ?, ?, ?)", (guid, dest_url, dest_url, html))
-            successful += 1
-        except requests.exceptions.RequestException as e:  # catches all of requests' exceptions
-            log.error(f"Error for requests.get('{udest_urlrl}'): {e}")
+            rss.cache_traces(conn, new_traces)
+            new_traces.clear()
+            for guid, link, dest_url, html in batch:
+                conn.execute("INSERT OR REPLACE INTO html (rss_guid, rss_link, dest_url, html_hash) "
+                             "VALUES (?, ?, ?, ?)",
+                             (guid, link, dest_url, blobs.put(conn, html, args.compression, args.level)))
+            workqueue.advance(conn, [(guid, link) for guid, link, _, _ in batch], workqueue.EXTRACT)
+            conn.commit()
+            return len(batch)
         except sqlite3.Error as e:  # catches all of sqlite3's exceptions
-            log.error(f"sqlite3 error while trying to store '{udest_urlrl}': {e}")
-        except Exception as e:
-            log.error(f"Miscellaneous error while trying to store '{udest_urlrl}': {e}")
+            conn.rollback()
+            log.error(f"sqlite3 error while trying to store {len(batch)} RSS items: {e}")
+            return 0
+
+    successful = 0  # number of successful downloads
+    batch, failed = [], []
+    for ii, (guid, link, dest_url, html, error) in enumerate(rss.download_html(records, args.workers,
+                                                                               traces=traces), 1):
+        if link not in traces:
+            if dest_url is not None:
+                new_traces[link] = dest_url
+            elif isinstance(error, NotImplementedError):
+                new_traces[link] = error
+        if error is not None:
+            failed.append((guid, link))
+        if isinstance(error, requests.exceptions.RequestException):  # catches all of requests' exceptions
+            log.error(f"Error for requests.get('{dest_url or link}'): {error}")
+        elif error is not None:
+            log.error(f"Miscellaneous error while trying to store '{dest_url or link}': {error}")
+        else:
+            log.info(f"Downloaded raw HTML of RSS item {ii}/{len(records)}.")
+            batch.append((guid, link, dest_url, html))
+            if len(batch) >= args.batchsize:
+                successful += store_batch(batch)
+                batch = []
+    if len(batch) > 0 or len(new_traces) > 0:
+        successful += store_batch(batch)
+    with util.transaction(conn):
+        dedup.release(conn, failed)  # skipped duplicates are downloaded instead
+        workqueue.requeue(conn, failed)  # retry after all other queued items
 
     log.info(f"Successfully downloaded the raw html of {successful}/{len(records)} RSS items.")
-    conn.commit()
-    conn.close()
+    util.close_dbs()
@@ -6,34 +6,107 @@ import configparser
 import logging
 import sqlite3
 import pathlib
+import signal
 import sys
-
-import yaml
+import threading
+import time
 
 from datetime import datetime
 from pathlib import Path
 
-import requests
-
+from src import bench
+from src import blobs
+from src import cassette
+from src import dates
+from src import dedup
+from src import metrics
+from src import pipeline
 from src import rss
+from src import search
+from src import startup
+from src import symbols
+from src import throttle
 from src import util
+from src import workqueue
 
 
 def init_args(argv: list) -> argparse.Namespace:
     """Parse command-line arguments and return populated Namespace object."""
+    return init_parser().parse_args(argv)
+
+
+def init_parser() -> argparse.ArgumentParser:
+    """Return parser of command-line arguments.
+
+    Keep module-level imports of this script and of the modules whose
+    constants are referenced here light. Every invocation, including
+    '--help', pays for them; see the 'startup' command.
+    """
     # Use a default formatter which displays default values in help string.
     formatter_class = argparse.ArgumentDefaultsHelpFormatter
 
     parser = argparse.ArgumentParser(formatter_class=formatter_class)
     parser.add_argument("-l", "--loglevel", default="info", choices=["debug", "info", "warning", "error", "critical"],
                         help="Set minimum importance threshold for console logging output. Case insensitive.")
+    parser.add_argument("--record", type=pathlib.Path, default=None, metavar="CASSETTE",
+                        help="Store all HTTP responses in the given cassette, see the 'replay' command.")
+    parser.add_argument("--replay", default=None, metavar="ADDRESS",
+                        help="Send all HTTP requests to the stand-in server at the given address, e.g. "
+                             f"http://{cassette.DEFAULT_HOST}:{cassette.DEFAULT_PORT}, instead of the real hosts. "
+                             "Lifts the per-host request limits.")
     subparsers = parser.add_subparsers(dest="command")
-    rss = subparsers.add_parser("rss", formatter_class=formatter_class)
-    rss_subparsers = rss.add_subparsers(dest="rss_command")
+    startup_parser = subparsers.add_parser("startup", formatter_class=formatter_class,
+                                           help="Report the startup time and slowest imports of each command.")
+    startup_parser.add_argument("-b", "--budget", type=float, default=startup.DEFAULT_BUDGET * 1000,
+                                help="Milliseconds each command may take to start. Exits with status 1 if a "
+                                     "command is slower.")
+    startup_parser.add_argument("-r", "--repeat", type=int, default=startup.DEFAULT_REPEAT,
+                                help="Number of runs per command; the fastest one counts.")
+    bench_parser = subparsers.add_parser("bench", formatter_class=formatter_class,
+                                         help="Benchmark fulltext extraction, feed parsing and storage and compare "
+                                              "the results against a saved baseline.")
+    bench_parser.add_argument("names", nargs="*",
+                              help="Prefixes of the benchmarks to run, e.g. 'extract_fulltext' or "
+                                   "'feeds_to_database'. Runs all benchmarks by default.")
+    bench_parser.add_argument("-r", "--repeat", type=int, default=bench.DEFAULT_REPEAT,
+                              help="Passes over the extraction corpus and the recorded feeds.")
+    bench_parser.add_argument("--sizes", type=int, nargs="+", default=list(bench.DEFAULT_SIZES),
+                              help="Numbers of items stored by the database benchmarks.")
+    bench_parser.add_argument("--baseline", type=pathlib.Path, default=bench.BASELINE_PATH,
+                              help="File of baseline results to compare against.")
+    bench_parser.add_argument("-t", "--threshold", type=float, default=bench.DEFAULT_THRESHOLD * 100,
+                              help="Percentage by which a metric may be worse than its baseline. Exits with "
+                                   "status 1 if a metric regressed further.")
+    bench_parser.add_argument("--save", action="store_true",
+                              help="Store the results as new baseline instead of comparing against it.")
+    replay_parser = subparsers.add_parser("replay", formatter_class=formatter_class,
+                                          help="Serve the responses of a cassette recorded with '--record' until "
+                                               "interrupted by SIGINT or SIGTERM.")
+    replay_parser.add_argument("cassette", type=pathlib.Path,
+                               help="Cassette of recorded responses.")
+    replay_parser.add_argument("--host", default=cassette.DEFAULT_HOST,
+                               help="Address to listen on.")
+    replay_parser.add_argument("-p", "--port", type=int, default=cassette.DEFAULT_PORT,
+                               help="Port to listen on.")
+    replay_parser.add_argument("--latency", type=float, default=0,
+                               help="Mean milliseconds before each response is sent.")
+    replay_parser.add_argument("--error-rate", type=float, default=0,
+                               help="Fraction of requests answered with status 503.")
+    replay_parser.add_argument("--bandwidth", type=float, default=None,
+                               help="KiB per second at which each response body is sent. Unlimited by default.")
+    replay_parser.add_argument("--copies", type=int, default=1,
+                               help="Serve every item of a feed as this many items, which are new on every "
+                                    "download, to simulate a multiple of the recorded volume.")
+    rss_parser = subparsers.add_parser("rss", formatter_class=formatter_class)
+    rss_subparsers = rss_parser.add_subparsers(dest="rss_command")
     rss_fetch = rss_subparsers.add_parser("fetch", formatter_class=formatter_class)
     rss_fetch.add_argument("-m", "--maxitems", type=int, default=32,  # FIXME: enforce nonneg integers
                            help="Stop after given number of items have been processed. Used to chunk up "
                                 "workload into batches of predictable duration.")
+    rss_fetch.add_argument("-w", "--workers", type=int, default=rss.DEFAULT_FETCH_WORKERS,
+                           help="Maximum number of feeds downloaded concurrently.")
+    rss_fetch.add_argument("--per-host", type=int, default=rss.DEFAULT_FETCH_PER_HOST,
+                           help="Maximum number of concurrent downloads from a single host.")
     rss_download = rss_subparsers.add_parser("download", formatter_class=formatter_class)
     rss_download.add_argument("-m", "--maxitems", type=int, default=32,  # FIXME: enforce nonneg integers
                               help="Stop after given number of items have been processed. Used to chunk up "
@@ -42,8 +115,53 @@ def init_args(argv: list) -> argparse.Namespace:
     rss_extract.add_argument("-m", "--maxitems", type=int, default=32,  # FIXME: enforce nonneg integers
                              help="Stop after given number of items have been processed. Used to chunk up "
                                   "workload into batches of predictable duration.")
-
-    return parser.parse_args(argv)
+    rss_analyze = rss_subparsers.add_parser("analyze", formatter_class=formatter_class)
+    rss_analyze.add_argument("-m", "--maxitems", type=int, default=None,  # FIXME: enforce nonneg integers
+                             help="Stop after given number of texts have been processed. Processes all "
+                                  "pending texts by default.")
+    rss_analyze.add_argument("--batchsize", type=int, default=256,
+                             help="Number of results stored per database transaction.")
+    rss_analyze.add_argument("--symbols", type=pathlib.Path, default=symbols.SYMBOLS_PATH,
+                             help="File of newline-separated ticker symbols to look for.")
+    rss_run = rss_subparsers.add_parser("run", formatter_class=formatter_class,
+                                        help="Run fetch, download, extract and analyze continuously until "
+                                             "interrupted by SIGINT or SIGTERM.")
+    rss_run.add_argument("--interval", type=float, default=pipeline.DEFAULT_FETCH_INTERVAL,
+                         help="Seconds between two fetches of all feeds.")
+    rss_run.add_argument("--queue-size", type=int, default=pipeline.DEFAULT_QUEUE_SIZE,
+                         help="Maximum number of items waiting between two stages.")
+    rss_run.add_argument("--batchsize", type=int, default=pipeline.DEFAULT_BATCHSIZE,
+                         help="Maximum number of items processed and stored at once by each stage.")
+    rss_run.add_argument("--per-host", type=int, default=rss.DEFAULT_FETCH_PER_HOST,
+                         help="Maximum number of concurrent feed downloads from a single host.")
+    rss_run.add_argument("--download-workers", type=int, default=rss.DEFAULT_DOWNLOAD_WORKERS,
+                         help="Maximum number of concurrent article downloads.")
+    rss_run.add_argument("--extract-workers", type=int, default=None,
+                         help="Number of fulltext extraction processes. Defaults to the number of CPUs.")
+    rss_run.add_argument("--symbols", type=pathlib.Path, default=symbols.SYMBOLS_PATH,
+                         help="File of newline-separated ticker symbols to look for.")
+    rss_metrics = rss_subparsers.add_parser("metrics", formatter_class=formatter_class,
+                                            help="Show which stages, domains and hosts took the most time.")
+    rss_metrics.add_argument("--hours", type=float, default=None,
+                             help="Only include metrics of the given number of past hours. Includes all "
+                                  "stored metrics by default.")
+    rss_metrics.add_argument("-n", "--top", type=int, default=10,
+                             help="Maximum number of rows per table.")
+    rss_search = rss_subparsers.add_parser("search", formatter_class=formatter_class)
+    rss_search.add_argument("query", nargs="?", default="",
+                            help="Search terms which must all occur in a text. Append '*' to a term to match "
+                                 "words starting with it.")
+    rss_search.add_argument("-n", "--limit", type=int, default=10,
+                            help="Maximum number of hits to show.")
+    rss_search.add_argument("--raw", action="store_true",
+                            help="Interpret query using the full SQLite FTS5 query syntax.")
+    rss_search.add_argument("--rebuild", action="store_true",
+                            help="Rebuild the search index before searching, e.g. after 'VACUUM'.")
+    rss_search.add_argument("--hours", type=float,
+                            help="Only match texts published in the last given number of hours. Without a "
+                                 "query, list these texts newest first.")
+
+    return parser
 
 
 def init_logging(logpath: pathlib.Path, level=logging.INFO):
@@ -119,12 +237,36 @@ def init_logging(logpath: pathlib.Path, level=logging.INFO):
 
 if __name__ == "__main__":
 
+    # Parse command-line arguments.
+    args = init_args(sys.argv[1:])
+    if args.command == "startup":
+        ok = startup.report(sys.argv[0], init_parser(), budget=args.budget / 1000, repeat=args.repeat)
+        sys.exit(0 if ok else 1)
+    if args.command == "bench":
+        baseline = bench.load_baseline(args.baseline)
+        results = bench.run(args.names, repeat=args.repeat, sizes=args.sizes)
+        bench.report(results, baseline)
+        if args.save:
+            bench.save_baseline(results, args.baseline)
+            print(f"Saved baseline to '{args.baseline}'.")
+            sys.exit(0)
+        regressions = bench.compare(results, baseline, threshold=args.threshold / 100)
+        for regression in regressions:
+            print(f"REGRESSION  {regression}")
+        if not baseline:
+            print(f"No baseline at '{args.baseline}'; run with --save to create one.")
+        sys.exit(1 if regressions else 0)
+
     # Load static configuration parameters.
+    import yaml
     with open("config.yaml", "r") as f:
         config = yaml.safe_load(f)
-
-    # Parse command-line arguments.
-    args = init_args(sys.argv[1:])
+    throttle.configure(**config.get("http", {}))
+    if args.record is not None:
+        cassette.record(args.record)
+    if args.replay is not None:
+        cassette.replay(args.replay)
+        throttle.configure(rate=1e9, burst=10**9)  # no real host is contacted
 
     # Configure logging. One logfile per day, e.g. 'log/2021-03-12.log'.
     today = datetime.now().strftime(r"%Y-%m-%d")
@@ -132,9 +274,19 @@ if __name__ == "__main__":
     loglevel = logging.getLevelName(args.loglevel.upper())
     init_logging(logpath, loglevel)
     log = logging.getLogger("stockbro")
+    textfile = config.get("metrics", {}).get("textfile")
+    metrics_textfile = pathlib.Path(pathlib.PurePosixPath(textfile)) if textfile else None
 
     # Dispatch commands.
-    if args.command == "rss":
+    if args.command == "replay":
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: stop.set())
+        cassette.serve(args.cassette, stop, host=args.host, port=args.port, latency=args.latency / 1000,
+                       error_rate=args.error_rate,
+                       bandwidth=args.bandwidth * 1024 if args.bandwidth is not None else None,
+                       copies=args.copies)
+    elif args.command == "rss":
         if args.rss_command == "fetch":
             urls = config["rss"]["feeds"]
 
@@ -142,18 +294,26 @@ if __name__ == "__main__":
             feedsdb_path = pathlib.Path(pathlib.PurePosixPath(config["rss"]["feedsdb-path"]))
             feedsdb_schema = pathlib.Path(pathlib.PurePosixPath(config["rss"]["feedsdb-schema"]))
 
-            # Count rows in database table before insertion
-            util.create_db(feedsdb_path, feedsdb_schema)
+            conn = util.connect_db(feedsdb_path, feedsdb_schema)
+            blobs.migrate_html_table(conn)  # the queue is filled from the migrated 'html' table
+            workqueue.create_queue(conn)
+            dedup.create_tables(conn)
+            dates.create_columns(conn)
             log.info(f"Fetching {len(urls)} RSS feeds ...")
-            for ii, url in enumerate(urls, 1):
-                try:
-                    rss.feeds_to_database([url], feedsdb_path, tablename="items",
-                                          tags={"guid": "rss_guid", "link": "rss_link", "pubDate": "rss_pubdate",
-                                                "title": "rss_title", "description": "rss_description"},
-                                          keys=["rss_guid", "rss_link"])
-                    log.info(f"  - {url} ... success.")
-                except Exception as e:
-                    log.error(f"  - {url} ... error: {e}")
+            failed = {}
+            try:
+                rss.feeds_to_database(urls, feedsdb_path, tablename="items",
+                                      tags=pipeline.ITEM_TAGS, keys=pipeline.ITEM_KEYS,
+                                      max_workers=args.workers, max_per_host=args.per_host, failed=failed)
+                dates.normalize_items(conn)
+                dedup.screen_items(conn)
+            except Exception as e:
+                log.error(f"Failed to store RSS feeds: {e}")
+            else:
+                # Feeds which failed have been logged while fetching.
+                for url in urls:
+                    if url not in failed:
+                        log.info(f"  - {url} ... success.")
 
         elif args.rss_command == "download":
             log.debug("rss download!")
@@ -168,3 +328,53 @@ if __name__ == "__main__":
             log.warning("rss extract!")
             log.error("rss extract!")
             log.critical("rss extract!")
+        elif args.rss_command == "analyze":
+            catalogdb_path = pathlib.Path(pathlib.PurePosixPath(config["rss"]["catalogdb-path"]))
+            catalogdb_schema = pathlib.Path(pathlib.PurePosixPath(config["rss"]["catalogdb-schema"]))
+            automaton = symbols.compile_symbols(symbols.load_symbols(args.symbols))
+            conn = util.connect_db(catalogdb_path, catalogdb_schema)
+            count = symbols.analyze_texts(conn, automaton, maxitems=args.maxitems, batchsize=args.batchsize)
+            log.info(f"Analyzed {count} texts.")
+        elif args.rss_command == "run":
+            stop = threading.Event()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda signum, frame: stop.set())
+            pipeline.run(config["rss"]["feeds"],
+                         pathlib.Path(pathlib.PurePosixPath(config["rss"]["feedsdb-path"])),
+                         pathlib.Path(pathlib.PurePosixPath(config["rss"]["feedsdb-schema"])),
+                         pathlib.Path(pathlib.PurePosixPath(config["rss"]["catalogdb-path"])),
+                         pathlib.Path(pathlib.PurePosixPath(config["rss"]["catalogdb-schema"])),
+                         symbols.compile_symbols(symbols.load_symbols(args.symbols)), stop,
+                         fetch_interval=args.interval, queue_size=args.queue_size, batchsize=args.batchsize,
+                         max_per_host=args.per_host, download_workers=args.download_workers,
+                         extract_workers=args.extract_workers, metrics_textfile=metrics_textfile)
+        elif args.rss_command == "search":
+            catalogdb_path = pathlib.Path(pathlib.PurePosixPath(config["rss"]["catalogdb-path"]))
+            catalogdb_schema = pathlib.Path(pathlib.PurePosixPath(config["rss"]["catalogdb-schema"]))
+            conn = util.connect_db(catalogdb_path, catalogdb_schema)
+            dates.create_columns(conn_catalog=conn)
+            try:
+                if not search.create_index(conn) and args.rebuild:
+                    log.info("Rebuilding full-text index ...")
+                    search.rebuild_index(conn)
+                start = time.perf_counter()
+                since = int(time.time() - args.hours * 3600) if args.hours is not None else None
+                hits = search.search(conn, args.query, limit=args.limit, raw=args.raw, since=since)
+                elapsed = time.perf_counter() - start
+            except sqlite3.OperationalError as e:
+                log.error(f"Invalid query '{args.query}': {e}")
+                sys.exit(1)
+            for hit in hits:
+                print(f"{hit.score:8.2f}  {hit.date}  {hit.title}\n          {hit.url}\n          {hit.snippet}")
+            log.info(f"Found {len(hits)} hits in {elapsed * 1000:.1f} ms.")
+        elif args.rss_command == "metrics":
+            feedsdb_path = pathlib.Path(pathlib.PurePosixPath(config["rss"]["feedsdb-path"]))
+            since = time.time() - args.hours * 3600 if args.hours is not None else None
+            metrics.report(util.connect_db(feedsdb_path), since, args.top)
+
+        # Export what the command has measured. 'rss run' exports periodically.
+        if args.rss_command in ("fetch", "download", "extract", "analyze"):
+            feedsdb_path = pathlib.Path(pathlib.PurePosixPath(config["rss"]["feedsdb-path"]))
+            metrics.flush(util.connect_db(feedsdb_path), metrics_textfile)
+
+    util.close_dbs()
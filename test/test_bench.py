@@ -0,0 +1,46 @@
+from src import bench
+from src import pipeline
+from src import rss
+
+
+def test_percentile():
+    samples = list(range(100, 0, -1))
+    assert bench.percentile(samples, 50) == 50
+    assert bench.percentile(samples, 99) == 99
+    assert bench.percentile([3.0], 99) == 3.0
+    assert bench.percentile([], 50) == 0.0
+
+
+def test_compare():
+    baseline = {"a": {"throughput": 100.0, "p50": 1.0, "p99": 2.0, "peak_rss": 1000}}
+    fine = bench.Result("a", "docs", 90, 1.0, 1.1, 2.2, 1100)  # everything 10% worse
+    assert bench.compare([fine], baseline, threshold=0.2) == []
+    slow = bench.Result("a", "docs", 50, 1.0, 1.0, 3.0, 1000)
+    regressions = bench.compare([slow], baseline, threshold=0.2)
+    assert [regression.split()[1] for regression in regressions] == ["throughput", "p99"]
+    assert bench.compare([bench.Result("b", "docs", 1, 1.0, 9.0, 9.0, 9)], baseline) == []
+
+
+def test_baseline_roundtrip(tmp_path):
+    path = tmp_path / "bench" / "baseline.json"
+    assert bench.load_baseline(path) == {}
+    bench.save_baseline([bench.Result("a", "docs", 10, 2.0, 0.1, 0.3, 1000)], path)
+    bench.save_baseline([bench.Result("b", "items", 5, 1.0, 0.2, 0.2, 2000)], path)
+    baseline = bench.load_baseline(path)
+    assert set(baseline) == {"a", "b"}
+    assert baseline["a"]["throughput"] == 5.0
+
+
+def test_synthetic_feed():
+    records = list(rss.parse_feed(bench.synthetic_feed(2, 10), pipeline.ITEM_TAGS))
+    assert len(records) == 10
+    assert len({record[0] for record in records}) == 10
+    assert records[0][0] == str(2 * bench.ITEMS_PER_FEED)
+    assert "&" in records[0][4]
+
+
+def test_run():
+    results = bench.run(["feeds_to_dataframe", "feeds_to_database"], repeat=1, sizes=[1500])
+    assert [result.name for result in results] == ["feeds_to_dataframe", "feeds_to_database[1500]"]
+    assert results[1].count == 1500
+    assert all(result.throughput > 0 and result.peak_rss > 0 for result in results)
@@ -0,0 +1,52 @@
+import sqlite3
+
+from src import blobs
+
+
+def test_put_get():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(blobs.CREATE_BLOBS_TABLE)
+    html = "<html><body><p>Äpfel & Birnen</p></body></html>" * 100
+    digest = blobs.put(conn, html)
+    assert digest == blobs.put(conn, html)
+    assert conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 1
+    assert blobs.get(conn, digest) == html
+    assert blobs.get(conn, "unknown") is None
+
+
+def test_put_concurrently(tmp_path):
+    class Racing:
+        """Connection on which another writer stores the same text right after the lookup."""
+
+        def __init__(self, conn, other):
+            self.conn, self.other = conn, other
+
+        def execute(self, statement, *args):
+            cursor = self.conn.execute(statement, *args)
+            if statement.startswith("SELECT"):
+                blobs.put(self.other, "<p>same</p>")
+                self.other.commit()
+            return cursor
+
+    conn, other = sqlite3.connect(str(tmp_path / "feeds.db")), sqlite3.connect(str(tmp_path / "feeds.db"))
+    conn.execute(blobs.CREATE_BLOBS_TABLE)
+    conn.commit()
+    digest = blobs.put(Racing(conn, other), "<p>same</p>")
+    conn.commit()
+    assert conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 1
+    assert blobs.get(conn, digest) == "<p>same</p>"
+
+
+def test_migrate_html_table():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE html (rss_guid TEXT, rss_link TEXT, dest_url TEXT, html TEXT, "
+                 "PRIMARY KEY (rss_guid, rss_link))")
+    conn.executemany("INSERT INTO html VALUES (?, ?, ?, ?)",
+                     [("1", "a", "x", "<p>same</p>"), ("2", "b", "x", "<p>same</p>"), ("3", "c", "y", None)])
+    conn.commit()
+    assert blobs.migrate_html_table(conn) == 3
+    assert blobs.migrate_html_table(conn) == 0
+    rows = conn.execute("SELECT rss_guid, html_hash FROM html ORDER BY rss_guid").fetchall()
+    assert rows[0][1] == rows[1][1] and rows[2][1] is None
+    assert blobs.get(conn, rows[0][1]) == "<p>same</p>"
+    assert conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 1
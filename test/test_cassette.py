@@ -0,0 +1,115 @@
+import http.server
+import threading
+
+import pytest
+
+from src import cassette
+from src import pipeline
+from src import rss
+from src import throttle
+from src import util
+
+FEED = open("test/parse-feed/finanznachrichten.de-1.xml", "rb").read()
+
+
+class Origin(http.server.BaseHTTPRequestHandler):
+    """Stands in for the real hosts while recording."""
+
+    def do_GET(self):
+        if self.path == "/feed":
+            status, headers, body = 200, {"Content-Type": "application/rss+xml", "ETag": '"v1"'}, FEED
+        elif self.path == "/old":
+            status, headers, body = 301, {"Location": "/article"}, b""
+        elif self.path == "/article":
+            status, headers, body = 200, {"Content-Type": "text/html; charset=utf-8"}, "<p>Börse</p>".encode()
+        else:
+            status, headers, body = 404, {}, b""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    """Record responses of the origin server to a cassette and return its path and the origin's URL."""
+    origin = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Origin)
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{origin.server_address[1]}"
+    path = tmp_path / "cassette.db"
+    throttle.configure(rate=1000, burst=1000)
+    cassette.record(path)
+    try:
+        assert throttle.get(f"{base}/feed").content == FEED
+        assert throttle.get(f"{base}/old").url == f"{base}/article"
+    finally:
+        cassette.reset()
+        origin.shutdown()
+        origin.server_close()
+    yield path, base
+    cassette.reset()
+    throttle.configure()
+
+
+def test_record(recorded):
+    path, base = recorded
+    responses = cassette.load(util.connect_db(path))
+    assert set(responses) == {f"{base}/feed", f"{base}/old", f"{base}/article"}
+    assert responses[f"{base}/old"].status == 301
+    assert responses[f"{base}/article"].body.decode() == "<p>Börse</p>"
+    assert "Content-Length" not in responses[f"{base}/feed"].headers
+
+
+def test_replay(recorded):
+    path, base = recorded
+    server = cassette.start_server(path, port=0)
+    try:
+        cassette.replay(f"http://127.0.0.1:{server.server_address[1]}")
+        response = throttle.get(f"{base}/old")  # origin is gone
+        assert response.url == f"{base}/article"
+        assert [r.url for r in response.history] == [f"{base}/old"]
+        assert response.text == "<p>Börse</p>"
+        assert throttle.get(f"{base}/feed", headers={"If-None-Match": '"v1"'}).status_code == 304
+        assert throttle.get(f"{base}/missing").status_code == 404
+        records = list(rss.feed_records([f"{base}/feed"], pipeline.ITEM_TAGS))
+        assert records == list(rss.parse_feed(FEED, pipeline.ITEM_TAGS))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_replay_errors(recorded, monkeypatch):
+    path, base = recorded
+    monkeypatch.setattr(throttle, "MAX_RETRIES", 0)
+    server = cassette.start_server(path, port=0, error_rate=1.0)
+    try:
+        cassette.replay(f"http://127.0.0.1:{server.server_address[1]}")
+        assert throttle.get(f"{base}/article").status_code == 503
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_replay_copies(recorded):
+    path, base = recorded
+    server = cassette.start_server(path, port=0, copies=3)
+    try:
+        cassette.replay(f"http://127.0.0.1:{server.server_address[1]}")
+        original = list(rss.parse_feed(FEED, pipeline.ITEM_TAGS))
+        first = list(rss.feed_records([f"{base}/feed"], pipeline.ITEM_TAGS))
+        second = list(rss.feed_records([f"{base}/feed"], pipeline.ITEM_TAGS))
+        assert len(first) == len(second) == 3 * len(original)
+        assert len({record[:2] for record in first + second}) == 6 * len(original)
+        assert first[0][0] == f"{original[0][0]}#1-0" and first[0][2:] == original[0][2:]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_multiply_feed_ignores_other_bodies():
+    assert cassette.multiply_feed(b"<html><p>item</p></html>", 3, 1) == b"<html><p>item</p></html>"
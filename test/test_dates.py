@@ -0,0 +1,95 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from src import dates
+from src import util
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    dates._formats.clear()
+    yield
+    dates._formats.clear()
+
+
+def test_parse():
+    values = ["Fri, 05 Mar 2021 09:41:00 +0100", "Thu, 04 Mar 2021 15:30:00 GMT", "2021-03-05T18:30:02+01:00",
+              "Fri, 05 Mar 2021 09:41:00 EST", " 5 Mar 2021 08:41 +0000\n", "Fr, 05 Mär 2021 09:41:00 MEZ",
+              "2021-03-05", "Fri, 05 Mar 2021 09:41:00 XYZ", "gestern", "Fri, 35 Mar 2021 09:41:00 +0100",
+              "Wed, 31 Feb 2021 09:41:00 +0100", "2021-02-29", "2020-02-29", None]
+    assert dates.parse(values) == [1614933660, 1614871800, 1614965402, 1614955260, 1614933660, 1614933660,
+                                   1614902400, 1614937260, None, None, None, None, 1582934400, None]
+    assert dates.parse([]) == []
+
+
+def test_parse_remembers_formats_per_feed():
+    dates.parse(["2021-03-05T18:30:02Z"], "example.org")
+    assert dates._formats["example.org"] == ("iso8601", "rfc822")
+    assert dates._formats.get("example.com") is None
+    dates.parse(["Thu, 04 Mar 2021 15:30:00 GMT"] * 2 + ["2021-03-05T18:30:02Z"], "example.org")
+    assert dates._formats["example.org"] == ("rfc822", "iso8601")
+
+
+def test_normalize():
+    assert dates.normalize("Fri, 05 Mar 2021 09:41:00 +0100") == ("2021-03-05T08:41:00Z", 1614933660)
+    assert dates.normalize("ignored", 0) == ("1970-01-01T00:00:00Z", 0)
+    assert dates.normalize("gestern") == ("gestern", None)
+    assert dates.normalize(None) == (None, None)
+
+
+def test_create_columns(tmp_path, caplog):
+    # Databases created before publication dates were normalized
+    conn_feeds = sqlite3.connect(str(tmp_path / "feeds.db"))
+    conn_feeds.execute("CREATE TABLE items (rss_guid TEXT, rss_link TEXT, rss_pubdate TEXT, "
+                       "PRIMARY KEY (rss_guid, rss_link))")
+    conn_feeds.executemany("INSERT INTO items VALUES (?, ?, ?)",
+                           [("1", "https://a.de/1", "Fri, 05 Mar 2021 09:41:00 +0100"), ("2", "https://a.de/2", "?"),
+                            ("3", "https://b.de/3", "2021-03-05T18:30:02Z")])
+    conn_catalog = sqlite3.connect(str(tmp_path / "catalog.db"))
+    conn_catalog.execute("CREATE TABLE texts (url TEXT, date TEXT, title TEXT, description TEXT, fulltext TEXT, "
+                         "PRIMARY KEY (url, date))")
+    conn_catalog.executemany("INSERT INTO texts VALUES (?, ?, '', '', '')",
+                             [("https://a.de/1", "Fri, 05 Mar 2021 09:41:00 +0100"), ("https://a.de/2", "?"),
+                              ("https://a.de/3", "Fri, 05 Mar 2021 08:41:00 GMT"),
+                              ("https://a.de/3", "Fri, 05 Mar 2021 09:41:00 +0100")])
+    for table in ("analysis", "progress"):
+        conn_catalog.execute(f"CREATE TABLE {table} (url TEXT, date TEXT, value TEXT, PRIMARY KEY (url, date))")
+        conn_catalog.executemany(f"INSERT INTO {table} VALUES (?, ?, '')",
+                                 [("https://a.de/1", "Fri, 05 Mar 2021 09:41:00 +0100"),
+                                  ("https://a.de/3", "Fri, 05 Mar 2021 09:41:00 +0100")])
+    conn_feeds.commit()
+    conn_catalog.commit()
+
+    assert dates.create_columns(conn_feeds, conn_catalog) == 5
+    assert dates.create_columns(conn_feeds, conn_catalog) == 0
+    assert conn_feeds.execute("SELECT rss_guid, rss_published FROM items ORDER BY rss_guid").fetchall() == [
+        ("1", 1614933660), ("2", None), ("3", 1614969002)]
+    # Dates are rewritten as new texts are stored, unless the text is stored under that date already, in
+    # which case its analysis and progress keep the date as well
+    assert conn_catalog.execute("SELECT url, date, published FROM texts ORDER BY url, date").fetchall() == [
+        ("https://a.de/1", "2021-03-05T08:41:00Z", 1614933660), ("https://a.de/2", "?", None),
+        ("https://a.de/3", "2021-03-05T08:41:00Z", 1614933660),
+        ("https://a.de/3", "Fri, 05 Mar 2021 09:41:00 +0100", 1614933660)]
+    assert dates.normalize("Fri, 05 Mar 2021 09:41:00 +0100")[0] == "2021-03-05T08:41:00Z"
+    for table in ("analysis", "progress"):
+        assert conn_catalog.execute(f"SELECT url, date FROM {table} ORDER BY url").fetchall() == [
+            ("https://a.de/1", "2021-03-05T08:41:00Z"), ("https://a.de/3", "Fri, 05 Mar 2021 09:41:00 +0100")]
+    assert "Kept the dates of 1 texts" in caplog.text
+    plan = " ".join(row[-1] for row in conn_catalog.execute(
+        "EXPLAIN QUERY PLAN SELECT url FROM texts WHERE published >= ? ORDER BY published DESC", (0,)))
+    assert "INDEX texts_published" in plan and "TEMP B-TREE" not in plan
+
+
+def test_normalize_items(tmp_path):
+    conn = util.connect_db(tmp_path / "feeds.db", Path("db/rss-feeds.schema"))
+    assert dates.create_columns(conn) == 0  # created from the schema
+    conn.executemany("INSERT INTO items (rss_guid, rss_link, rss_pubdate) VALUES (?, ?, ?)",
+                     [("1", "https://a.de/1", "Thu, 04 Mar 2021 15:30:00 GMT"), ("2", "https://a.de/2", None)])
+    conn.execute("DELETE FROM queue WHERE rss_guid = '2'")
+    conn.commit()
+    assert dates.normalize_items(conn) == 1
+    assert dates.normalize_items(conn) == 0
+    assert conn.execute("SELECT rss_published FROM items ORDER BY rss_guid").fetchall() == [(1614871800,), (None,)]
+    util.close_dbs()
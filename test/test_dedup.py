@@ -0,0 +1,105 @@
+from pathlib import Path
+
+from src import dedup
+from src import metrics
+from src import util
+from src import workqueue
+
+ARTICLE = ("Die Aktie der Muster AG ist am Dienstag deutlich gestiegen, nachdem das Unternehmen seine Prognose "
+           "für das laufende Geschäftsjahr angehoben hat. Der Umsatz soll nun um zehn Prozent wachsen, das "
+           "operative Ergebnis überproportional zulegen. Analysten reagierten positiv und hoben ihre Kursziele an.")
+TEXTS = [Path(f"test/extract-fulltext/{name}.txt").read_text() for name in ("deraktionaer.de-1", "4investors.de-1")]
+
+
+def test_simhash():
+    text, other = TEXTS
+    edited = "Anzeige\n" + text + "\nQuelle: dpa-AFX"
+    assert dedup.distance(dedup.simhash(text), dedup.simhash(text.upper())) == 0
+    assert dedup.distance(dedup.simhash(text), dedup.simhash(edited)) <= dedup.MAX_DISTANCE[dedup.TEXT]
+    assert dedup.distance(dedup.simhash(text), dedup.simhash(other)) > dedup.MAX_DISTANCE[dedup.TEXT]
+    assert dedup.simhash("Zu kurz") is None
+    assert 0 <= dedup.simhash(ARTICLE) < 1 << 64
+
+
+def test_screen(tmp_path):
+    conn = util.connect_db(tmp_path / "feeds.db")
+    dedup.create_tables(conn)
+    metrics.reset()
+    entries = [(("1", "a"), TEXTS[0]), (("2", "b"), TEXTS[0] + "\nMehr dazu"), (("3", "c"), "Zu kurz")]
+    with util.transaction(conn):
+        assert dedup.screen(conn, dedup.TEXT, entries) == {("2", "b"): ("1", "a")}
+    assert metrics.drain()["counters"] == {(metrics.DUPLICATES, (("kind", dedup.TEXT),)): 1}
+    assert conn.execute("SELECT rss_guid, simhash IS NULL FROM fingerprints ORDER BY rss_guid").fetchall() == [
+        ("1", 0), ("3", 1)]
+    # Screening again yields the same result
+    with util.transaction(conn):
+        assert dedup.screen(conn, dedup.TEXT, entries) == {("2", "b"): ("1", "a")}
+    assert conn.execute("SELECT COUNT(*) FROM duplicates").fetchone() == (1,)
+    # Fingerprints of another kind are not compared
+    with util.transaction(conn):
+        assert dedup.screen(conn, dedup.ITEM, entries[1:2]) == {}
+    util.close_dbs()
+
+
+def test_screen_items(tmp_path):
+    conn = util.connect_db(tmp_path / "feeds.db", Path("db/rss-feeds.schema"))
+    workqueue.create_queue(conn)
+    title, description = ARTICLE.split(". ", 1)
+    conn.executemany("INSERT INTO items (rss_guid, rss_link, rss_title, rss_description) VALUES (?, ?, ?, ?)",
+                     [("1", "a", title, description), ("2", "b", title, description),
+                      ("3", "c", "Ölpreis fällt", "Die Förderländer weiten die Produktion aus.")])
+    conn.commit()
+    assert dedup.screen_items(conn) == 1
+    assert workqueue.pending(conn, workqueue.DOWNLOAD) == [("1", "a"), ("3", "c")]
+    assert conn.execute("SELECT rss_guid, canonical_guid FROM duplicates").fetchall() == [("2", "1")]
+    assert dedup.screen_items(conn) == 0
+    util.close_dbs()
+
+
+def test_screen_items_keeps_template_headlines(tmp_path):
+    conn = util.connect_db(tmp_path / "feeds.db", Path("db/rss-feeds.schema"))
+    workqueue.create_queue(conn)
+    items = []
+    for guid, company in (("1", "Muster AG"), ("2", "Bayer AG"), ("3", "Siemens AG")):
+        title, description = ARTICLE.replace("Muster AG", company).split(". ", 1)
+        items.append((guid, guid, title, description))
+    conn.executemany("INSERT INTO items (rss_guid, rss_link, rss_title, rss_description) VALUES (?, ?, ?, ?)", items)
+    conn.commit()
+    # Items differing in the company name only are different news
+    assert dedup.screen_items(conn) == 0
+    assert workqueue.pending(conn, workqueue.DOWNLOAD) == [("1", "1"), ("2", "2"), ("3", "3")]
+    util.close_dbs()
+
+
+def test_release(tmp_path):
+    conn = util.connect_db(tmp_path / "feeds.db", Path("db/rss-feeds.schema"))
+    workqueue.create_queue(conn)
+    dedup.create_tables(conn)
+    title, description = ARTICLE.split(". ", 1)
+    conn.executemany("INSERT INTO items (rss_guid, rss_link, rss_title, rss_description) VALUES (?, ?, ?, ?)",
+                     [(guid, link, title, description) for guid, link in (("1", "a"), ("2", "b"), ("3", "c"))])
+    conn.commit()
+    assert dedup.screen_items(conn) == 2
+    # The canonical item fails to download: its first duplicate is downloaded instead
+    with util.transaction(conn):
+        assert dedup.release(conn, [("1", "a")]) == 1
+        workqueue.requeue(conn, [("1", "a")])
+    assert sorted(workqueue.pending(conn, workqueue.DOWNLOAD)) == [("1", "a"), ("2", "b")]
+    assert conn.execute("SELECT rss_guid, kind FROM fingerprints").fetchall() == [("2", dedup.ITEM)]
+    assert conn.execute("SELECT rss_guid, canonical_guid FROM duplicates").fetchall() == [("3", "2")]
+    # Retried, the failed item duplicates its successor
+    assert dedup.screen_items(conn) == 1
+    assert workqueue.pending(conn, workqueue.DOWNLOAD) == [("2", "b")]
+    # Duplicates of texts were marked as done and are extracted again
+    with util.transaction(conn):
+        assert dedup.screen(conn, dedup.TEXT, [(("2", "b"), TEXTS[0]), (("4", "d"), TEXTS[0])]) == {
+            ("4", "d"): ("2", "b")}
+        conn.execute("INSERT INTO progress VALUES ('4', 'd', 1)")
+        assert dedup.release(conn, [("2", "b")]) == 2
+    assert workqueue.pending(conn, workqueue.EXTRACT) == [("4", "d")]
+    assert conn.execute("SELECT COUNT(*) FROM progress").fetchone() == (0,)
+    assert sorted(workqueue.pending(conn, workqueue.DOWNLOAD)) == [("2", "b"), ("3", "c")]
+    assert conn.execute("SELECT rss_guid, kind FROM fingerprints ORDER BY rss_guid").fetchall() == [
+        ("3", dedup.ITEM), ("4", dedup.TEXT)]
+    assert conn.execute("SELECT rss_guid, canonical_guid FROM duplicates").fetchall() == [("1", "3")]
+    util.close_dbs()
@@ -0,0 +1,16 @@
+from src import domains
+
+
+def test_registered_domain():
+    assert domains.registered_domain("https://www.finanznachrichten.de/nachrichten-2021-03/x.htm") \
+        == "finanznachrichten.de"
+    assert domains.registered_domain("https://www.fool.co.uk/feed/") == "fool.co.uk"
+    assert domains.registered_domain("HTTPS://WWW.DERAKTIONAER.DE/artikel") == "deraktionaer.de"
+    assert domains.registered_domain("www.stock-world.de:8080/news") == "stock-world.de"
+
+
+def test_registered_domain_is_memoized():
+    domains.registered_domain("https://www.4investors.de/a")
+    hits = domains._host_domain.cache_info().hits
+    domains.registered_domain("https://www.4investors.de/b")
+    assert domains._host_domain.cache_info().hits == hits + 1
@@ -0,0 +1,91 @@
+import threading
+import time
+import urllib.parse
+
+import pytest
+import requests
+
+from src import rss
+from src import throttle
+from src import util
+
+
+class FakeSession:
+    """Answers each URL with the body and status of *pages* after *delay* seconds."""
+
+    def __init__(self, pages, delay=0.0):
+        self.pages = pages
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            self.calls.append(url)
+        time.sleep(self.delay)
+        body, status = self.pages[url]
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response.encoding = "utf-8"
+        response._content = body.encode()
+        return response
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    throttle.configure(rate=1e9, burst=10**9)
+    yield
+    throttle.configure()
+
+
+def test_download_html(monkeypatch):
+    pages = {"https://a.de/1": ("<p>Eins</p>", 200), "https://a.de/2": ("<p>Zwei</p>", 200),
+             "https://b.de/3": ("<p>Drei</p>", 200), "https://b.de/4": ("Not found", 404)}
+    sessions = {}  # host -> FakeSession
+
+    def http_session(url):
+        return sessions.setdefault(urllib.parse.urlsplit(url).hostname, FakeSession(pages, delay=0.01))
+
+    monkeypatch.setattr(util, "http_session", http_session)
+    traces = {f"https://feed.de/{ii}": url for ii, url in enumerate(pages, 1)}
+    traces["https://feed.de/5"] = NotImplementedError("Incomplete handler")
+    items = [(str(ii), f"https://feed.de/{ii}") for ii in range(1, 6)] + [("6", "https://other.de/6")]
+    pulled = []
+
+    def pull():
+        for item in items:
+            pulled.append(item)
+            yield item
+
+    results = rss.download_html(pull(), max_workers=2, traces=traces)
+    first = next(results)
+    assert len(pulled) <= 2 * 2  # items are taken from the iterable as workers become free
+    results = [first] + list(results)
+
+    # One result per item in order of completion
+    assert sorted(result[0] for result in results) == ["1", "2", "3", "4", "5", "6"]
+    results = {result[0]: result for result in results}
+    assert results["1"] == ("1", "https://feed.de/1", "https://a.de/1", "<p>Eins</p>", None)
+    assert results["3"] == ("3", "https://feed.de/3", "https://b.de/3", "<p>Drei</p>", None)
+    # Errors are handed back instead of being raised
+    guid, link, dest_url, html, error = results["4"]
+    assert (dest_url, html, type(error)) == ("https://b.de/4", None, requests.exceptions.HTTPError)
+    assert results["5"][2:4] == (None, None) and results["5"][4] is traces["https://feed.de/5"]
+    assert isinstance(results["6"][4], NotImplementedError)  # no handler to trace the link
+    # Requests are sent via the session of their host
+    assert sorted(sessions) == ["a.de", "b.de"]
+    assert sorted(sessions["a.de"].calls) == ["https://a.de/1", "https://a.de/2"]
+    assert sorted(sessions["b.de"].calls) == ["https://b.de/3", "https://b.de/4"]
+
+
+def test_http_session_per_host():
+    hosts = ("a.example.org", "b.example.org")
+    try:
+        session = util.http_session(f"https://{hosts[0]}/1")
+        assert util.http_session(f"http://{hosts[0]}/2") is session
+        assert util.http_session(f"https://{hosts[1]}/1") is not session
+        assert session.get_adapter(f"https://{hosts[0]}/")._pool_maxsize == util.HTTP_POOL_SIZE
+    finally:
+        for host in hosts:
+            util._http_sessions.pop(host, None)
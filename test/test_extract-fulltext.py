@@ -34,4 +34,12 @@ def test_all():
 
 
 def testfoo():
-    assert True
\ No newline at end of file
+    assert True
+
+def test_extract_fulltexts():
+    names = sorted({name[:-4] for name in os.listdir("test/extract-fulltext") if name.endswith(".txt")})
+    records = [(name, *read_test_parameters(name)[:2]) for name in names]
+    results = {name: (fulltext, error) for name, fulltext, error in rss.extract_fulltexts(records, 2, 3)}
+    assert set(results) == set(names)
+    for name, url, html in records:
+        assert results[name] == (rss.extract_fulltext(url, html), None)
@@ -0,0 +1,120 @@
+import threading
+import time
+import urllib.parse
+
+import pytest
+import requests
+
+from src import rss
+from src import throttle
+from src import util
+
+FEED = open("test/parse-feed/finanznachrichten.de-1.xml", "rb").read()
+
+
+class FakeSession:
+    """Answers each URL with a body, status and headers of *pages*; unknown hosts don't resolve.
+
+    Each request takes *delay* seconds. The most requests running at once
+    are counted per host in *peak*.
+    """
+
+    def __init__(self, pages, delay=0.0):
+        self.pages = pages
+        self.delay = delay
+        self.calls = []
+        self.active = {}
+        self.peak = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        host = urllib.parse.urlsplit(url).hostname
+        with self.lock:
+            self.calls.append((url, kwargs.get("headers", {})))
+            self.active[host] = self.active.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+        try:
+            time.sleep(self.delay)
+            if url not in self.pages:
+                raise requests.exceptions.ConnectionError(f"'{host}': Name or service not known")
+            body, status, headers = self.pages[url]
+        finally:
+            with self.lock:
+                self.active[host] -= 1
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = body
+        return response
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    throttle.configure(rate=1e9, burst=10**9)
+    yield
+    throttle.configure()
+
+
+def test_feed_records_skips_broken_feeds(monkeypatch):
+    truncated = FEED[:FEED.index(b"</item>") + len(b"</item>")] + b"<item><title>Abgeschnit"
+    session = FakeSession({"https://a.de/rss": (FEED, 200, {}), "https://b.de/rss": (b"", 200, {}),
+                           "https://c.de/rss": (truncated, 200, {})})
+    monkeypatch.setattr(util, "http_session", lambda url: session)
+    failed = {}
+    records = list(rss.feed_records(["https://b.de/rss", "https://a.de/rss", "https://c.de/rss"], failed=failed))
+    expected = list(rss.parse_feed(FEED))
+    # The empty feed fails, the truncated one keeps its complete items
+    assert list(failed) == ["https://b.de/rss"]
+    assert records[:len(expected)] == expected
+    assert records[len(expected)] == expected[0]
+    with pytest.raises(SyntaxError):
+        list(rss.feed_records(["https://b.de/rss"]))
+
+
+def test_fetch_feeds_limits_hosts(monkeypatch):
+    urls = [f"https://a.de/rss{ii}" for ii in range(6)] + [f"https://b.de/rss{ii}" for ii in range(3)]
+    session = FakeSession({url: (FEED, 200, {}) for url in urls}, delay=0.05)
+    monkeypatch.setattr(util, "http_session", lambda url: session)
+    start = time.monotonic()
+    results = list(rss.fetch_feeds(urls, max_workers=8, max_per_host=2))
+    # Results are in the order of the URLs; hosts are downloaded from in parallel
+    assert [(url, response.content, error) for url, response, error in results] == [(url, FEED, None) for url in urls]
+    assert session.peak == {"a.de": 2, "b.de": 2}
+    assert time.monotonic() - start < 6 * 0.05
+
+
+def test_feed_records_isolates_failures(monkeypatch):
+    session = FakeSession({"https://a.de/rss": (FEED, 200, {}), "https://b.de/rss": (b"", 404, {}),
+                           "https://d.de/rss": (FEED, 200, {})})
+    monkeypatch.setattr(util, "http_session", lambda url: session)
+    failed = {}
+    records = list(rss.feed_records(["https://a.de/rss", "https://b.de/rss", "https://c.de/rss", "https://d.de/rss"],
+                                    failed=failed))
+    assert records == list(rss.parse_feed(FEED)) * 2
+    assert sorted(failed) == ["https://b.de/rss", "https://c.de/rss"]
+    assert isinstance(failed["https://b.de/rss"], requests.exceptions.HTTPError)
+    assert isinstance(failed["https://c.de/rss"], requests.exceptions.ConnectionError)
+
+
+def test_conditional_get(monkeypatch):
+    url = "https://a.de/rss"
+    session = FakeSession({url: (FEED, 200, {"ETag": '"v1"', "Last-Modified": "Fri, 05 Mar 2021 09:41:00 GMT"})})
+    monkeypatch.setattr(util, "http_session", lambda url: session)
+    validators = {}
+    assert list(rss.feed_records([url], validators=validators)) == list(rss.parse_feed(FEED))
+    assert session.calls[0][1].get("If-None-Match") is None
+    assert validators[url] == ('"v1"', "Fri, 05 Mar 2021 09:41:00 GMT", rss.feed_validators(session.get(url))[2])
+
+    # Validators of the previous download are sent along; 'not modified' is skipped
+    session.pages[url] = (b"", 304, {})
+    assert list(rss.feed_records([url], validators=validators)) == []
+    headers = session.calls[-1][1]
+    assert headers["If-None-Match"] == '"v1"' and headers["If-Modified-Since"] == "Fri, 05 Mar 2021 09:41:00 GMT"
+    assert validators[url][0] == '"v1"'
+
+    # Servers ignoring the headers send the same body again, which isn't parsed
+    session.pages[url] = (FEED, 200, {})
+    monkeypatch.setattr(rss, "parse_feed", lambda *args: pytest.fail("Unchanged feed was parsed."))
+    assert list(rss.feed_records([url], validators=validators)) == []
+    assert validators[url][:2] == (None, None)
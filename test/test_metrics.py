@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+from src import metrics
+from src import rss
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_textfile():
+    metrics.inc(metrics.FAILURES, stage="download", cause="Timeout")
+    metrics.inc(metrics.FAILURES, 2, stage="download", cause="Timeout")
+    metrics.observe(metrics.HTTP_SECONDS, 0.02, host='a"b')
+    metrics.observe(metrics.HTTP_SECONDS, 100, host='a"b')
+    lines = metrics.textfile().splitlines()
+    assert 'stockbro_failures_total{cause="Timeout",stage="download"} 3' in lines
+    assert '# TYPE stockbro_http_request_seconds histogram' in lines
+    assert 'stockbro_http_request_seconds_bucket{host="a\\"b",le="0.01"} 0' in lines
+    assert 'stockbro_http_request_seconds_bucket{host="a\\"b",le="0.025"} 1' in lines
+    assert 'stockbro_http_request_seconds_bucket{host="a\\"b",le="+Inf"} 2' in lines
+    assert 'stockbro_http_request_seconds_count{host="a\\"b"} 2' in lines
+
+
+def test_write_textfile(tmp_path):
+    metrics.inc(metrics.ITEMS, stage="fetch")
+    metrics.write_textfile(tmp_path / "metrics" / "stockbro.prom")
+    assert (tmp_path / "metrics" / "stockbro.prom").read_text() == metrics.textfile()
+    assert [path.name for path in (tmp_path / "metrics").iterdir()] == ["stockbro.prom"]
+
+
+def test_store():
+    conn = sqlite3.connect(":memory:")
+    metrics.inc(metrics.ITEMS, 5, stage="fetch")
+    metrics.observe(metrics.STAGE_SECONDS, 0.5, stage="fetch")
+    assert metrics.store(conn) == 2
+    assert metrics.store(conn) == 0  # nothing changed
+    metrics.inc(metrics.ITEMS, 2, stage="fetch")
+    metrics.observe(metrics.STAGE_SECONDS, 1.5, stage="fetch")
+    assert metrics.store(conn) == 2
+    rows = conn.execute("SELECT value, count FROM metrics WHERE name = ? ORDER BY rowid",
+                        (metrics.ITEMS,)).fetchall()
+    assert rows == [(5, None), (2, None)]
+    summary = {series.name: series for series in metrics.summary(conn)}
+    assert summary[metrics.ITEMS].value == 7
+    assert summary[metrics.STAGE_SECONDS].value == 2.0
+    assert summary[metrics.STAGE_SECONDS].count == 2
+
+
+def test_stage():
+    with pytest.raises(ValueError):
+        with metrics.stage("extract"):
+            raise ValueError()
+    snapshot = metrics.drain()
+    assert snapshot["counters"] == {(metrics.FAILURES, (("cause", "ValueError"), ("stage", "extract"))): 1}
+    assert snapshot["histograms"][(metrics.STAGE_SECONDS, (("stage", "extract"),))][2] == 1
+    assert metrics.drain() == {"counters": {}, "histograms": {}}
+    metrics.merge(snapshot)
+    metrics.merge(snapshot)
+    assert metrics.drain()["counters"][(metrics.FAILURES, (("cause", "ValueError"), ("stage", "extract")))] == 2
+
+
+def test_trace_failures():
+    with pytest.raises(NotImplementedError):
+        rss.trace_link("https://example.org/news")
+    counters = metrics.drain()["counters"]
+    assert counters[(metrics.FAILURES, (("cause", "NotImplementedError"), ("stage", "trace")))] == 1
+
+
+def test_extract_metrics_of_workers():
+    with open("test/extract-fulltext/deraktionaer.de-1.html") as f:
+        url, html = f.read().split("\n", 1)
+    records = [(ii, url, html) for ii in range(4)] + [(4, "https://example.org/", "")]
+    results = list(rss.extract_fulltexts(records, 2, 2))
+    assert len(results) == 5
+    snapshot = metrics.drain()
+    assert snapshot["counters"][(metrics.ITEMS, (("stage", "extract"),))] == 4
+    assert snapshot["counters"][(metrics.FAILURES, (("cause", "NotImplementedError"), ("stage", "extract")))] == 1
+    assert snapshot["histograms"][(metrics.PARSE_SECONDS, (("domain", "deraktionaer.de"), ("kind", "article")))][2] == 4
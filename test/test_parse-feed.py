@@ -0,0 +1,51 @@
+import os
+
+from src import rss
+
+
+def read_test_parameters(testname):
+    """Given a feed-parsing test name return tuple of raw XML and target records.
+
+    Parameters
+    ----------
+    testname: str
+        Name of the feed-parsing test to run. Must not include the path.
+
+    Returns
+    -------
+    tuple
+        Tuple consisting of the feed's raw XML as bytes and the list of target
+        records to compare parsing against. Records are stored tab-separated in
+        the order of rss.DEFAULT_RSS_FIELD_NAMES.
+    """
+    with open(f"test/parse-feed/{testname}.xml", "rb") as f:
+        content = f.read()
+    with open(f"test/parse-feed/{testname}.tsv", encoding="utf-8") as f:
+        records = [tuple(line.rstrip("\n").split("\t")) for line in f]
+    return (content, records)
+
+
+def test_all():
+    names = {name[:-4] for name in os.listdir("test/parse-feed") if name.endswith(".tsv")}
+    for name in names:
+        content, records = read_test_parameters(name)
+        assert records == list(rss.parse_feed(content, parser="lxml"))
+
+
+def test_parsers_agree():
+    # The BeautifulSoup backend supports RSS 2.0 feeds only.
+    names = {name[:-4] for name in os.listdir("test/parse-feed") if name.endswith(".tsv")} - {"atom-1"}
+    tags = dict(rss.DEFAULT_RSS_FIELD_NAMES, **{"dc:creator": "creator", "atom:link": "atom_link"})
+    for name in names:
+        content, _ = read_test_parameters(name)
+        assert list(rss.parse_feed(content, tags, parser="bs4")) == list(rss.parse_feed(content, tags, parser="lxml"))
+        assert list(rss.parse_feed(content.decode("utf-8"), tags, parser="bs4")) \
+            == list(rss.parse_feed(content.decode("utf-8"), tags, parser="lxml"))
+
+
+def test_known_items_are_skipped():
+    content, records = read_test_parameters("finanznachrichten.de-1")
+    known = {(records[0][1], records[0][0])}  # (guid, link) of first item
+    assert records[1:] == list(rss.parse_feed(content, known=known, keys=["guid", "link"]))
+    assert len(known) == len(records)
+    assert [] == list(rss.parse_feed(content, known=known, keys=["guid", "link"]))
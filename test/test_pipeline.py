@@ -0,0 +1,107 @@
+import threading
+import time
+from pathlib import Path
+
+from src import blobs
+from src import pipeline
+from src import symbols
+from src import util
+from src import workqueue
+
+
+def test_run_resumes_backlog(tmp_path):
+    feedsdb, catalogdb = tmp_path / "feeds.db", tmp_path / "catalog.db"
+    with open("test/extract-fulltext/4investors.de-1.html") as f:
+        url = f.readline().rstrip("\n")
+        html = f.read()
+    with open("test/extract-fulltext/4investors.de-1.txt") as f:
+        fulltext = f.read()
+
+    # An item downloaded by a previous run
+    conn = util.connect_db(feedsdb, Path("db/rss-feeds.schema"))
+    conn.execute("INSERT INTO items (rss_guid, rss_link, rss_pubdate, rss_title, rss_description) "
+                 "VALUES ('1', 'a', 'Mon, 01 Mar 2021 10:00:00 GMT', 'Titel', 'AAPL')")
+    conn.execute("INSERT INTO html VALUES ('1', 'a', ?, ?)", (url, blobs.put(conn, html)))
+    workqueue.advance(conn, [("1", "a")], workqueue.EXTRACT)
+    conn.commit()
+    util.close_dbs()
+
+    stop = threading.Event()
+    thread = threading.Thread(target=pipeline.run,
+                              args=([], feedsdb, Path("db/rss-feeds.schema"), catalogdb, Path("db/rss-catalog.schema"),
+                                    symbols.compile_symbols(["AAPL"]), stop),
+                              kwargs={"extract_workers": 1})
+    conn = util.connect_db(catalogdb, Path("db/rss-catalog.schema"))
+    thread.start()
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and conn.execute("SELECT COUNT(*) FROM analysis").fetchone()[0] == 0:
+        time.sleep(0.1)
+    stop.set()
+    thread.join()
+
+    assert conn.execute("SELECT url, fulltext FROM texts").fetchall() == [(url, fulltext)]
+    assert conn.execute("SELECT date, published FROM texts").fetchall() == [("2021-03-01T10:00:00Z", 1614592800)]
+    assert conn.execute("SELECT symbols_verbatim FROM analysis").fetchall() == [("AAPL",)]
+    conn = util.connect_db(feedsdb)
+    assert workqueue.pending(conn, workqueue.EXTRACT) == []
+    assert conn.execute("SELECT * FROM progress").fetchall() == [("1", "a", 1)]
+    util.close_dbs()
+
+
+def test_run_skips_incomplete_backlog(tmp_path):
+    feedsdb, catalogdb = tmp_path / "feeds.db", tmp_path / "catalog.db"
+    conn = util.connect_db(feedsdb, Path("db/rss-feeds.schema"))
+    conn.execute("INSERT INTO items (rss_guid, rss_link) VALUES ('2', 'b')")
+    conn.execute("INSERT INTO html VALUES ('1', 'a', 'https://example.org/a', ?)", (blobs.put(conn, "<p>a</p>"),))
+    # Queued for extraction, but the item ('1') or its raw HTML ('2') is missing
+    conn.executemany("INSERT OR REPLACE INTO queue VALUES (?, ?, ?, 0)",
+                     [("1", "a", workqueue.EXTRACT), ("2", "b", workqueue.EXTRACT)])
+    conn.commit()
+    util.close_dbs()
+
+    stop = threading.Event()
+    thread = threading.Thread(target=pipeline.run,
+                              args=([], feedsdb, Path("db/rss-feeds.schema"), catalogdb, Path("db/rss-catalog.schema"),
+                                    symbols.compile_symbols(["AAPL"]), stop),
+                              kwargs={"extract_workers": 1})
+    thread.start()
+    conn = util.connect_db(feedsdb)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and workqueue.pending(conn, workqueue.EXTRACT) != []:
+        time.sleep(0.1)
+    stop.set()
+    thread.join()
+
+    assert workqueue.pending(conn, workqueue.EXTRACT) == []
+    assert conn.execute("SELECT rss_guid, stage FROM queue").fetchall() == [("2", workqueue.DOWNLOAD)]
+    util.close_dbs()
+
+
+def test_run_polls_items_requeued_for_extraction(tmp_path):
+    feedsdb, catalogdb = tmp_path / "feeds.db", tmp_path / "catalog.db"
+    with open("test/extract-fulltext/4investors.de-1.html") as f:
+        url = f.readline().rstrip("\n")
+        html = f.read()
+    stop = threading.Event()
+    thread = threading.Thread(target=pipeline.run,
+                              args=([], feedsdb, Path("db/rss-feeds.schema"), catalogdb, Path("db/rss-catalog.schema"),
+                                    symbols.compile_symbols(["AAPL"]), stop),
+                              kwargs={"extract_workers": 1})
+    thread.start()
+    time.sleep(1)  # the pipeline has created the databases and is running
+    conn = util.connect_db(feedsdb)
+
+    # An item queued for extraction while running, e.g. by dedup.release()
+    with util.transaction(conn):
+        conn.execute("INSERT INTO items (rss_guid, rss_link, rss_title) VALUES ('1', 'a', 'Titel')")
+        conn.execute("INSERT INTO html VALUES ('1', 'a', ?, ?)", (url, blobs.put(conn, html)))
+        workqueue.advance(conn, [("1", "a")], workqueue.EXTRACT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and conn.execute("SELECT COUNT(*) FROM progress").fetchone()[0] == 0:
+        time.sleep(0.1)
+    stop.set()
+    thread.join()
+
+    assert conn.execute("SELECT * FROM progress").fetchall() == [("1", "a", 1)]
+    assert workqueue.pending(conn, workqueue.EXTRACT) == []
+    util.close_dbs()
@@ -1,18 +1,103 @@
+import re
+from pathlib import Path
+
+import pytest
+
+from src import cassette
 from src import rss
+from src import throttle
+from src import util
+
 
 def test_rss_trace_link():
     """Test fooo."""
     # Appetizer preview
-    link = "https://www.finanznachrichten.de/nachrichten-2021-03/52172551-chart-check-itm-power-diese-marke-muss-heute-halten-124.htm"
-    dest = "https://www.deraktionaer.de/artikel/aktien/chart-check-itm-power-diese-marke-muss-heute-halten-20226666.html?feed=TRtvHrugxEKV2n-qR2P-ag"
+    link = ("https://www.finanznachrichten.de/nachrichten-2021-03/"
+            "52172551-chart-check-itm-power-diese-marke-muss-heute-halten-124.htm")
+    dest = ("https://www.deraktionaer.de/artikel/aktien/"
+            "chart-check-itm-power-diese-marke-muss-heute-halten-20226666.html?feed=TRtvHrugxEKV2n-qR2P-ag")
     assert rss.rss_trace_link(link) == dest
 
     # Direct content
-    link = "https://www.finanznachrichten.de/nachrichten-2021-03/52158803-opening-bell-tripadvisor-alibaba-bilibili-johnson-johnson-plug-paypal-fuelcell-tesla-nio-398.htm"
+    link = ("https://www.finanznachrichten.de/nachrichten-2021-03/"
+            "52158803-opening-bell-tripadvisor-alibaba-bilibili-johnson-johnson-plug-paypal-fuelcell-tesla-nio-398.htm")
     dest = link
     assert rss.rss_trace_link(link) == dest
 
     # Direct content
     link = "https://www.finanznachrichten.de/nachrichten-2021-03/52206697-curevac-neues-kursziel-aktiviert-441.htm"
     dest = "https://www.start-trading.de/2021/03/05/curevac-neues-kursziel-aktiviert/"
-    assert rss.rss_trace_link(link) == dest
\ No newline at end of file
+    assert rss.rss_trace_link(link) == dest
+
+
+def test_trace_cache():
+    import sqlite3
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute(rss.CREATE_TRACES_TABLE)
+    found = "https://www.finanznachrichten.de/nachrichten-2021-03/1-found.htm"
+    missing = "https://www.finanznachrichten.de/nachrichten-2021-03/2-missing.htm"
+    rss.cache_traces(conn, {found: "https://www.deraktionaer.de/artikel/1.html",
+                            missing: NotImplementedError("Incomplete handler")})
+    rss._trace_lru.clear()  # force lookup from database
+
+    traces = rss.cached_traces(conn, [found, missing, "https://www.finanznachrichten.de/unknown.htm"])
+    assert traces[found] == "https://www.deraktionaer.de/artikel/1.html"
+    assert isinstance(traces[missing], NotImplementedError)
+    assert len(traces) == 2
+
+    # Expired entries are ignored
+    rss._trace_lru.clear()
+    assert rss.cached_traces(conn, [found, missing], ttl=-1, negative_ttl=-1) == {}
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """Replay the pages of the offline corpus and return their links and expected destinations."""
+    conn = util.connect_db(tmp_path / "cassette.db")
+    cassette.create_cassette(conn)
+    expected = {}
+    for path in sorted(Path("test/rss-trace-link").glob("*.html")):
+        link, dest, html = path.read_text(encoding="utf-8").split("\n", 2)
+        expected[link] = dest
+        cassette.store(conn, cassette.Response(link, 200, "OK", {"Content-Type": "text/html; charset=utf-8"},
+                                               html.encode("utf-8")))
+        if dest != link:
+            news_id = re.search(r"artikelKomplettID\('0', (\d+)\)", html).group(1)
+            redirect_url = f"https://www.finanznachrichten.de/ext/nachricht-komplett-{news_id}-0.htm"
+            cassette.store(conn, cassette.Response(redirect_url, 302, "Found", {"Location": dest}, b""))
+            cassette.store(conn, cassette.Response(dest, 200, "OK", {"Content-Type": "text/html"}, b"<p>Artikel</p>"))
+    server = cassette.start_server(tmp_path / "cassette.db", port=0)
+    throttle.configure(rate=1000, burst=1000)
+    cassette.replay(f"http://127.0.0.1:{server.server_address[1]}")
+    yield expected
+    cassette.reset()
+    throttle.configure()
+    server.shutdown()
+    server.server_close()
+
+
+def test_trace_link_fast_path_matches_full_parse(corpus, caplog):
+    for link, dest in corpus.items():
+        fast = rss.trace_link(link, fetch_destination=True, fast=True)
+        full = rss.trace_link(link, fetch_destination=True, fast=False)
+        assert fast == full
+        assert fast.url == dest
+    assert "Fast path failed" not in caplog.text
+
+
+def test_download_html_reuses_traced_pages(corpus, monkeypatch):
+    get, calls = throttle.get, []
+
+    def counting_get(url, **kwargs):
+        calls.append(url)
+        return get(url, **kwargs)
+
+    monkeypatch.setattr(throttle, "get", counting_get)
+    items = [(str(ii), link) for ii, link in enumerate(corpus)]
+    results = list(rss.download_html(items, max_workers=2))
+    assert sorted(dest_url for _, _, dest_url, _, _ in results) == sorted(corpus.values())
+    assert all(html is not None and error is None for _, _, _, html, error in results)
+    # Each link is requested once; destinations are downloaded while tracing
+    assert sorted(url for url in calls if "/ext/" not in url) == sorted(corpus)
+    assert len(calls) == len(corpus) + sum(link != dest for link, dest in corpus.items())
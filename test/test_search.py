@@ -0,0 +1,48 @@
+import sqlite3
+from pathlib import Path
+
+from src import search
+from src import util
+
+
+def _catalog(tmp_path):
+    dbpath = tmp_path / "catalog.db"
+    util.create_db(dbpath, Path("db/rss-catalog.schema"))
+    conn = sqlite3.connect(str(dbpath))
+    conn.execute("INSERT INTO texts (url, date, title, description, fulltext, published) VALUES (?, ?, ?, ?, ?, ?)",
+                 ("a", "1", "Tesla-Aktie bricht ein", "", "Die Börse reagiert nervös auf Tesla.", 100))
+    conn.commit()
+    return conn
+
+
+def test_search(tmp_path):
+    conn = _catalog(tmp_path)
+    assert search.create_index(conn)  # indexes existing texts
+    assert not search.create_index(conn)
+    conn.executemany("INSERT INTO texts (url, date, title, description, fulltext, published) "
+                     "VALUES (?, ?, ?, ?, ?, ?)",
+                     [("b", "2", "Dividenden im Fokus", "Tesla zahlt keine", "Aktien mit Dividenden ...", 200),
+                      ("c", "3", "Ölpreis steigt", "", "", None)])
+    conn.commit()
+
+    assert [hit.url for hit in search.search(conn, "Tesla")] == ["a", "b"]  # title matches rank first
+    assert [hit.url for hit in search.search(conn, "Aktie")] == ["a"]
+    assert [hit.url for hit in search.search(conn, "Akti*")] == ["a", "b"]
+    assert [hit.url for hit in search.search(conn, "borse")] == ["a"]
+    assert [hit.url for hit in search.search(conn, "olpreis")] == ["c"]
+    assert [hit.url for hit in search.search(conn, "Tesla-Aktie")] == ["a"]
+    assert search.search(conn, "Tesla Dividenden")[0].snippet == "[Dividenden] im Fokus"
+    assert {hit.url for hit in search.search(conn, "title:Tesla OR Öl*", raw=True)} == {"a", "c"}
+    assert [hit.url for hit in search.search(conn, "Tesla", since=150)] == ["b"]
+    assert [(hit.url, hit.snippet) for hit in search.search(conn, "", since=50)] == [
+        ("b", "Tesla zahlt keine"), ("a", "")]
+
+    conn.execute("UPDATE texts SET title = 'Apple' WHERE url = 'c'")
+    conn.execute("DELETE FROM texts WHERE url = 'a'")
+    conn.commit()
+    assert [hit.url for hit in search.search(conn, "Tesla")] == ["b"]
+    assert [hit.url for hit in search.search(conn, "Apple")] == ["c"]
+    assert search.search(conn, "Ölpreis") == []
+    search.rebuild_index(conn)
+    assert [hit.url for hit in search.search(conn, "Apple")] == ["c"]
+    assert search.search(conn, "") == []
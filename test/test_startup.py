@@ -0,0 +1,25 @@
+import argparse
+import subprocess
+import sys
+
+from src import startup
+
+HEAVY_MODULES = ["bs4", "lxml", "pandas", "requests", "tldextract", "yaml"]
+
+
+def test_cli_does_not_import_heavy_modules():
+    code = "import sys; sys.argv = ['stockbro2.py', '--help']; import runpy\n" \
+           "try:\n    runpy.run_path('stockbro2.py', run_name='__main__')\nexcept SystemExit:\n    pass\n" \
+           f"print(sorted(set({HEAVY_MODULES!r}) & set(sys.modules)))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.splitlines()[-1] == "[]"
+
+
+def test_commands():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+    rss = subparsers.add_parser("rss").add_subparsers()
+    rss.add_parser("fetch")
+    rss.add_parser("run")
+    subparsers.add_parser("startup")
+    assert startup.commands(parser) == [[], ["rss"], ["rss", "fetch"], ["rss", "run"], ["startup"]]
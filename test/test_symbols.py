@@ -0,0 +1,39 @@
+import re
+import sqlite3
+from pathlib import Path
+
+from src import symbols
+from src import util
+
+
+def test_find_symbols():
+    automaton = symbols.compile_symbols(["AMD", "AMDOCS", "MD", "GM", "GME", "T"])
+    assert symbols.find_symbols(automaton, "AMD-Aktie steigt, $GME fällt.") == ["AMD", "GME"]
+    assert symbols.find_symbols(automaton, "AMDOCS meldet Zahlen") == ["AMDOCS"]
+    assert symbols.find_symbols(automaton, "GMX, AT&T, amd") == ["T"]
+    assert symbols.find_symbols(automaton, "") == []
+
+
+def test_find_symbols_agrees_with_regex():
+    tickers = symbols.load_symbols()
+    automaton = symbols.compile_symbols(tickers)
+    pattern = re.compile(r"(?<!\w)(" + "|".join(sorted(map(re.escape, tickers), key=len, reverse=True)) + r")(?!\w)")
+    for path in Path("test/extract-fulltext").glob("*.txt"):
+        text = path.read_text(encoding="utf-8")
+        expected = list(dict.fromkeys(pattern.findall(text)))
+        assert sorted(symbols.find_symbols(automaton, text)) == sorted(expected), path
+
+
+def test_analyze_texts(tmp_path):
+    dbpath = tmp_path / "catalog.db"
+    util.create_db(dbpath, Path("db/rss-catalog.schema"))
+    conn = sqlite3.connect(str(dbpath))
+    conn.executemany("INSERT INTO texts (url, date, title, description, fulltext) VALUES (?, ?, ?, ?, ?)",
+                     [("a", "1", "Apple (AAPL) hebt Prognose an", None, "Auch MSFT profitiert."),
+                      ("b", "2", "Keine Ticker", "", "")])
+    conn.commit()
+    automaton = symbols.compile_symbols(["AAPL", "MSFT"])
+    assert symbols.analyze_texts(conn, automaton, batchsize=1) == 2
+    assert symbols.analyze_texts(conn, automaton) == 0
+    rows = conn.execute("SELECT url, symbols_verbatim FROM analysis ORDER BY url").fetchall()
+    assert rows == [("a", "AAPL,MSFT"), ("b", "")]
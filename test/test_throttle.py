@@ -0,0 +1,61 @@
+import io
+import time
+
+import pytest
+import requests
+
+from src import throttle
+from src import util
+
+
+class FakeSession:
+    def __init__(self, statuses, headers=None):
+        self.statuses = list(statuses)
+        self.headers = headers or {}
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append(time.monotonic())
+        response = requests.Response()
+        response.url = url
+        response.status_code = self.statuses.pop(0)
+        response.headers.update(self.headers)
+        response.raw = io.BytesIO()
+        return response
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    throttle.configure()
+    yield
+    throttle.configure()
+
+
+def test_token_bucket(monkeypatch):
+    session = FakeSession([200] * 6)
+    monkeypatch.setattr(util, "http_session", lambda url: session)
+    throttle.configure(hosts={"example.com": {"rate": 20, "burst": 2}})
+    start = time.monotonic()
+    for _ in range(6):
+        assert throttle.get("https://www.example.com/").status_code == 200
+    # Two requests pass at once, the remaining four wait for a token each
+    assert time.monotonic() - start >= 4 / 20 * 0.9
+
+
+def test_retry_after(monkeypatch):
+    session = FakeSession([429, 503, 200], headers={"Retry-After": "0.1"})
+    monkeypatch.setattr(util, "http_session", lambda url: session)
+    assert throttle.get("https://example.org/").status_code == 200
+    assert len(session.calls) == 3
+    assert session.calls[1] - session.calls[0] >= 0.09
+    assert throttle._host("example.org").speed < 1
+
+    # Hosts asking for a long pause are not waited for
+    session = FakeSession([429, 200], headers={"Retry-After": str(throttle.MAX_WAIT + 10)})
+    monkeypatch.setattr(util, "http_session", lambda url: session)
+    assert throttle.get("https://example.net/").status_code == 429
+    try:
+        throttle.get("https://example.net/")
+        assert False
+    except throttle.HostBlocked:
+        pass
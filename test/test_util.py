@@ -0,0 +1,47 @@
+import sqlite3
+import threading
+
+import pytest
+
+from src import util
+
+
+def test_connect_db(tmp_path):
+    dbpath = tmp_path / "sub" / "a.db"
+    conn = util.connect_db(dbpath)
+    assert util.connect_db(str(dbpath)) is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+    # Connections are per thread
+    other = []
+    thread = threading.Thread(target=lambda: other.append(util.connect_db(dbpath)))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+    util.close_dbs()
+    assert util.connect_db(dbpath) is not conn
+    util.close_dbs()
+
+
+def test_transaction_and_write_batches(tmp_path):
+    conn = util.connect_db(tmp_path / "a.db")
+    conn.execute("CREATE TABLE t (x INTEGER PRIMARY KEY)")
+    assert util.write_batches(conn, "INSERT INTO t VALUES (?)", ((ii,) for ii in range(10)), batchsize=3) == 10
+    assert not conn.in_transaction
+
+    with pytest.raises(sqlite3.IntegrityError):
+        with util.transaction(conn):
+            conn.execute("INSERT INTO t VALUES (10)")
+            conn.execute("INSERT INTO t VALUES (0)")
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 10
+
+    # Readers see committed data while a writer holds its transaction open
+    with util.transaction(conn):
+        conn.execute("INSERT INTO t VALUES (10)")
+        reader = sqlite3.connect(str(tmp_path / "a.db"))
+        assert reader.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 10
+        reader.close()
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 11
+    util.close_dbs()
@@ -0,0 +1,70 @@
+import sqlite3
+from pathlib import Path
+
+from src import blobs
+from src import util
+from src import workqueue
+
+
+def test_queue(tmp_path):
+    conn = util.connect_db(tmp_path / "feeds.db", Path("db/rss-feeds.schema"))
+    assert workqueue.create_queue(conn) == 0
+    conn.executemany("INSERT OR IGNORE INTO items (rss_guid, rss_link) VALUES (?, ?)",
+                     [("1", "a"), ("2", "b"), ("3", "c"), ("1", "a")])
+    conn.commit()
+    assert workqueue.pending(conn, workqueue.DOWNLOAD) == [("1", "a"), ("2", "b"), ("3", "c")]
+    assert workqueue.pending(conn, workqueue.DOWNLOAD, 2) == [("1", "a"), ("2", "b")]
+
+    conn.execute("UPDATE queue SET queued_at = queued_at - 10")  # pretend items were queued a while ago
+    workqueue.requeue(conn, [("1", "a")])
+    assert workqueue.pending(conn, workqueue.DOWNLOAD) == [("2", "b"), ("3", "c"), ("1", "a")]
+
+    workqueue.advance(conn, [("2", "b"), ("3", "c")], workqueue.EXTRACT)
+    workqueue.advance(conn, [("3", "c")])
+    conn.commit()
+    assert workqueue.pending(conn, workqueue.DOWNLOAD) == [("1", "a")]
+    assert workqueue.pending(conn, workqueue.EXTRACT) == [("2", "b")]
+
+    # Selecting pending items only reads the covering index
+    plan = " ".join(row[-1] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT rss_guid, rss_link FROM queue WHERE stage = ? ORDER BY queued_at LIMIT ?",
+        (workqueue.EXTRACT, 10)))
+    assert "COVERING INDEX queue_stage" in plan and "TEMP B-TREE" not in plan
+    util.close_dbs()
+
+
+def test_create_queue_from_legacy_state(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "feeds.db"))
+    conn.execute("CREATE TABLE items (rss_guid TEXT, rss_link TEXT, PRIMARY KEY (rss_guid, rss_link))")
+    conn.execute("CREATE TABLE html (rss_guid TEXT, rss_link TEXT, dest_url TEXT, html_hash TEXT)")
+    conn.execute("CREATE TABLE progress (rss_guid TEXT, rss_link TEXT, can_delete INTEGER)")
+    conn.executemany("INSERT INTO items VALUES (?, ?)", [("1", "a"), ("2", "b"), ("3", "c")])
+    conn.executemany("INSERT INTO html VALUES (?, ?, ?, ?)", [("2", "b", "x", "h"), ("3", "c", "y", "h")])
+    conn.execute("INSERT INTO progress VALUES ('3', 'c', 1)")
+    conn.commit()
+
+    assert workqueue.create_queue(conn) == 2
+    assert workqueue.create_queue(conn) == 0
+    assert workqueue.pending(conn, workqueue.DOWNLOAD) == [("1", "a")]
+    assert workqueue.pending(conn, workqueue.EXTRACT) == [("2", "b")]
+    conn.execute("INSERT INTO items VALUES ('4', 'd')")
+    assert workqueue.pending(conn, workqueue.DOWNLOAD) == [("1", "a"), ("4", "d")]
+
+
+def test_create_queue_from_pre_blobs_schema(tmp_path):
+    # Layout of feeds databases before raw HTML was moved to the 'blobs' table
+    conn = sqlite3.connect(str(tmp_path / "feeds.db"))
+    conn.execute("CREATE TABLE items (rss_guid TEXT, rss_link TEXT, rss_pubdate TEXT, rss_title TEXT, "
+                 "rss_description TEXT, PRIMARY KEY (rss_guid, rss_link))")
+    conn.execute("CREATE TABLE html (rss_guid TEXT, rss_link TEXT, dest_url TEXT, html TEXT, "
+                 "PRIMARY KEY (rss_guid, rss_link))")
+    conn.execute("CREATE TABLE progress (rss_guid TEXT, rss_link TEXT, can_delete INTEGER, "
+                 "PRIMARY KEY (rss_guid, rss_link))")
+    conn.executemany("INSERT INTO items (rss_guid, rss_link) VALUES (?, ?)", [("1", "a"), ("2", "b")])
+    conn.execute("INSERT INTO html VALUES ('2', 'b', 'x', '<p>Artikel</p>')")
+    conn.commit()
+
+    assert blobs.migrate_html_table(conn) == 1
+    assert workqueue.create_queue(conn) == 2
+    assert workqueue.pending(conn, workqueue.DOWNLOAD) == [("1", "a")]
+    assert workqueue.pending(conn, workqueue.EXTRACT) == [("2", "b")]